@@ -2,7 +2,11 @@ __all__ = [
     "initialise",
     "link_read",
     "link_write",
+    "open_write",
     "finalise",
+    "resume_finalise",
+    "commit_output",
+    "find_memoised_outputs",
     "raise_issue_by_data_product",
     "raise_issue_by_index",
     "raise_issue_with_config",
@@ -11,11 +15,45 @@ __all__ = [
     "raise_issue_with_submission_script",
     "raise_issue_with_github_repo",
     "get_handle_index_from_path",
+    "AsyncClient",
+    "CodeRunBatch",
+    "ProvenanceGraph",
+    "initialise_async",
+    "link_read_async",
+    "link_write_async",
+    "finalise_async",
+    "raise_issue_by_data_product_async",
+    "raise_issue_by_index_async",
+    "raise_issue_with_config_async",
+    "raise_issue_by_existing_data_product_async",
+    "raise_issue_with_submission_script_async",
+    "raise_issue_with_github_repo_async",
 ]
 
+from .aio import (
+    AsyncClient,
+    finalise_async,
+    initialise_async,
+    link_read_async,
+    link_write_async,
+    raise_issue_by_data_product_async,
+    raise_issue_by_existing_data_product_async,
+    raise_issue_by_index_async,
+    raise_issue_with_config_async,
+    raise_issue_with_github_repo_async,
+    raise_issue_with_submission_script_async,
+)
+from .batch import CodeRunBatch
 from .fdp_utils import get_handle_index_from_path
-from .link import link_read, link_write
-from .pipeline import finalise, initialise
+from .link import link_read, link_write, open_write
+from .pipeline import (
+    commit_output,
+    finalise,
+    find_memoised_outputs,
+    initialise,
+    resume_finalise,
+)
+from .provenance import ProvenanceGraph
 from .raise_issue import (
     raise_issue_by_data_product,
     raise_issue_by_existing_data_product,
@@ -0,0 +1,255 @@
+import asyncio
+import functools
+from typing import Any, Callable, Optional
+
+from data_pipeline_api import fdp_utils, link, pipeline, raise_issue
+
+DEFAULT_OFFLOAD_THREADS = 32
+
+_DEFAULT_CLIENT: Optional["AsyncClient"] = None
+
+
+class AsyncClient:
+    """Calls the pipeline from asyncio by offloading it to threads.
+
+    This is a convenience for asyncio programs, not non-blocking I/O: each
+    call runs the blocking pipeline function, registry requests and file
+    hashing included, on a bounded pool of threads so that it does not
+    block the event loop. At most max_workers calls run at once, and their
+    registry requests are further limited by the request limit of each
+    registry if one is set, see fdp_utils.configure_requests. The threads
+    share the
+    keep-alive connections to the registry of every registry call in the
+    process. Each code run uses its own handle.
+
+    Args:
+        |   max_connections: (optional) maximum open connections per host,
+        |       this limit is shared by every registry call in the process
+        |       and is left as it is if not given
+        |   max_workers: (optional) maximum concurrent blocking calls
+    """
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_workers: int = DEFAULT_OFFLOAD_THREADS,
+    ) -> None:
+        if max_connections is not None:
+            fdp_utils.set_max_connections(max_connections)
+        self._executor = fdp_utils.ContextThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="fdp-async"
+        )
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Waits for running calls to finish and stops the workers."""
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self._executor.shutdown, wait=True)
+        )
+
+    async def _run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """
+        Internal function to run a blocking call on the threads
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def initialise(
+        self,
+        token: str,
+        config: str,
+        script: str,
+        deadline: Optional[float] = None,
+    ) -> dict:
+        """See pipeline.initialise"""
+        return await self._run(
+            pipeline.initialise, token, config, script, deadline
+        )
+
+    async def link_read(self, handle: dict, data_product: str) -> str:
+        """See link.link_read"""
+        return await self._run(link.link_read, handle, data_product)
+
+    async def link_write(self, handle: dict, data_product: str) -> str:
+        """See link.link_write"""
+        return await self._run(link.link_write, handle, data_product)
+
+    async def finalise(
+        self, token: str, handle: dict, deadline: Optional[float] = None
+    ) -> None:
+        """See pipeline.finalise"""
+        await self._run(pipeline.finalise, token, handle, deadline)
+
+    async def raise_issue_by_index(
+        self,
+        handle: dict,
+        index: Optional[bool],
+        issue: str,
+        severity: int,
+        group: bool = True,
+    ) -> None:
+        """See raise_issue.raise_issue_by_index"""
+        raise_issue.raise_issue_by_index(handle, index, issue, severity, group)
+
+    async def raise_issue_by_data_product(
+        self,
+        handle: dict,
+        data_product: str,
+        version: str,
+        namespace: str,
+        issue: str,
+        severity: int,
+        group: bool = True,
+    ) -> None:
+        """See raise_issue.raise_issue_by_data_product"""
+        raise_issue.raise_issue_by_data_product(
+            handle, data_product, version, namespace, issue, severity, group
+        )
+
+    async def raise_issue_by_existing_data_product(
+        self,
+        handle: dict,
+        data_product: str,
+        version: str,
+        namespace: str,
+        issue: str,
+        severity: int,
+        group: bool = True,
+    ) -> None:
+        """See raise_issue.raise_issue_by_existing_data_product"""
+        raise_issue.raise_issue_by_existing_data_product(
+            handle, data_product, version, namespace, issue, severity, group
+        )
+
+    async def raise_issue_with_config(
+        self, handle: dict, issue: str, severity: int, group: bool = True
+    ) -> None:
+        """See raise_issue.raise_issue_with_config"""
+        raise_issue.raise_issue_with_config(handle, issue, severity, group)
+
+    async def raise_issue_with_submission_script(
+        self, handle: dict, issue: str, severity: int, group: bool = True
+    ) -> None:
+        """See raise_issue.raise_issue_with_submission_script"""
+        raise_issue.raise_issue_with_submission_script(
+            handle, issue, severity, group
+        )
+
+    async def raise_issue_with_github_repo(
+        self, handle: dict, issue: str, severity: int, group: bool = True
+    ) -> None:
+        """See raise_issue.raise_issue_with_github_repo"""
+        raise_issue.raise_issue_with_github_repo(
+            handle, issue, severity, group
+        )
+
+
+def get_client() -> AsyncClient:
+    """
+    Internal function to return the client used by the module level async
+    functions, which is created on first use
+    Returns:
+        |   AsyncClient: the default client
+    """
+    global _DEFAULT_CLIENT
+    if _DEFAULT_CLIENT is None:
+        _DEFAULT_CLIENT = AsyncClient()
+    return _DEFAULT_CLIENT
+
+
+async def initialise_async(
+    token: str, config: str, script: str, deadline: Optional[float] = None
+) -> dict:
+    """Async version of initialise, see pipeline.initialise"""
+    return await get_client().initialise(token, config, script, deadline)
+
+
+async def link_read_async(handle: dict, data_product: str) -> str:
+    """Async version of link_read, see link.link_read"""
+    return await get_client().link_read(handle, data_product)
+
+
+async def link_write_async(handle: dict, data_product: str) -> str:
+    """Async version of link_write, see link.link_write"""
+    return await get_client().link_write(handle, data_product)
+
+
+async def finalise_async(
+    token: str, handle: dict, deadline: Optional[float] = None
+) -> None:
+    """Async version of finalise, see pipeline.finalise"""
+    await get_client().finalise(token, handle, deadline)
+
+
+async def raise_issue_by_index_async(
+    handle: dict,
+    index: Optional[bool],
+    issue: str,
+    severity: int,
+    group: bool = True,
+) -> None:
+    """Async version of raise_issue_by_index"""
+    await get_client().raise_issue_by_index(
+        handle, index, issue, severity, group
+    )
+
+
+async def raise_issue_by_data_product_async(
+    handle: dict,
+    data_product: str,
+    version: str,
+    namespace: str,
+    issue: str,
+    severity: int,
+    group: bool = True,
+) -> None:
+    """Async version of raise_issue_by_data_product"""
+    await get_client().raise_issue_by_data_product(
+        handle, data_product, version, namespace, issue, severity, group
+    )
+
+
+async def raise_issue_by_existing_data_product_async(
+    handle: dict,
+    data_product: str,
+    version: str,
+    namespace: str,
+    issue: str,
+    severity: int,
+    group: bool = True,
+) -> None:
+    """Async version of raise_issue_by_existing_data_product"""
+    await get_client().raise_issue_by_existing_data_product(
+        handle, data_product, version, namespace, issue, severity, group
+    )
+
+
+async def raise_issue_with_config_async(
+    handle: dict, issue: str, severity: int, group: bool = True
+) -> None:
+    """Async version of raise_issue_with_config"""
+    await get_client().raise_issue_with_config(handle, issue, severity, group)
+
+
+async def raise_issue_with_submission_script_async(
+    handle: dict, issue: str, severity: int, group: bool = True
+) -> None:
+    """Async version of raise_issue_with_submission_script"""
+    await get_client().raise_issue_with_submission_script(
+        handle, issue, severity, group
+    )
+
+
+async def raise_issue_with_github_repo_async(
+    handle: dict, issue: str, severity: int, group: bool = True
+) -> None:
+    """Async version of raise_issue_with_github_repo"""
+    await get_client().raise_issue_with_github_repo(
+        handle, issue, severity, group
+    )
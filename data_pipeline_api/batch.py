@@ -0,0 +1,206 @@
+import copy
+import logging
+import threading
+from typing import Any, List, Optional
+
+from data_pipeline_api import fdp_utils, journal, pipeline
+
+DEFAULT_COMMIT_SIZE = 100
+
+
+class CodeRunBatch:
+    """Registers many code runs which share a config and submission script,
+    e.g. the runs of a parameter sweep.
+
+    The config, submission script, code repo, author and datastore are
+    registered once for the whole batch. Each code run then only needs its
+    own code_run and outputs to be registered. Finalised code runs are
+    queued and committed to the registry commit_size at a time, with the
+    registry calls of the queued runs made concurrently. Queued code runs
+    are committed when the batch exits, even if its block raised, and any
+    which could not be are journaled to be resumed with resume_finalise.
+
+    Usage:
+        |   with CodeRunBatch(token, config, script) as batch:
+        |       for parameters in sweep:
+        |           handle = batch.initialise()
+        |           path = link_write(handle, "SEIRS_model/results")
+        |           ...
+        |           batch.finalise(handle)
+
+    Args:
+        |   token: registry token
+        |   config: Path to config file
+        |   script: Path to script file
+        |   commit_size: (optional) number of finalised code runs to commit
+        |       together, defaults to 100
+        |   max_workers: (optional) number of concurrent registry requests,
+        |       defaults to max_workers in the run_metadata
+    """
+
+    def __init__(
+        self,
+        token: str,
+        config: str,
+        script: str,
+        commit_size: int = DEFAULT_COMMIT_SIZE,
+        max_workers: Optional[int] = None,
+    ) -> None:
+        if commit_size < 1:
+            raise ValueError("commit_size must be at least 1")
+        self.token = token
+        self.commit_size = commit_size
+        self._config_yaml = pipeline._read_config(config, script)
+        self._setup = pipeline._register_setup(
+            token, self._config_yaml, config, script
+        )
+        run_metadata = self._config_yaml["run_metadata"]
+        self._executor = fdp_utils.ContextThreadPoolExecutor(
+            max_workers=max_workers or fdp_utils.get_max_workers(run_metadata),
+            thread_name_prefix="fdp-batch",
+        )
+        self._datastore_root_url: Optional[str] = None
+        self._lock = threading.Lock()
+        self._pending: List[dict] = []
+        self.committed = 0
+
+    def __enter__(self) -> "CodeRunBatch":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                # The queued code runs were complete before the block failed,
+                # its exception is raised rather than any from the commit
+                try:
+                    self.commit()
+                except Exception as err:
+                    logging.warning(
+                        "Commit of code runs failed: {}".format(err)
+                    )
+        finally:
+            self._journal_pending()
+            self._executor.shutdown()
+
+    def _journal_pending(self) -> None:
+        """
+        Internal function to journal the queued code runs which were not
+        committed, so each can be resumed with resume_finalise
+        """
+        with self._lock:
+            handles = list(self._pending)
+        for handle in handles:
+            journal_path = journal.get_journal_path(handle)
+            journal.write_handle(journal_path, handle)
+            logging.warning(
+                "Code run {} was not finalised, it can be resumed with "
+                "resume_finalise from {}".format(
+                    handle["code_run_uuid"], journal_path
+                )
+            )
+
+    def initialise(self, description: Optional[str] = None) -> dict:
+        """Registers a new code run in the batch.
+
+        Args:
+            |   description: (optional) description of the code run,
+            |       defaults to the description in the run_metadata
+
+        Returns:
+            |   dict: the handle of the code run, as returned by initialise
+        """
+        return pipeline._register_code_run(
+            self.token,
+            copy.deepcopy(self._config_yaml),
+            self._setup,
+            description,
+        )
+
+    def initialise_many(
+        self, count: int, descriptions: Optional[List[str]] = None
+    ) -> List[dict]:
+        """Registers count new code runs in the batch concurrently.
+
+        Args:
+            |   count: number of code runs
+            |   descriptions: (optional) a description for each code run
+
+        Returns:
+            |   list: the handles of the code runs
+        """
+        if descriptions is not None and len(descriptions) != count:
+            raise ValueError("A description is needed for each code run")
+        return list(
+            self._executor.map(self.initialise, descriptions or [None] * count)
+        )
+
+    def finalise(self, handle: dict) -> None:
+        """Queues a code run to be finalised, the queue is committed once
+        commit_size code runs are waiting.
+
+        Args:
+            |   handle: the handle of a code run from initialise
+        """
+        with self._lock:
+            self._pending.append(handle)
+            commit = len(self._pending) >= self.commit_size
+        if commit:
+            self.commit()
+
+    def commit(self) -> None:
+        """Finalises all queued code runs."""
+        with self._lock:
+            handles, self._pending = self._pending, []
+        if not handles:
+            return
+        if self._datastore_root_url is None:
+            self._datastore_root_url = pipeline._get_datastore_root_url(
+                self.token, handles[0]
+            )
+
+        def _finalise(handle: dict) -> None:
+            pipeline._finalise(
+                self.token, handle, self._datastore_root_url  # type: ignore
+            )
+
+        failed = []
+        for handle, error in zip(
+            handles, self._executor.map(_capture(_finalise), handles)
+        ):
+            if error is not None:
+                failed.append(handle)
+                logging.warning(
+                    "Finalise of code run {} failed: {}".format(
+                        handle["code_run_uuid"], error
+                    )
+                )
+        self.committed += len(handles) - len(failed)
+        logging.info(
+            "Committed {} code runs".format(len(handles) - len(failed))
+        )
+
+        if failed:
+            with self._lock:
+                self._pending = failed + self._pending
+            raise ValueError(
+                "{} code runs could not be finalised, they remain queued "
+                "and can be resumed with commit()".format(len(failed))
+            )
+
+
+def _capture(func: Any) -> Any:
+    """
+    Internal function to wrap func so that it returns the exception it
+    raises, or None
+    """
+
+    def _wrapper(*args: Any) -> Optional[Exception]:
+        try:
+            func(*args)
+        except Exception as err:
+            return err
+        return None
+
+    return _wrapper
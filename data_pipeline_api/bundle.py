@@ -0,0 +1,540 @@
+import argparse
+import io
+import json
+import logging
+import os
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Callable, Dict, List, Optional, Tuple
+
+from data_pipeline_api import fdp_utils, ref
+
+BUNDLE_FORMAT = 1
+BUNDLE_HEADER = "bundle.json"
+BUNDLE_ROWS = "rows.jsonl"
+BUNDLE_FILES = "files/"
+DEFAULT_BATCH_SIZE = 100
+
+# Registry tables in the order their rows must be created
+ENDPOINT_ORDER = (
+    "storage_root",
+    "file_type",
+    "namespace",
+    "author",
+    "storage_location",
+    "object",
+    "object_component",
+    "data_product",
+    "code_run",
+)
+
+# Fields which are not followed on export, they would pull in unrelated
+# code runs and users
+_NOT_FOLLOWED = {"inputs_of", "outputs_of", "updated_by", "users"}
+
+# Fields which are set by the registry and not posted on import
+_NOT_POSTED = {
+    "url",
+    "id",
+    "last_updated",
+    "updated_by",
+    "components",
+    "data_products",
+    "inputs_of",
+    "outputs_of",
+    "prov_report",
+}
+
+
+def _endpoint(url: str) -> str:
+    """
+    Internal function to return the endpoint of a registry url
+    """
+    return ref.parse(url).endpoint
+
+
+def _references(value: object, registry_url: str) -> List[str]:
+    """
+    Internal function to return the registry urls in a field of a row
+    """
+    values = value if isinstance(value, list) else [value]
+    return [
+        item
+        for item in values
+        if isinstance(item, str) and item.startswith(registry_url)
+    ]
+
+
+def _local_file(location: dict, root: dict) -> Optional[str]:
+    """
+    Internal function to return the path of a storage_location's file if
+    it is stored locally
+    """
+    if not root["root"].startswith(fdp_utils.FILE_PREFIX):
+        return None
+    directory = fdp_utils.remove_local_from_root(root["root"])
+    for path in (
+        os.path.join(directory, location["path"].lstrip("/\\")),
+        location["path"],
+    ):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def collect_rows(
+    url: str,
+    get: Callable[[str], dict],
+    max_workers: int = fdp_utils.DEFAULT_MAX_WORKERS,
+) -> Dict[str, dict]:
+    """
+    Internal function to return the rows a code_run or data_product needs,
+    following the registry urls in each row. Each level is fetched
+    concurrently.
+    Args:
+        |   url: url of the code_run or data_product
+        |   get: function returning the registry entry of a url
+        |   max_workers: (optional) number of concurrent requests
+    Returns:
+        |   dict: {url: row}
+    """
+    registry_url = ref.parse(url).registry
+    rows: Dict[str, dict] = {}
+    frontier = [url]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while frontier:
+            for row_url, row in zip(frontier, executor.map(get, frontier)):
+                rows[row_url] = row
+            found = set()
+            for row_url in frontier:
+                for field, value in rows[row_url].items():
+                    if field not in _NOT_FOLLOWED:
+                        found.update(_references(value, registry_url))
+            frontier = sorted(found - rows.keys())
+    return rows
+
+
+def export_bundle(
+    url: str,
+    path: str,
+    token: Optional[str] = None,
+    api_version: str = "1.0.0",
+    compress: bool = True,
+    max_workers: int = fdp_utils.DEFAULT_MAX_WORKERS,
+) -> dict:
+    """Writes a code_run or data_product, the registry rows it needs and
+    its local datastore files to a single bundle, which import_bundle can
+    load into another registry. The bundle is a tar file which is written
+    as a stream, files are stored once by the hash of their content.
+
+    Args:
+        |   url: url of the code_run or data_product
+        |   path: path of the bundle to write
+        |   token: (optional) registry token
+        |   api_version: (optional) registry api version
+        |   compress: (optional) gzip the bundle, defaults to True
+        |   max_workers: (optional) number of concurrent requests
+
+    Returns:
+        |   dict: number of 'rows' and 'files' in the bundle
+    """
+
+    def _get(row_url: str) -> dict:
+        return fdp_utils.get_entity_from_url(
+            row_url, token=token, api_version=api_version
+        )
+
+    rows = collect_rows(url, _get, max_workers)
+    ordered = []
+    for row_url, row in rows.items():
+        endpoint = _endpoint(row_url)
+        if endpoint not in ENDPOINT_ORDER:
+            logging.warning("Not exporting {}".format(row_url))
+            continue
+        ordered.append((ENDPOINT_ORDER.index(endpoint), row_url, row))
+    ordered.sort(key=lambda item: (item[0], ref.parse(item[1]).id))
+
+    files: Dict[str, str] = {}
+    for _, row_url, row in ordered:
+        if _endpoint(row_url) == "storage_location":
+            local_file = _local_file(row, rows[row["storage_root"]])
+            if local_file:
+                files.setdefault(row["hash"], local_file)
+
+    header = {
+        "format": BUNDLE_FORMAT,
+        "registry": ref.parse(url).registry,
+        "url": url,
+    }
+    lines = "".join(
+        json.dumps({"url": row_url, "row": row}) + "\n"
+        for _, row_url, row in ordered
+    )
+    with tarfile.open(path, "w|gz" if compress else "w|") as bundle:
+        for name, content in (
+            (BUNDLE_HEADER, json.dumps(header)),
+            (BUNDLE_ROWS, lines),
+        ):
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            bundle.addfile(info, io.BytesIO(data))
+        for file_hash, local_file in sorted(files.items()):
+            info = tarfile.TarInfo(BUNDLE_FILES + file_hash)
+            info.size = os.path.getsize(local_file)
+            with open(local_file, "rb") as stored:
+                bundle.addfile(info, stored)
+
+    logging.info(
+        "Exported {} rows and {} files to {}".format(
+            len(ordered), len(files), path
+        )
+    )
+    return {"rows": len(ordered), "files": len(files)}
+
+
+def import_bundle(
+    path: str,
+    registry_url: str,
+    datastore: str,
+    token: str,
+    api_version: str = "1.0.0",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_workers: int = fdp_utils.DEFAULT_MAX_WORKERS,
+) -> dict:
+    """Loads a bundle written by export_bundle into a registry. Files are
+    written to the local datastore unless the registry already holds data
+    with the same hash. Rows are created table by table in dependency
+    order, batch_size at a time with concurrent requests, and rows which
+    already exist are reused.
+
+    Args:
+        |   path: path of the bundle
+        |   registry_url: url of the registry to import into
+        |   datastore: path of the local datastore to write files to
+        |   token: registry token
+        |   api_version: (optional) registry api version
+        |   batch_size: (optional) number of rows to create at a time
+        |   max_workers: (optional) number of concurrent requests
+
+    Returns:
+        |   dict: 'url' of the imported code_run or data_product, the
+        |       number of 'rows', 'files_written' and 'files_skipped'
+    """
+    if registry_url[-1] != "/":
+        registry_url += "/"
+    datastore = fdp_utils.remove_local_from_root(datastore)
+    importer = _Importer(
+        registry_url, datastore, token, api_version, max_workers
+    )
+
+    with tarfile.open(path, "r|*") as bundle:
+        header: dict = {}
+        rows: List[Tuple[str, dict]] = []
+        for member in bundle:
+            if member.name == BUNDLE_HEADER:
+                header = json.load(bundle.extractfile(member))  # type: ignore
+                if header.get("format") != BUNDLE_FORMAT:
+                    raise ValueError("Unsupported bundle format")
+            elif member.name == BUNDLE_ROWS:
+                data = bundle.extractfile(member)
+                rows = [
+                    (entry["url"], entry["row"])
+                    for entry in map(json.loads, data)  # type: ignore
+                ]
+                importer.read_rows(rows)
+            elif member.name.startswith(BUNDLE_FILES):
+                importer.place_file(
+                    os.path.basename(member.name),
+                    bundle.extractfile(member),  # type: ignore
+                )
+
+    for endpoint in ENDPOINT_ORDER:
+        batch = [
+            (row_url, row)
+            for row_url, row in rows
+            if _endpoint(row_url) == endpoint
+        ]
+        for start in range(0, len(batch), batch_size):
+            end = start + batch_size
+            importer.create_rows(batch[start:end])
+
+    logging.info(
+        "Imported {} rows, wrote {} files and skipped {} files".format(
+            len(rows), importer.files_written, importer.files_skipped
+        )
+    )
+    return {
+        "url": importer.urls.get(header.get("url", "")),
+        "rows": len(rows),
+        "files_written": importer.files_written,
+        "files_skipped": importer.files_skipped,
+    }
+
+
+class _Importer:
+    """
+    Internal class holding the state of an import, the urls of the rows
+    created so far and where the files of the bundle are stored
+    """
+
+    def __init__(
+        self,
+        registry_url: str,
+        datastore: str,
+        token: str,
+        api_version: str,
+        max_workers: int,
+    ) -> None:
+        self.registry_url = registry_url
+        self.datastore = datastore
+        self.token = token
+        self.api_version = api_version
+        self.max_workers = max_workers
+        self.urls: Dict[str, str] = {}
+        self.paths: Dict[str, str] = {}
+        self.locations: Dict[str, List[str]] = {}
+        self.local_roots: set = set()
+        self.files_written = 0
+        self.files_skipped = 0
+        self.datastore_root_url = fdp_utils.post_storage_root(
+            url=registry_url,
+            data={"root": datastore, "local": True},
+            token=token,
+            api_version=api_version,
+        )["url"]
+
+    def read_rows(self, rows: List[Tuple[str, dict]]) -> None:
+        """
+        Internal function to decide where each local file will be stored
+        """
+        for row_url, row in rows:
+            if _endpoint(row_url) == "storage_root":
+                if row["root"].startswith(fdp_utils.FILE_PREFIX):
+                    self.local_roots.add(row_url)
+                    self.urls[row_url] = self.datastore_root_url
+        for row_url, row in rows:
+            if (
+                _endpoint(row_url) == "storage_location"
+                and row["storage_root"] in self.local_roots
+            ):
+                path = row["path"]
+                if os.path.isabs(path):
+                    path = "/".join(
+                        ["imported", row["hash"], os.path.basename(path)]
+                    )
+                # Paths come from the bundle, so are checked before any
+                # row is created or file is written
+                self.get_target(path)
+                self.paths[row_url] = path
+                self.locations.setdefault(row["hash"], []).append(path)
+
+    def get_target(self, path: str) -> str:
+        """
+        Internal function to return where a path of the datastore is stored
+        Raises:
+            |   ValueError: the path is outside the datastore
+        """
+        datastore = os.path.realpath(self.datastore)
+        target = os.path.realpath(os.path.join(datastore, path))
+        if os.path.commonpath([datastore, target]) != datastore:
+            raise ValueError(
+                "Bundle path {} is outside the datastore".format(path)
+            )
+        return target
+
+    def _existing_location(self, file_hash: str) -> Optional[str]:
+        """
+        Internal function to return the path of data already stored in the
+        datastore with a hash
+        """
+        existing = fdp_utils.get_entry(
+            url=self.registry_url,
+            endpoint="storage_location",
+            query={
+                "hash": file_hash,
+                "storage_root": fdp_utils.extract_id(self.datastore_root_url),
+            },
+            api_version=self.api_version,
+        )
+        for location in existing:
+            try:
+                path = self.get_target(location["path"])
+            except ValueError:
+                continue
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def place_file(self, file_hash: str, data: IO[bytes]) -> None:
+        """
+        Internal function to store a file from the bundle at each of its
+        paths, unless data with its hash is already stored
+        """
+        paths = self.locations.get(file_hash, [])
+        if not paths:
+            return
+        existing = self._existing_location(file_hash)
+        for path in dict.fromkeys(paths):
+            target = self.get_target(path)
+            if (
+                os.path.isfile(target)
+                and fdp_utils.get_data_hash(target) == file_hash
+            ):
+                self.files_skipped += 1
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if existing:
+                fdp_utils.link_or_copy(existing, target)
+                self.files_skipped += 1
+                continue
+            tmp_path = target + ".part"
+            with open(tmp_path, "wb") as stored:
+                for chunk in iter(
+                    lambda: data.read(fdp_utils.CHUNK_SIZE), b""
+                ):
+                    stored.write(chunk)
+            compression = fdp_utils.get_compression(target)
+            if fdp_utils.get_data_hash(tmp_path, compression) != file_hash:
+                os.remove(tmp_path)
+                raise ValueError(
+                    "Bundle file {} does not match its hash".format(file_hash)
+                )
+            os.replace(tmp_path, target)
+            existing = target
+            self.files_written += 1
+
+    def _remap(self, value: object) -> object:
+        """
+        Internal function to replace urls of the source registry with urls
+        of the rows created in the target registry
+        """
+        if isinstance(value, list):
+            return [self._remap(item) for item in value]
+        if isinstance(value, str):
+            return self.urls.get(value, value)
+        return value
+
+    def create_rows(self, rows: List[Tuple[str, dict]]) -> None:
+        """
+        Internal function to create a batch of rows from one table
+        concurrently
+        """
+        rows = [
+            (row_url, row) for row_url, row in rows if row_url not in self.urls
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for (row_url, _), new_url in zip(
+                rows, executor.map(self._create_row, rows)
+            ):
+                self.urls[row_url] = new_url
+
+    def _find(self, endpoint: str, query: dict) -> Optional[str]:
+        """
+        Internal function to return the url of an existing row
+        """
+        existing = fdp_utils.get_entry(
+            url=self.registry_url,
+            endpoint=endpoint,
+            query=query,
+            api_version=self.api_version,
+        )
+        return existing[0]["url"] if existing else None
+
+    def _create_row(self, item: Tuple[str, dict]) -> str:
+        """
+        Internal function to create a row, or find the existing row
+        """
+        row_url, row = item
+        endpoint = _endpoint(row_url)
+        data: dict = {
+            field: self._remap(value)
+            for field, value in row.items()
+            if field not in _NOT_POSTED and value is not None
+        }
+
+        existing = None
+        if endpoint == "storage_location" and row_url in self.paths:
+            data["path"] = self.paths[row_url]
+        elif endpoint == "object" and "storage_location" in data:
+            existing = self._find(
+                "object",
+                {
+                    "storage_location": fdp_utils.extract_id(
+                        data["storage_location"]
+                    )
+                },
+            )
+        elif endpoint == "object_component" and data.get("whole_object"):
+            existing = self._find(
+                "object_component",
+                {
+                    "object": fdp_utils.extract_id(data["object"]),
+                    "name": data["name"],
+                },
+            )
+        elif endpoint == "author":
+            existing = self._find("author", {"name": data["name"]})
+        elif endpoint == "code_run" and "uuid" in data:
+            existing = self._find("code_run", {"uuid": data["uuid"]})
+        if existing:
+            return existing
+
+        if endpoint == "storage_root":
+            data["root"] = data["root"].rstrip("/") + "/"
+        return fdp_utils.post_entry(
+            url=self.registry_url,
+            endpoint=endpoint,
+            data=data,
+            token=self.token,
+            api_version=self.api_version,
+        )["url"]
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Move code runs and data products between registries"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write a bundle")
+    export.add_argument("url", help="url of a code_run or data_product")
+    export.add_argument("bundle", help="path of the bundle to write")
+    export.add_argument("--token", help="path to the registry token")
+    export.add_argument("--no-compress", action="store_true")
+    load = commands.add_parser("import", help="load a bundle")
+    load.add_argument("bundle", help="path of the bundle")
+    load.add_argument("registry_url", help="url of the local registry")
+    load.add_argument("datastore", help="path of the local datastore")
+    load.add_argument("token", help="path to the registry token")
+    load.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    for command in (export, load):
+        command.add_argument(
+            "--workers", type=int, default=fdp_utils.DEFAULT_MAX_WORKERS
+        )
+        command.add_argument("--api-version", default="1.0.0")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        summary = export_bundle(
+            args.url,
+            args.bundle,
+            token=fdp_utils.read_token(args.token) if args.token else None,
+            api_version=args.api_version,
+            compress=not args.no_compress,
+            max_workers=args.workers,
+        )
+    else:
+        summary = import_bundle(
+            args.bundle,
+            args.registry_url,
+            args.datastore,
+            fdp_utils.read_token(args.token),
+            api_version=args.api_version,
+            batch_size=args.batch_size,
+            max_workers=args.workers,
+        )
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import json
+from typing import Any, List, Optional
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - optional dependency
+    msgspec = None  # type: ignore
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None  # type: ignore
+
+# JSON backends in order of preference
+BACKENDS = ("msgspec", "orjson", "json")
+
+_MODULES = {"msgspec": msgspec, "orjson": orjson, "json": json}
+
+
+if msgspec is not None:
+
+    class Page(msgspec.Struct):
+        """A page of the registry's response to a query, with its results
+        and the url of the next page"""
+
+        results: List[dict] = []
+        next: Optional[str] = None
+
+    _ENCODER = msgspec.json.Encoder()
+    _DECODER = msgspec.json.Decoder()
+    _PAGE_DECODER = msgspec.json.Decoder(Page)
+
+else:  # pragma: no cover - msgspec is optional
+
+    class Page:  # type: ignore
+        """A page of the registry's response to a query, with its results
+        and the url of the next page"""
+
+        __slots__ = ("results", "next")
+
+        def __init__(
+            self, results: Optional[list] = None, next: Optional[str] = None
+        ) -> None:
+            self.results = results or []
+            self.next = next
+
+
+def is_available(backend: str) -> bool:
+    """
+    Internal function to return whether a JSON backend is installed
+    """
+    return _MODULES.get(backend) is not None
+
+
+_BACKEND = next(backend for backend in BACKENDS if is_available(backend))
+
+
+def get_backend() -> str:
+    """
+    Internal function to return the JSON backend used for registry requests
+    """
+    return _BACKEND
+
+
+def set_backend(backend: Optional[str] = None) -> None:
+    """
+    Internal function to set the JSON backend used for registry requests
+    Args:
+        |   backend: (optional) 'msgspec', 'orjson' or 'json', defaults to
+        |       the first of them which is installed
+    """
+    global _BACKEND
+    if backend is None:
+        backend = next(name for name in BACKENDS if is_available(name))
+    if backend not in BACKENDS:
+        raise ValueError(
+            "JSON backend must be one of {}".format(", ".join(BACKENDS))
+        )
+    if not is_available(backend):
+        raise ImportError("JSON backend {} is not installed".format(backend))
+    _BACKEND = backend
+
+
+def dumps(data: Any) -> bytes:
+    """
+    Internal function to encode the body of a registry request
+    """
+    if _BACKEND == "msgspec":
+        return _ENCODER.encode(data)
+    if _BACKEND == "orjson":
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+
+def loads(data: bytes) -> Any:
+    """
+    Internal function to decode the body of a registry response
+    Raises:
+        |   ValueError: the body is not valid JSON
+    """
+    if _BACKEND == "msgspec":
+        return _DECODER.decode(data)
+    if _BACKEND == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def loads_page(data: bytes) -> Page:
+    """
+    Internal function to decode a page of the registry's response to a
+    query, the other fields of the page are skipped
+    Raises:
+        |   ValueError: the body is not a valid page
+    """
+    if _BACKEND == "msgspec":
+        return _PAGE_DECODER.decode(data)
+    page = loads(data)
+    if not isinstance(page, dict):
+        raise ValueError("Expected a page of results")
+    return Page(results=page.get("results") or [], next=page.get("next"))
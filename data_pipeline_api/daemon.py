@@ -0,0 +1,288 @@
+import argparse
+import functools
+import inspect
+import logging
+import os
+import socket
+import stat
+import tempfile
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Set to 0 to never delegate to a running daemon
+DAEMON_ENVIRONMENT = "FDP_DAEMON"
+# Path of the daemon's socket
+SOCKET_ENVIRONMENT = "FDP_DAEMON_SOCKET"
+
+AUTHKEY_SIZE = 32
+
+# Functions run by the daemon, by module and name
+_OPERATIONS: Dict[str, Callable] = {}
+
+_SERVING = False
+_LOCAL = threading.local()
+_LOCK = threading.Lock()
+
+# Whether this process delegates to the daemon, decided on its first call
+_RUNNING: Optional[bool] = None
+
+
+class DaemonError(RuntimeError):
+    """Raised when the daemon a process delegates to cannot be reached"""
+
+
+def get_address() -> str:
+    """
+    Internal function to return the path of the daemon's socket, set by
+    FDP_DAEMON_SOCKET, defaults to a directory of the user's in
+    XDG_RUNTIME_DIR, or the temporary directory if that is not set. The
+    socket's directory must be one only the user can access, see
+    check_directory.
+    """
+    address = os.environ.get(SOCKET_ENVIRONMENT)
+    if address:
+        return address
+    directory = "fdp_daemon_{}".format(getattr(os, "getuid", lambda: 0)())
+    return os.path.join(
+        os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(),
+        directory,
+        "daemon.sock",
+    )
+
+
+def get_authkey_path(address: str) -> str:
+    """
+    Internal function to return the path of the file holding the key the
+    daemon at address and its clients authenticate each other with
+    """
+    return address + ".key"
+
+
+def check_directory(directory: str) -> None:
+    """
+    Internal function to check the directory of the daemon's socket is
+    owned by the user and only they can access it, so no one else can
+    serve or reach a daemon there
+    Args:
+        |   directory: path of the directory
+    """
+    if not hasattr(os, "getuid"):
+        return
+    status = os.lstat(directory)
+    if (
+        not stat.S_ISDIR(status.st_mode)
+        or status.st_uid != os.getuid()
+        or stat.S_IMODE(status.st_mode) != 0o700
+    ):
+        raise DaemonError(
+            "The daemon's directory {} must be owned by the user with mode "
+            "0700".format(directory)
+        )
+
+
+def _read_authkey(address: str) -> bytes:
+    """
+    Internal function to read the key of the daemon at address
+    """
+    with open(get_authkey_path(address), "rb") as data:
+        return data.read()
+
+
+def _write_authkey(address: str) -> bytes:
+    """
+    Internal function to write a new key for the daemon at address, only
+    the user can read it
+    """
+    authkey = os.urandom(AUTHKEY_SIZE)
+    path = get_authkey_path(address)
+    tmp_path = path + ".part"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as data:
+        data.write(authkey)
+    os.replace(tmp_path, path)
+    return authkey
+
+
+def delegate(*path_arguments: str) -> Callable:
+    """
+    Internal decorator to run a public function in the daemon when one is
+    running. The arguments are sent to the daemon and dicts among them,
+    e.g. the handle, are updated in place with the daemon's changes.
+    Args:
+        |   path_arguments: names of arguments holding paths, which are
+        |       made absolute as the daemon has its own working directory
+    """
+
+    def decorator(func: Callable) -> Callable:
+        key = "{}.{}".format(func.__module__, func.__qualname__)
+        _OPERATIONS[key] = func
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            connection = _get_connection()
+            if connection is None:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            for name in path_arguments:
+                if isinstance(bound.arguments.get(name), str):
+                    bound.arguments[name] = os.path.abspath(
+                        bound.arguments[name]
+                    )
+            return _call(connection, key, bound.args, bound.kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _get_connection() -> Optional[Connection]:
+    """
+    Internal function to return the current thread's connection to the
+    daemon, or None if calls are run in this process. Whether a daemon is
+    running is checked once, so all the calls of a process are run in the
+    same place.
+    """
+    global _RUNNING
+    if _SERVING or os.environ.get(DAEMON_ENVIRONMENT) == "0":
+        return None
+    connection = getattr(_LOCAL, "connection", None)
+    if connection is not None and _LOCAL.pid == os.getpid():
+        return connection
+    if _RUNNING is False or not hasattr(socket, "AF_UNIX"):
+        return None
+    with _LOCK:
+        address = get_address()
+        try:
+            check_directory(os.path.dirname(address))
+            connection = Client(
+                address, family="AF_UNIX", authkey=_read_authkey(address)
+            )
+        except (OSError, DaemonError, AuthenticationError) as err:
+            if _RUNNING is None:
+                if not isinstance(err, OSError):
+                    logging.warning(
+                        "Not delegating to the daemon at {}: {}".format(
+                            address, err
+                        )
+                    )
+                _RUNNING = False
+                return None
+            raise DaemonError(
+                "Could not reach the daemon at {}: {}".format(address, err)
+            ) from err
+        if _RUNNING is None:
+            logging.debug("Delegating to the daemon at " + address)
+        _RUNNING = True
+    _LOCAL.connection = connection
+    _LOCAL.pid = os.getpid()
+    return connection
+
+
+def _call(connection: Connection, key: str, args: tuple, kwargs: dict) -> Any:
+    """
+    Internal function to run a function in the daemon
+    """
+    try:
+        connection.send((key, args, kwargs))
+        status, result, returned = connection.recv()
+    except (EOFError, OSError) as err:
+        _LOCAL.connection = None
+        raise DaemonError("The daemon stopped: {}".format(err)) from err
+    for arg, returned_arg in zip(args, returned):
+        if isinstance(arg, dict) and isinstance(returned_arg, dict):
+            arg.clear()
+            arg.update(returned_arg)
+    if status == "error":
+        raise result
+    return result
+
+
+def _serve_connection(connection: Connection) -> None:
+    """
+    Internal function to run the calls of one client until it disconnects
+    """
+    with connection:
+        while True:
+            try:
+                key, args, kwargs = connection.recv()
+            except (EOFError, OSError):
+                return
+            response: Tuple[str, Any] = ("ok", None)
+            try:
+                response = ("ok", _OPERATIONS[key](*args, **kwargs))
+            except Exception as err:
+                response = ("error", err)
+            try:
+                connection.send((*response, args))
+            except Exception as err:
+                connection.send(
+                    ("error", DaemonError(str(response[1] or err)), args)
+                )
+
+
+def serve(address: Optional[str] = None) -> None:
+    """Runs the daemon, which runs the public functions for the processes
+    of the user on this node until it is stopped. Its registry sessions,
+    request limits, registry mirrors and file hashes are shared by all of
+    them. The socket's directory must be one only the user can access,
+    and clients authenticate with a key kept there, readable only by the
+    user.
+
+    Args:
+        |   address: (optional) path of the socket, see get_address
+    """
+    global _SERVING
+    _SERVING = True
+    address = address or get_address()
+    os.makedirs(os.path.dirname(address), mode=0o700, exist_ok=True)
+    check_directory(os.path.dirname(address))
+    if os.path.exists(address):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(address)
+        except OSError:
+            os.remove(address)
+        else:
+            raise RuntimeError("A daemon is already running at " + address)
+        finally:
+            probe.close()
+
+    authkey = _write_authkey(address)
+    with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+        os.chmod(address, 0o600)
+        logging.info("Serving at " + address)
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, EOFError, ConnectionError) as err:
+                logging.warning("Refused a connection: {}".format(err))
+                continue
+            threading.Thread(
+                target=_serve_connection, args=(connection,), daemon=True
+            ).start()
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Run a daemon shared by the pipeline processes on a node"
+    )
+    parser.add_argument(
+        "--socket", help="path of the socket, defaults to FDP_DAEMON_SOCKET"
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    # Run as a script this module is a copy of the one the public functions
+    # are registered with
+    from data_pipeline_api import daemon
+
+    daemon.serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()
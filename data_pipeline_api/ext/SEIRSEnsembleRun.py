@@ -0,0 +1,26 @@
+import os
+import platform
+
+import data_pipeline_api as pipeline
+from data_pipeline_api.ext import seirs_ensemble
+
+token = str(os.environ.get("FDP_LOCAL_TOKEN"))
+script = os.path.join(str(os.environ.get("FDP_CONFIG_DIR")), "script.sh")
+if platform.system() == "Windows":
+    script = os.path.join(str(os.environ.get("FDP_CONFIG_DIR")), "script.bat")
+config = os.path.join(str(os.environ.get("FDP_CONFIG_DIR")), "config.yaml")
+members = int(os.environ.get("SEIRS_ENSEMBLE_MEMBERS", 1000))
+handle = pipeline.initialise(token, config, script)
+
+initial_parameters = pipeline.link_read(handle, "SEIRS_model/parameters")
+
+# Model Code
+parameters = seirs_ensemble.sample_parameters(
+    seirs_ensemble.read_parameters(initial_parameters), members, seed=0
+)
+
+seirs_ensemble.run_ensemble(
+    handle, "SEIRS_model/results/ensemble/python", parameters, 1000, 5
+)
+
+pipeline.finalise(token, handle)
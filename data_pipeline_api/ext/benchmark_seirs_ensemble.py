@@ -0,0 +1,84 @@
+import argparse
+import csv
+import os
+import tempfile
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from data_pipeline_api.ext import seirs_ensemble
+
+PARAMETERS = os.path.join(os.path.dirname(__file__), "static_params_SEIRS.csv")
+
+
+def looped(parameters: dict, members: int, timesteps: int, out: str) -> None:
+    """Runs each member as a separate single run writing its own csv, as
+    SEIRSModelRun does"""
+    for member in range(members):
+        single = {
+            parameter: float(value[member]) if np.ndim(value) else value
+            for parameter, value in parameters.items()
+        }
+        results = seirs_ensemble.seirs_single(single, timesteps)
+        path = os.path.join(out, "member_{}.csv".format(member))
+        with open(path, "w", newline="") as data:
+            writer = csv.writer(data)
+            writer.writerow(("time",) + seirs_ensemble.STATES)
+            writer.writerows(
+                zip(
+                    results["time"],
+                    *(results[state] for state in seirs_ensemble.STATES)
+                )
+            )
+
+
+def vectorised(
+    parameters: dict, members: int, timesteps: int, out: str
+) -> None:
+    """Runs all members at once writing one columnar file"""
+    results = seirs_ensemble.seirs_ensemble(parameters, timesteps)
+    path = os.path.join(out, "ensemble.npz")
+    seirs_ensemble.write_ensemble(path, results, parameters)
+
+
+def best_time(run: Callable, repeat: int, *args: object) -> float:
+    """Returns the fastest of repeat runs in seconds"""
+    times = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as out:
+            start = time.perf_counter()
+            run(*args, out)
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare the looped SEIRS example with the vectorised "
+        "ensemble runner"
+    )
+    parser.add_argument("--members", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--timesteps", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    base = seirs_ensemble.read_parameters(PARAMETERS)
+    print("members  looped (s)  vectorised (s)  speedup")
+    for members in args.members:
+        parameters = seirs_ensemble.sample_parameters(base, members, seed=0)
+        loop = best_time(
+            looped, args.repeat, parameters, members, args.timesteps
+        )
+        vector = best_time(
+            vectorised, args.repeat, parameters, members, args.timesteps
+        )
+        print(
+            "{:>7}  {:>10.3f}  {:>14.3f}  {:>6.1f}x".format(
+                members, loop, vector, loop / vector
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
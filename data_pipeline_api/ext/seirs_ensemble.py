@@ -0,0 +1,218 @@
+import csv
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+import data_pipeline_api as pipeline
+
+PARAMETERS = ("alpha", "beta", "inv_gamma", "inv_omega", "inv_mu", "inv_sigma")
+STATES = ("S", "E", "I", "R")
+INITIAL_STATE = {"S": 0.999, "E": 0.001, "I": 0.0, "R": 0.0}
+DAYS_PER_YEAR = 365.25
+
+
+def read_parameters(path: str) -> Dict[str, float]:
+    """Reads SEIRS parameters from a csv file with "param" and "value"
+    columns, e.g. static_params_SEIRS.csv
+
+    Args:
+        |   path: path of the parameter file
+
+    Returns:
+        |   dict: {parameter: value}
+    """
+    with open(path, "r", newline="") as data:
+        return {
+            row["param"]: float(row["value"]) for row in csv.DictReader(data)
+        }
+
+
+def _rates(parameters: dict) -> tuple:
+    """
+    Internal function to convert SEIRS parameters into rates per year
+    """
+    return (
+        parameters["alpha"],
+        parameters["beta"] * DAYS_PER_YEAR,
+        DAYS_PER_YEAR / parameters["inv_gamma"],
+        1 / parameters["inv_omega"],
+        1 / parameters["inv_mu"],
+        DAYS_PER_YEAR / parameters["inv_sigma"],
+    )
+
+
+def seirs_single(
+    parameters: Dict[str, float], timesteps: int = 1000, years: float = 5
+) -> Dict[str, List[float]]:
+    """Integrates the SEIRS model for a single parameter set with one
+    python loop, as in the SEIRSModelRun example
+
+    Args:
+        |   parameters: {parameter: value} for each of PARAMETERS
+        |   timesteps: (optional) number of time steps, defaults to 1000
+        |   years: (optional) length of the run in years, defaults to 5
+
+    Returns:
+        |   dict: lists of 'time' and each of STATES, of length timesteps + 1
+    """
+    alpha, beta, gamma, omega, mu, sigma = _rates(parameters)
+    dt = years / timesteps
+    s, e, i, r = (INITIAL_STATE[state] for state in STATES)
+    results: Dict[str, List[float]] = {"time": [0.0]}
+    for state in STATES:
+        results[state] = [INITIAL_STATE[state]]
+    for step in range(1, timesteps + 1):
+        n = s + e + i + r
+        infection = beta * i * s
+        s, e, i, r = (
+            s + dt * (mu * n - infection - mu * s + omega * r),
+            e + dt * (infection - (sigma + mu) * e),
+            i + dt * (sigma * e - (gamma + mu + alpha) * i),
+            r + dt * (gamma * i - omega * r - mu * r),
+        )
+        results["time"].append(step * dt)
+        for state, value in zip(STATES, (s, e, i, r)):
+            results[state].append(value)
+    return results
+
+
+def seirs_ensemble(
+    parameters: Dict[str, Union[float, np.ndarray]],
+    timesteps: int = 1000,
+    years: float = 5,
+) -> Dict[str, np.ndarray]:
+    """Integrates the SEIRS model for every member of an ensemble at once,
+    each time step updates all members with array operations
+
+    Args:
+        |   parameters: {parameter: value or array of values} for each of
+        |       PARAMETERS, arrays are one value per member and scalars are
+        |       shared by all members
+        |   timesteps: (optional) number of time steps, defaults to 1000
+        |   years: (optional) length of the run in years, defaults to 5
+
+    Returns:
+        |   dict: 'time' of shape (timesteps + 1,) and each of STATES of
+        |       shape (members, timesteps + 1)
+    """
+    values = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(parameters[p], float)) for p in PARAMETERS)
+    )
+    alpha, beta, gamma, omega, mu, sigma = _rates(
+        dict(zip(PARAMETERS, values))
+    )
+    dt = years / timesteps
+    members = values[0].shape[0]
+
+    # One row per time step so each step writes contiguous memory
+    states = np.empty((timesteps + 1, len(STATES), members))
+    states[0] = np.array([INITIAL_STATE[state] for state in STATES])[:, None]
+    for step in range(timesteps):
+        s, e, i, r = states[step]
+        n = s + e + i + r
+        infection = beta * i * s
+        s_next, e_next, i_next, r_next = states[step + 1]
+        np.add(s, dt * (mu * n - infection - mu * s + omega * r), s_next)
+        np.add(e, dt * (infection - (sigma + mu) * e), e_next)
+        np.add(i, dt * (sigma * e - (gamma + mu + alpha) * i), i_next)
+        np.add(r, dt * (gamma * i - omega * r - mu * r), r_next)
+
+    results = {"time": np.arange(timesteps + 1) * dt}
+    for index, state in enumerate(STATES):
+        results[state] = np.ascontiguousarray(states[:, index, :].T)
+    return results
+
+
+def member_names(members: int) -> List[str]:
+    """Returns the component names of the members of an ensemble
+
+    Args:
+        |   members: number of members
+
+    Returns:
+        |   list: member_0, member_1, ...
+    """
+    return ["member_" + str(member) for member in range(members)]
+
+
+def write_ensemble(
+    path: str,
+    results: Dict[str, np.ndarray],
+    parameters: Dict[str, Union[float, np.ndarray]],
+) -> None:
+    """Writes the results of seirs_ensemble to one columnar .npz file with
+    an array for the time, each state and each parameter. Row n of each
+    state and parameter array is the member component member_n.
+
+    Args:
+        |   path: path to write to, e.g. from link_write
+        |   results: results of seirs_ensemble
+        |   parameters: parameters given to seirs_ensemble
+    """
+    members = results[STATES[0]].shape[0]
+    columns: Dict[str, Any] = dict(results)
+    for parameter in PARAMETERS:
+        columns["param_" + parameter] = np.broadcast_to(
+            np.asarray(parameters[parameter], float), (members,)
+        )
+    # A file object stops numpy adding .npz to the path
+    with open(path, "wb") as data:
+        np.savez(data, **columns)
+
+
+def run_ensemble(
+    handle: dict,
+    data_product: str,
+    parameters: Dict[str, Union[float, np.ndarray]],
+    timesteps: int = 1000,
+    years: float = 5,
+) -> str:
+    """Integrates an ensemble with seirs_ensemble and writes it as a single
+    data product of the code run, with a component for each member
+
+    Args:
+        |   handle: the handle of the code run
+        |   data_product: data product to write, as in the config
+        |   parameters: parameters of the members, see seirs_ensemble
+        |   timesteps: (optional) number of time steps, defaults to 1000
+        |   years: (optional) length of the run in years, defaults to 5
+
+    Returns:
+        |   str: path the ensemble was written to
+    """
+    results = seirs_ensemble(parameters, timesteps, years)
+    members = results[STATES[0]].shape[0]
+    path = pipeline.link_write(handle, data_product, member_names(members))
+    write_ensemble(path, results, parameters)
+    return path
+
+
+def sample_parameters(
+    base: Dict[str, float],
+    members: int,
+    spread: float = 0.2,
+    vary: tuple = ("beta", "inv_gamma"),
+    seed: Optional[int] = None,
+) -> Dict[str, Union[float, np.ndarray]]:
+    """Samples an ensemble around a parameter set, the parameters in vary
+    are drawn uniformly within +/- spread of their base value
+
+    Args:
+        |   base: {parameter: value}, e.g. from read_parameters
+        |   members: number of members
+        |   spread: (optional) relative spread, defaults to 0.2
+        |   vary: (optional) parameters to vary
+        |   seed: (optional) random seed
+
+    Returns:
+        |   dict: parameters for seirs_ensemble
+    """
+    rng = np.random.default_rng(seed)
+    parameters: Dict[str, Union[float, np.ndarray]] = {
+        parameter: base[parameter] for parameter in PARAMETERS
+    }
+    for parameter in vary:
+        parameters[parameter] = base[parameter] * rng.uniform(
+            1 - spread, 1 + spread, members
+        )
+    return parameters
@@ -1,19 +1,620 @@
+import bz2
+import contextlib
+import contextvars
+import errno
+import functools
+import gzip
 import hashlib
-import json
+import io
 import logging
+import lzma
 import os
 import random
+import re
+import shutil
+import tempfile
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
-from typing import Any, Optional
+from typing import IO, Any, Callable, Iterator, Optional
 
-from urllib.parse import urlsplit
+from urllib.parse import quote, unquote, urlsplit
 
 import requests
 import yaml
 
+from data_pipeline_api import codec, limiter, ref, transport
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None  # type: ignore
+
 FILE_PREFIX = "file://"
+OFFLINE_PREFIX = "offline://"
 SERVER_RESPONSE_STR = "Server responded with: "
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+HASH_CACHE_SIZE = 4096
+QUERY_CACHE_SIZE = 4096
+HANDLE_INDEXES_CACHE_SIZE = 8
+RACY_SECONDS = 2.0
+
+# Responses to requests which can be retried, the registry is overloaded
+# or restarting
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Fields which identify an entry of each registry table, an entry which
+# conflicts with an existing one is looked up by them
+UNIQUE_KEYS = {
+    "storage_root": (("root",),),
+    "storage_location": (
+        ("path", "public", "storage_root"),
+        ("hash", "public", "storage_root"),
+    ),
+    "file_type": (("extension",),),
+    "namespace": (("name",),),
+    "data_product": (("name", "version", "namespace"),),
+    "object_component": (("object", "name"),),
+    "author": (("identifier",), ("name",)),
+    "code_run": (("uuid",),),
+    "users": (("username",),),
+    "user_author": (("user",),),
+}
+
+# ioctl request to clone a file's extents (Linux btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+DATASTORE_LAYOUTS = ("flat", "sharded")
+HASHED_FILENAME = re.compile(r"^[0-9a-f]{40}\.")
+
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "bz2": ".bz2", "lzma": ".xz"}
+_COMPRESSION_OPENERS: dict = {
+    "gzip": gzip.open,
+    "bz2": bz2.open,
+    "lzma": lzma.open,
+}
+
+_SESSION_LOCK = threading.Lock()
+_SESSION: Optional[requests.Session] = None
+_MAX_CONNECTIONS = DEFAULT_MAX_CONNECTIONS
+
+# Hashes of files by path and stat, see get_file_hash
+_HASH_CACHE_LOCK = threading.Lock()
+_HASH_CACHE: OrderedDict = OrderedDict()
+
+# Lookup tables of the most recently used handles, by the id of the handle,
+# see get_handle_indexes. Handles are dicts, which cannot be weakly
+# referenced, so each is kept with its tables to check the id is its own.
+_HANDLE_INDEXES_LOCK = threading.Lock()
+_HANDLE_INDEXES: OrderedDict = OrderedDict()
+
+# Unix domain sockets of co-located registries, by the url prefix of the
+# requests sent over them
+_REGISTRY_SOCKETS: dict = {}
+
+_RETRIES = DEFAULT_RETRIES
+_BACKOFF = DEFAULT_BACKOFF
+_TIMEOUTS: tuple = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+
+# Time by which the registry calls of the current initialise or finalise
+# must be made, see deadline()
+_DEADLINE: contextvars.ContextVar = contextvars.ContextVar(
+    "fdp_deadline", default=None
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a registry call is due after the deadline of the
+    initialise or finalise making it"""
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor which runs each task in a copy of the submitting
+    thread's context, so workers keep to the caller's deadline
+    """
+
+    def submit(self, fn: Any, /, *args: Any, **kwargs: Any) -> Future:
+        context = contextvars.copy_context()
+        return super().submit(context.run, fn, *args, **kwargs)
+
+
+# Limits on the requests in flight to each registry, by registry host
+_LIMITERS: dict = {}
+_LIMITER_SETTINGS: Optional[dict] = None
+
+# Registry GET requests in flight, by url and headers, see _get_shared
+_IN_FLIGHT_LOCK = threading.Lock()
+_IN_FLIGHT: dict = {}
+
+# Offline journals standing in for the registry, by journal id
+_OFFLINE_REGISTRIES: dict = {}
+
+# Local mirrors of registry tables, by registry url
+_REGISTRY_MIRRORS: dict = {}
+
+
+def get_session() -> requests.Session:
+    """
+    Internal function to return the session shared by all registry
+    requests, which keeps connections to the registry open between requests
+    Returns:
+        |   requests.Session: the shared session
+    """
+    if _SESSION is None:
+        set_max_connections(DEFAULT_MAX_CONNECTIONS)
+    return _SESSION  # type: ignore
+
+
+def set_max_connections(max_connections: int) -> None:
+    """
+    Internal function to limit the number of open connections to each
+    registry, requests beyond the limit wait for a free connection. The
+    limit applies to every registry request in the process, the open
+    connections are kept if it is unchanged.
+    Args:
+        |   max_connections: maximum connections per host
+    """
+    global _SESSION, _MAX_CONNECTIONS
+    if max_connections < 1:
+        raise ValueError("max_connections must be at least 1")
+    if _SESSION is not None and max_connections == _MAX_CONNECTIONS:
+        return
+    adapter = requests.adapters.HTTPAdapter(
+        pool_maxsize=max_connections, pool_block=True
+    )
+    with _SESSION_LOCK:
+        _MAX_CONNECTIONS = max_connections
+        if _SESSION is None:
+            _SESSION = requests.Session()
+        _SESSION.mount("http://", adapter)
+        _SESSION.mount("https://", adapter)
+        _SESSION.mount(
+            transport.UNIX_PREFIX,
+            transport.UnixSocketAdapter(
+                pool_maxsize=max_connections, pool_block=True
+            ),
+        )
+        for prefix, socket_path in _REGISTRY_SOCKETS.items():
+            _mount_socket(prefix, socket_path)
+
+
+def set_registry_socket(
+    registry_url: str, socket_path: Optional[str] = None
+) -> None:
+    """
+    Internal function to send the requests to a co-located registry over a
+    Unix domain socket rather than TCP. Either registry_url is the
+    registry's http url and socket_path its socket, or registry_url is an
+    http+unix url holding the quoted socket path in place of the host, e.g.
+    http+unix://%2Frun%2Fregistry.sock/api/. The registry is then addressed
+    as localhost, so the urls it returns, http://localhost/..., are sent
+    over the socket too.
+    Args:
+        |   registry_url: url of the registry
+        |   socket_path: (optional) path of the registry's socket
+    """
+    parts = urlsplit(registry_url)
+    if parts.scheme == transport.UNIX_SCHEME:
+        socket_path = unquote(parts.netloc)
+        prefix = "http://{}/".format(transport.UNIX_HOST)
+    elif socket_path is None:
+        raise ValueError("socket_path is needed for an http registry url")
+    else:
+        prefix = "{}://{}/".format(parts.scheme, parts.netloc)
+    get_session()
+    with _SESSION_LOCK:
+        _REGISTRY_SOCKETS[prefix] = socket_path
+        _mount_socket(prefix, socket_path)
+
+
+def _mount_socket(prefix: str, socket_path: str) -> None:
+    """
+    Internal function to send the requests whose url starts with prefix
+    over a Unix domain socket
+    """
+    _SESSION.mount(  # type: ignore
+        prefix,
+        transport.UnixSocketAdapter(
+            socket_path, pool_maxsize=_MAX_CONNECTIONS, pool_block=True
+        ),
+    )
+
+
+def set_retries(retries: int, backoff: float = DEFAULT_BACKOFF) -> None:
+    """
+    Internal function to set how often registry requests which failed
+    because the registry was unavailable are retried, each retry waits
+    twice as long as the last with random jitter
+    Args:
+        |   retries: number of retries, 0 to not retry
+        |   backoff: (optional) seconds to wait before the first retry
+    """
+    global _RETRIES, _BACKOFF
+    if retries < 0:
+        raise ValueError("retries must not be negative")
+    _RETRIES = retries
+    _BACKOFF = backoff
+
+
+def set_request_limits(
+    max_requests: Optional[int] = limiter.DEFAULT_MAX_REQUESTS,
+    node_max_requests: Optional[int] = None,
+    slot_directory: Optional[str] = None,
+) -> None:
+    """
+    Internal function to limit the requests in flight to each registry,
+    the limit adapts to the registry's latency and errors up to
+    max_requests, see limiter.AdaptiveLimiter. Requests are not limited
+    until this is called. The limiters, and what they have learnt, are
+    kept if the limits are unchanged.
+    Args:
+        |   max_requests: (optional) most requests in flight from this
+        |       process, defaults to 10, None for no limit
+        |   node_max_requests: (optional) most requests in flight from all
+        |       processes on the node, None for no limit
+        |   slot_directory: (optional) directory of the node's slot files,
+        |       shared by the processes on the node
+    """
+    global _LIMITER_SETTINGS
+    settings = None
+    if max_requests is not None:
+        settings = {
+            "max_requests": max_requests,
+            "node_max_requests": node_max_requests,
+            "slot_directory": slot_directory,
+        }
+    with _SESSION_LOCK:
+        if settings != _LIMITER_SETTINGS:
+            _LIMITER_SETTINGS = settings
+            _LIMITERS.clear()
+
+
+def get_limiter(url: str) -> Optional[limiter.AdaptiveLimiter]:
+    """
+    Internal function to return the limiter of the registry a url belongs
+    to, or None if requests are not limited
+    """
+    registry = urlsplit(url).netloc
+    with _SESSION_LOCK:
+        if _LIMITER_SETTINGS is None:
+            return None
+        if registry not in _LIMITERS:
+            _LIMITERS[registry] = limiter.AdaptiveLimiter(
+                registry, **_LIMITER_SETTINGS
+            )
+        return _LIMITERS[registry]
+
+
+def set_timeouts(
+    connect: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+    read: Optional[float] = DEFAULT_READ_TIMEOUT,
+) -> None:
+    """
+    Internal function to set the timeouts of registry requests
+    Args:
+        |   connect: (optional) seconds to wait for a connection, None to
+        |       wait forever, defaults to 10
+        |   read: (optional) seconds to wait for each response, None to
+        |       wait forever, defaults to 60
+    """
+    global _TIMEOUTS
+    _TIMEOUTS = (connect, read)
+
+
+def configure_requests(run_metadata: dict) -> None:
+    """
+    Internal function to apply the retries, retry_backoff, connect_timeout,
+    read_timeout, registry_max_requests, registry_node_max_requests,
+    registry_slot_directory, registry_socket and json_backend set in the
+    run_metadata to registry requests. Requests to a local_data_registry_url
+    given as an http+unix url are sent over its socket. The requests in
+    flight to a registry are only limited once one of the registry_*
+    limits is set, see set_request_limits.
+    """
+    if "retries" in run_metadata:
+        set_retries(
+            int(run_metadata["retries"]),
+            float(run_metadata.get("retry_backoff", DEFAULT_BACKOFF)),
+        )
+    if "connect_timeout" in run_metadata or "read_timeout" in run_metadata:
+        set_timeouts(
+            run_metadata.get("connect_timeout", _TIMEOUTS[0]),
+            run_metadata.get("read_timeout", _TIMEOUTS[1]),
+        )
+    if any(
+        key in run_metadata
+        for key in (
+            "registry_max_requests",
+            "registry_node_max_requests",
+            "registry_slot_directory",
+        )
+    ):
+        set_request_limits(
+            int(
+                run_metadata.get(
+                    "registry_max_requests", limiter.DEFAULT_MAX_REQUESTS
+                )
+            ),
+            run_metadata.get("registry_node_max_requests"),
+            run_metadata.get("registry_slot_directory"),
+        )
+    registry_url = run_metadata.get("local_data_registry_url", "")
+    if run_metadata.get("registry_socket") or registry_url.startswith(
+        transport.UNIX_PREFIX
+    ):
+        set_registry_socket(registry_url, run_metadata.get("registry_socket"))
+    if "json_backend" in run_metadata:
+        codec.set_backend(run_metadata["json_backend"])
+
+
+@contextlib.contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Internal function to set a deadline for the registry calls made within
+    the context, including those of workers started by a
+    ContextThreadPoolExecutor. Calls due after the deadline raise
+    DeadlineExceeded. An earlier deadline already set is kept.
+    Args:
+        |   seconds: seconds from now, None for no deadline
+    """
+    if seconds is None:
+        yield
+        return
+    expires = time.monotonic() + float(seconds)
+    if _DEADLINE.get() is not None:
+        expires = min(expires, _DEADLINE.get())
+    token = _DEADLINE.set(expires)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def get_remaining_time() -> Optional[float]:
+    """
+    Internal function to return the seconds left before the deadline, or
+    None if there is no deadline
+    """
+    expires = _DEADLINE.get()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+def check_deadline() -> None:
+    """
+    Internal function to raise DeadlineExceeded if the deadline has passed
+    """
+    remaining = get_remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("The deadline for registry calls has passed")
+
+
+def _get_timeout() -> tuple:
+    """
+    Internal function to return the connect and read timeouts of a
+    request, which end at the deadline
+    """
+    check_deadline()
+    remaining = get_remaining_time()
+    if remaining is None:
+        return _TIMEOUTS
+    return tuple(
+        remaining if timeout is None else min(timeout, remaining)
+        for timeout in _TIMEOUTS
+    )
+
+
+def _get_backoff(attempt: int, response: Any = None) -> float:
+    """
+    Internal function to return how long to wait before a retry, the
+    registry's Retry-After is respected
+    """
+    delay = min(MAX_BACKOFF, _BACKOFF * 2**attempt)
+    delay *= random.uniform(0.5, 1.0)
+    retry_after = None
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(MAX_BACKOFF, float(retry_after)))
+    return delay
+
+
+def _request(
+    method: str, url: str, idempotent: bool = True, **kwargs: Any
+) -> requests.Response:
+    """
+    Internal function to make a registry request, retrying with backoff if
+    the registry is unavailable. Requests which are not idempotent are only
+    retried if they were never sent. Requests wait for the registry's
+    limiter to let them in flight.
+    Args:
+        |   method: 'get', 'post' or 'patch'
+        |   url: url of the request
+        |   idempotent: (optional) whether the request can be repeated
+    Returns:
+        |   requests.Response: the response
+    """
+    attempt = 0
+    while True:
+        try:
+            response = _send(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            try:
+                check_deadline()
+            except DeadlineExceeded as deadline_err:
+                raise deadline_err from err
+            retry = idempotent or isinstance(err, requests.ConnectTimeout)
+            if not retry or attempt >= _RETRIES:
+                raise
+            reason = type(err).__name__
+            delay = _get_backoff(attempt)
+        else:
+            if (
+                response.status_code not in RETRY_STATUSES
+                or not idempotent
+                or attempt >= _RETRIES
+            ):
+                return response
+            reason = str(response.status_code)
+            delay = _get_backoff(attempt, response)
+        remaining = get_remaining_time()
+        if remaining is not None and delay >= remaining:
+            raise DeadlineExceeded(
+                "The deadline for registry calls passes before {} can be "
+                "retried".format(url)
+            )
+        logging.warning(
+            "Registry request failed ({}), retrying in {:.1f}s: {}".format(
+                reason, delay, url
+            )
+        )
+        time.sleep(delay)
+        attempt += 1
+
+
+def _send(method: str, url: str, **kwargs: Any) -> requests.Response:
+    """
+    Internal function to send a registry request once its limiter, if
+    requests are limited, lets it, the limiter adapts to whether the
+    registry answered
+    """
+    check_deadline()
+    request_limiter = get_limiter(url)
+    if request_limiter is None:
+        kwargs["timeout"] = _get_timeout()
+        return getattr(get_session(), method)(url, **kwargs)
+    permit = request_limiter.acquire(
+        get_remaining_time(), _get_request_kind(method, url)
+    )
+    if permit is None:
+        raise DeadlineExceeded(
+            "The deadline for registry calls passed while waiting to send "
+            "{}".format(url)
+        )
+    ok: Optional[bool] = None
+    try:
+        kwargs["timeout"] = _get_timeout()
+        response = getattr(get_session(), method)(url, **kwargs)
+        ok = response.status_code not in RETRY_STATUSES
+        return response
+    except (requests.ConnectionError, requests.Timeout):
+        ok = False
+        raise
+    finally:
+        request_limiter.release(permit, ok)
+
+
+def _get_request_kind(method: str, url: str) -> str:
+    """
+    Internal function to return the method and endpoint of a registry
+    request, e.g. "patch code_run", whose latencies are comparable
+    """
+    segments = [
+        segment
+        for segment in urlsplit(url).path.split("/")
+        if segment and not segment.isdigit()
+    ]
+    return "{} {}".format(method, segments[-1] if segments else "")
+
+
+def _get_shared(url: str, headers: dict) -> requests.Response:
+    """
+    Internal function to make a registry GET request, joining an identical
+    request which is already in flight rather than sending another. Every
+    caller gets the response of the one request, nothing is kept once it
+    is answered. Callers waiting on a request whose own caller ran out of
+    time send it again themselves.
+    Args:
+        |   url: url of the request
+        |   headers: headers of the request
+    Returns:
+        |   requests.Response: the response
+    """
+    key = (url, tuple(sorted(headers.items())))
+    while True:
+        with _IN_FLIGHT_LOCK:
+            request = _IN_FLIGHT.get(key)
+            if request is None:
+                request = _IN_FLIGHT[key] = Future()
+                break
+        check_deadline()
+        try:
+            return request.result(timeout=get_remaining_time())
+        except DeadlineExceeded:
+            continue
+        except FutureTimeoutError as err:
+            raise DeadlineExceeded(
+                "The deadline for registry calls passed while waiting for "
+                "{}".format(url)
+            ) from err
+
+    try:
+        response = _request("get", url, headers=headers)
+    except BaseException as err:
+        with _IN_FLIGHT_LOCK:
+            del _IN_FLIGHT[key]
+        request.set_exception(err)
+        raise
+    with _IN_FLIGHT_LOCK:
+        del _IN_FLIGHT[key]
+    request.set_result(response)
+    return response
+
+
+def register_offline_registry(registry: Any) -> None:
+    """
+    Internal function to route the requests to an offline registry's url to
+    its journal, see offline.OfflineRegistry
+    """
+    _OFFLINE_REGISTRIES[registry.journal_id] = registry
+
+
+def get_offline_registry(url: str) -> Optional[Any]:
+    """
+    Internal function to return the offline registry a url belongs to, or
+    None if the url is not offline
+    """
+    if not url.startswith(OFFLINE_PREFIX):
+        return None
+    return _OFFLINE_REGISTRIES.get(urlsplit(url).netloc)
+
+
+def register_registry_mirror(registry_mirror: Any) -> None:
+    """
+    Internal function to answer lookups of a registry's slowly changing
+    tables from a local mirror, see mirror.RegistryMirror
+    """
+    _REGISTRY_MIRRORS[registry_mirror.registry_url] = registry_mirror
+
+
+def get_registry_mirror(url: str, endpoint: Optional[str] = None) -> Any:
+    """
+    Internal function to return the mirror of a registry, or None if it has
+    no mirror or the mirror does not hold the endpoint
+    """
+    if not _REGISTRY_MIRRORS:
+        return None
+    if url[-1] != "/":
+        url += "/"
+    registry_mirror = _REGISTRY_MIRRORS.get(url)
+    if endpoint is not None and registry_mirror is not None:
+        if endpoint not in registry_mirror.endpoints:
+            return None
+    return registry_mirror
+
 
 def get_first_entry(entries: list) -> dict:
     """
@@ -38,11 +639,12 @@ def get_entry(
     url: str,
     endpoint: str,
     query: dict,
-    token: str = None,
+    token: Optional[str] = None,
     api_version: str = "1.0.0",
 ) -> list:
     """
-    Internal function to retreive and item from the registry using a query
+    Internal function to retreive and item from the registry using a query,
+    only the first page of items is returned, see iter_entries()
     Args:
         |   url: str of the registry url
         |   endpoint: endpoint (table)
@@ -51,28 +653,137 @@ def get_entry(
     Returns:
         |   dict: responce from registry
     """
+    offline_registry = get_offline_registry(url)
+    if offline_registry is not None:
+        return offline_registry.get_entry(endpoint, query)
+
     headers = get_headers(token=token, api_version=api_version)
 
-    # Remove api address from query
-    for key in query:
-        if isinstance(query[key], str):
-            if url in query[key]:
-                query[key] = extract_id(query[key])
-        elif isinstance(query[key], dict):
-            for _key in query[key]:
-                if url in query[key][_key]:
-                    query[key][_key] = extract_id(query[key][_key])
-        elif isinstance(query[key], list):
-            for i in range(len(query[key])):
-                if url in query[key][i]:
-                    query[key][i] = extract_id(query[key][i])
+    registry_mirror = get_registry_mirror(url, endpoint)
+    if registry_mirror is not None:
+        entries = registry_mirror.get_entry(endpoint, query)
+        if entries:
+            return entries
+
+    results = _get_page(_get_query_url(url, endpoint, query), headers).results
+    if registry_mirror is not None:
+        registry_mirror.add(endpoint, results)
+    return results
+
 
+def iter_entries(
+    url: str,
+    endpoint: str,
+    query: dict,
+    token: Optional[str] = None,
+    api_version: str = "1.0.0",
+    page_size: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    Internal function to iterate over every item matching a query, following
+    the pages of the registry's response. The next page is fetched while the
+    items of the current page are used, so at most two pages are held.
+    Args:
+        |   url: str of the registry url
+        |   endpoint: endpoint (table)
+        |   query: dict forming a query
+        |   token: (optional) str of the registry token
+        |   page_size: (optional) number of items to request per page
+    Returns:
+        |   Iterator[dict]: the items
+    """
+    offline_registry = get_offline_registry(url)
+    if offline_registry is not None:
+        yield from offline_registry.get_entry(endpoint, query)
+        return
+
+    headers = get_headers(token=token, api_version=api_version)
+    if page_size is not None:
+        query = dict(query, page_size=page_size)
+
+    page = _get_page(_get_query_url(url, endpoint, query), headers)
+    with ContextThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="fdp-pages"
+    ) as executor:
+        while True:
+            next_page = None
+            if page.next:
+                next_page = executor.submit(_get_page, page.next, headers)
+            yield from page.results
+            if next_page is None:
+                return
+            page = next_page.result()
+
+
+def get_query_string(url: str, query: dict) -> str:
+    """
+    Internal function to return the canonical query string of a query. The
+    fields are sorted, urls of the registry are replaced with their ids,
+    lists are joined with commas and the fields and values are url
+    encoded. The query itself is not changed. Equal queries give the same
+    string, so it can be used as a cache key.
+    Args:
+        |   url: str of the registry url
+        |   query: dict forming a query
+    Returns:
+        |   str: the query string
+    """
+    if url[-1] != "/":
+        url += "/"
+    return "&".join(
+        _quote_query(url, key) + "=" + _encode_query_value(url, query[key])
+        for key in sorted(query)
+    )
+
+
+def _encode_query_value(url: str, value: Any) -> str:
+    """
+    Internal function to return the url encoded value of a query field
+    """
+    if isinstance(value, (list, tuple)):
+        return ",".join(_encode_query_value(url, item) for item in value)
+    if isinstance(value, dict):
+        value = str(
+            {key: _strip_registry(url, item) for key, item in value.items()}
+        )
+    return _quote_query(url, value)
+
+
+def _strip_registry(url: str, value: Any) -> Any:
+    """
+    Internal function to replace a url of the registry with its id
+    """
+    if isinstance(value, str) and value.startswith(
+        transport.get_registry_urls(url)
+    ):
+        return extract_id(value)
+    return value
+
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE, typed=True)
+def _quote_query(url: str, value: Any) -> str:
+    """
+    Internal function to return a url encoded field or value of a query,
+    values which are encoded again are answered from a cache
+    """
+    return quote(str(_strip_registry(url, value)), safe="")
+
+
+def _get_query_url(url: str, endpoint: str, query: dict) -> str:
+    """
+    Internal function to return the url of a query of an endpoint
+    """
     if url[-1] != "/":
         url += "/"
-    url += endpoint + "/?"
-    _query = [f"{k}={v}" for k, v in query.items()]
-    url += "&".join(_query)
-    response = requests.get(url, headers=headers)
+    return url + endpoint + "/?" + get_query_string(url, query)
+
+
+def _get_page(url: str, headers: dict) -> codec.Page:
+    """
+    Internal function to return a page of the registry's response to a
+    query, with its results and the url of the next page
+    """
+    response = _get_shared(url, headers)
     if response.status_code != 200:
         raise ValueError(
             SERVER_RESPONSE_STR
@@ -80,14 +791,14 @@ def get_entry(
             + " Query = "
             + url
         )
-    return response.json()["results"]
+    return codec.loads_page(response.content)
 
 
 def get_entity(
     url: str,
     endpoint: str,
     id: int,
-    token: str = None,
+    token: Optional[str] = None,
     api_version: str = "1.0.0",
 ) -> dict:
     """
@@ -100,12 +811,22 @@ def get_entity(
     Returns:
         |   dict: responce from registry
     """
+    offline_registry = get_offline_registry(url)
+    if offline_registry is not None:
+        return offline_registry.get_entity(endpoint, id)
+
+    registry_mirror = get_registry_mirror(url, endpoint)
+    if registry_mirror is not None:
+        entity = registry_mirror.get_entity(endpoint, id)
+        if entity is not None:
+            return entity
+
     headers = get_headers(token=token, api_version=api_version)
 
     if url[-1] != "/":
         url += "/"
     url += endpoint + "/" + str(id)
-    response = requests.get(url, headers=headers)
+    response = _get_shared(url, headers)
     if response.status_code != 200:
         raise ValueError(
             SERVER_RESPONSE_STR
@@ -113,12 +834,44 @@ def get_entity(
             + " Query = "
             + url
         )
-    return response.json()
+    entity = codec.loads(response.content)
+    if registry_mirror is not None:
+        registry_mirror.add(endpoint, [entity])
+    return entity
+
+
+def get_entity_from_url(
+    url: str, token: Optional[str] = None, api_version: str = "1.0.0"
+) -> dict:
+    """
+    Internal function to get an item from the registry using its url
+    Args:
+        |   url: str of the url of the item
+        |   token: (optional) str of the registry token
+    Returns:
+        |   dict: responce from registry
+    """
+    # Entries of an offline registry have placeholder ids, e.g. ref-1
+    offline_registry = get_offline_registry(url)
+    if offline_registry is not None:
+        _, endpoint, id = url.rstrip("/").rsplit("/", 2)
+        return offline_registry.get_entity(endpoint, id)
+
+    entity_ref = ref.parse(url)
+    return get_entity(
+        url=entity_ref.registry,
+        endpoint=entity_ref.endpoint,
+        id=entity_ref.id,
+        token=token,
+        api_version=api_version,
+    )
 
 
+@functools.lru_cache(maxsize=ref.PARSE_CACHE_SIZE)
 def extract_id(url: str) -> str:
     """
-    Internal function to return the id from an api url
+    Internal function to return the id from an api url, urls which are
+    extracted again are answered from a cache
     Args:
         |   url: str of the api url
     Returns:
@@ -135,7 +888,11 @@ def post_entry(
     url: str, endpoint: str, data: dict, token: str, api_version: str = "1.0.0"
 ) -> dict:
     """
-    Internal function to post and entry on the registry
+    Internal function to post and entry on the registry. If the entry
+    conflicts with an existing one, the existing entry is looked up by the
+    endpoint's UNIQUE_KEYS and returned. Posts holding all the fields of one
+    of the endpoint's unique keys are retried if the registry is
+    unavailable, a repeated post then conflicts rather than duplicates.
     Args:
         |   url: str of the registry url
         |   enpoint: str of the endpoint (table)
@@ -144,6 +901,10 @@ def post_entry(
     Returns:
         |   dict: responce from registry
     """
+    offline_registry = get_offline_registry(url)
+    if offline_registry is not None:
+        return offline_registry.post_entry(endpoint, data)
+
     headers = get_headers(
         request_type="post", token=token, api_version=api_version
     )
@@ -151,21 +912,53 @@ def post_entry(
     if url[-1] != "/":
         url += "/"
     _url = url + endpoint + "/"
-    _data = json.dumps(data)
-
-    response = requests.post(_url, _data, headers=headers)
+    _data = codec.dumps(data)
+
+    response = _request(
+        "post",
+        _url,
+        idempotent=any(
+            all(key in data for key in keys)
+            for keys in UNIQUE_KEYS.get(endpoint, ())
+        ),
+        data=_data,
+        headers=headers,
+    )
 
     if response.status_code == 409:
         logging.info("Entry Exists: Attempting to return Existing Entry")
-        existing_entry = get_entry(url, endpoint, data)
-        if not existing_entry:
-            raise ValueError("Could not return existing Entry")
-        return existing_entry[0]
+        return _get_existing_entry(url, endpoint, data, token, api_version)
 
     if response.status_code != 201:
         raise ValueError(SERVER_RESPONSE_STR + str(response.status_code))
 
-    return response.json()
+    entry = codec.loads(response.content)
+    registry_mirror = get_registry_mirror(url, endpoint)
+    if registry_mirror is not None:
+        registry_mirror.add(endpoint, [entry])
+    return entry
+
+
+def _get_existing_entry(
+    url: str, endpoint: str, data: dict, token: str, api_version: str
+) -> dict:
+    """
+    Internal function to return the entry a post conflicted with, found by
+    the fields of the endpoint's UNIQUE_KEYS
+    """
+    for keys in UNIQUE_KEYS.get(endpoint, (tuple(data),)):
+        if not all(key in data for key in keys):
+            continue
+        existing_entry = get_entry(
+            url,
+            endpoint,
+            {key: data[key] for key in keys},
+            token=token,
+            api_version=api_version,
+        )
+        if existing_entry:
+            return existing_entry[0]
+    raise ValueError("Could not return existing Entry")
 
 
 def patch_entry(
@@ -180,21 +973,27 @@ def patch_entry(
     Returns:
         |   dict: responce from registry
     """
+    offline_registry = get_offline_registry(url)
+    if offline_registry is not None:
+        return offline_registry.patch_entry(url, data)
+
     headers = get_headers(
         request_type="post", token=token, api_version=api_version
     )
 
-    data_json = json.dumps(data)
+    data_json = codec.dumps(data)
 
-    response = requests.patch(url, data_json, headers=headers)
+    response = _request("patch", url, data=data_json, headers=headers)
     if response.status_code != 200:
         raise ValueError(SERVER_RESPONSE_STR + str(response.status_code))
 
-    return response.json()
+    return codec.loads(response.content)
 
 
 def get_headers(
-    request_type: str = "get", token: str = None, api_version: str = "1.0.0"
+    request_type: str = "get",
+    token: Optional[str] = None,
+    api_version: str = "1.0.0",
 ) -> dict:
     """
     Internal function to return headers to be added to a request
@@ -232,6 +1031,7 @@ def post_storage_root(
         data["root"] = data["root"] + "/"
     return post_entry(url, "storage_root", data, token, api_version)
 
+
 def post_file_type(
     url: str, data: dict, token: str, api_version: str = "1.0.0"
 ) -> dict:
@@ -239,18 +1039,24 @@ def post_file_type(
     Internal wrapper function to return check if a file_type already exists and return it.
     """
     if "extension" not in data:
-            if not data["extension"]:
-                raise ValueError("error file_type name not specified")
-    file_type_exists = get_entry(url= url, 
-        endpoint= "file_type", 
-        query= {"extension": data["extension"]}, 
-        api_version= api_version)
-    if file_type_exists : return file_type_exists[0]
-    return post_entry(url= url,
-        endpoint= "file_type",
-        data= data,
-        token= token,
-        api_version= api_version)
+        if not data["extension"]:
+            raise ValueError("error file_type name not specified")
+    file_type_exists = get_entry(
+        url=url,
+        endpoint="file_type",
+        query={"extension": data["extension"]},
+        api_version=api_version,
+    )
+    if file_type_exists:
+        return file_type_exists[0]
+    return post_entry(
+        url=url,
+        endpoint="file_type",
+        data=data,
+        token=token,
+        api_version=api_version,
+    )
+
 
 def remove_local_from_root(root: str) -> str:
     """
@@ -266,6 +1072,66 @@ def remove_local_from_root(root: str) -> str:
     return root
 
 
+def validate_layout(layout: Optional[str]) -> str:
+    """
+    Internal function to check a datastore layout setting from the config
+    Args:
+        |   layout: layout name 'flat' or 'sharded', or None for 'flat'
+    Returns:
+        |   str: the layout name
+    """
+    if not layout:
+        return "flat"
+    if layout not in DATASTORE_LAYOUTS:
+        raise ValueError(
+            "Unsupported datastore layout: {}, valid layouts: {}".format(
+                layout, ", ".join(DATASTORE_LAYOUTS)
+            )
+        )
+    return layout
+
+
+def get_storage_path(
+    namespace: str, data_product: str, filename: str, layout: str = "flat"
+) -> str:
+    """
+    Internal function to return the path of an output relative to the
+    datastore. The sharded layout adds two directory levels taken from the
+    start of the (hash) filename e.g. namespace/data_product/ab/cd/abcd...csv
+    Args:
+        |   namespace: namespace of the output
+        |   data_product: data product name of the output
+        |   filename: hash filename of the output
+        |   layout: (optional) 'flat' or 'sharded', defaults to 'flat'
+    Returns:
+        |   str: relative storage path using / as a separator
+    """
+    parts = [namespace, data_product]
+    if validate_layout(layout) == "sharded":
+        parts += [filename[:2], filename[2:4]]
+    parts.append(filename)
+    return "/".join(parts).replace("\\", "/")
+
+
+def reshard_path(path: str, layout: str) -> str:
+    """
+    Internal function to move a relative storage path into a given layout
+    Args:
+        |   path: relative storage path of a hash named file
+        |   layout: 'flat' or 'sharded'
+    Returns:
+        |   str: the storage path in the given layout
+    """
+    parts = path.replace("\\", "/").split("/")
+    filename = parts.pop()
+    if parts[-2:] == [filename[:2], filename[2:4]]:
+        parts = parts[:-2]
+    if validate_layout(layout) == "sharded":
+        parts += [filename[:2], filename[2:4]]
+    parts.append(filename)
+    return "/".join(parts)
+
+
 def random_hash() -> str:
     """
     Internal function to generate a random unique hash
@@ -284,19 +1150,319 @@ def get_file_hash(
     path: str,
 ) -> str:
     """
-    Internal function to return a files sha1 hash
+    Internal function to return a files sha1 hash, hashes of files which
+    have not changed since they were last hashed are reused
     Args:
         |   path: str file path
     Returns:
         |   str: sha1 hash
     """
+    stat = os.stat(path)
+    key = (
+        os.path.abspath(path),
+        stat.st_dev,
+        stat.st_ino,
+        stat.st_size,
+        stat.st_mtime_ns,
+        stat.st_ctime_ns,
+    )
+    with _HASH_CACHE_LOCK:
+        if key in _HASH_CACHE:
+            _HASH_CACHE.move_to_end(key)
+            return _HASH_CACHE[key]
+
+    hashed = hashlib.sha1()
     with open(path, "rb") as data:
-        _data = data.read()
-    hashed = hashlib.sha1(_data)
+        for chunk in iter(lambda: data.read(CHUNK_SIZE), b""):
+            hashed.update(chunk)
+
+    # A file changed within the timestamp resolution of the filesystem
+    # could change again without its stat changing
+    if time.time() - max(stat.st_mtime, stat.st_ctime) > RACY_SECONDS:
+        with _HASH_CACHE_LOCK:
+            _HASH_CACHE[key] = hashed.hexdigest()
+            while len(_HASH_CACHE) > HASH_CACHE_SIZE:
+                _HASH_CACHE.popitem(last=False)
+    return hashed.hexdigest()
+
+
+def get_data_hash(path: str, compression: Optional[str] = None) -> str:
+    """
+    Internal function to return the sha1 hash of a file's data, which for
+    compressed files is the hash of the uncompressed data
+    Args:
+        |   path: str file path
+        |   compression: (optional) compression name e.g. 'gzip', defaults
+        |       to the compression of the path's suffix
+    Returns:
+        |   str: sha1 hash
+    """
+    compression = compression or get_compression(path)
+    if not compression:
+        return get_file_hash(path)
+    hashed = hashlib.sha1()
+    with open_compressed(path, "rb", compression) as data:
+        for chunk in iter(lambda: data.read(CHUNK_SIZE), b""):
+            hashed.update(chunk)
+    return hashed.hexdigest()
+
+
+def validate_compression(compression: Optional[str]) -> Optional[str]:
+    """
+    Internal function to check a compression setting from the config
+    Args:
+        |   compression: compression name e.g. 'gzip', or None
+    Returns:
+        |   str: the compression name, or None if compression is disabled
+    """
+    if not compression:
+        return None
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(
+            "Unsupported compression: {}, valid compressions: {}".format(
+                compression, ", ".join(COMPRESSION_SUFFIXES)
+            )
+        )
+    return compression
+
+
+def get_compression(path: str) -> Optional[str]:
+    """
+    Internal function to return the compression of a file from its suffix
+    Args:
+        |   path: str file path
+    Returns:
+        |   str: compression name, or None if the file is not compressed
+    """
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def strip_compression_suffix(path: str) -> str:
+    """
+    Internal function to remove a compression suffix from a path
+    Args:
+        |   path: str file path e.g. abc.csv.gz
+    Returns:
+        |   str: the path without the compression suffix e.g. abc.csv
+    """
+    compression = get_compression(path)
+    if compression:
+        return path[: -len(COMPRESSION_SUFFIXES[compression])]
+    return path
+
+
+def open_compressed(path: str, mode: str, compression: str) -> IO:
+    """
+    Internal function to open a compressed file as a binary stream
+    Args:
+        |   path: str file path
+        |   mode: 'rb' or 'wb'
+        |   compression: compression name e.g. 'gzip'
+    Returns:
+        |   file object: binary stream of the uncompressed data
+    """
+    return _COMPRESSION_OPENERS[compression](path, mode)
+
+
+def compress_file(src: str, dst: str, compression: str) -> str:
+    """
+    Internal function to stream a file into a compressed copy
+    Args:
+        |   src: str path of the uncompressed file
+        |   dst: str path of the compressed file to create
+        |   compression: compression name e.g. 'gzip'
+    Returns:
+        |   str: sha1 hash of the uncompressed data
+    """
+    hashed = hashlib.sha1()
+    with _temporary_path(dst) as tmp_dst:
+        with open(src, "rb") as data:
+            with open_compressed(tmp_dst, "wb", compression) as compressed:
+                for chunk in iter(lambda: data.read(CHUNK_SIZE), b""):
+                    hashed.update(chunk)
+                    compressed.write(chunk)
+        shutil.copymode(src, tmp_dst)
+        os.replace(tmp_dst, dst)
 
     return hashed.hexdigest()
 
 
+def decompress_file(src: str, dst: str) -> None:
+    """
+    Internal function to stream a compressed file into an uncompressed copy
+    Args:
+        |   src: str path of the compressed file
+        |   dst: str path of the uncompressed file to create
+    """
+    compression = get_compression(src)
+    if not compression:
+        raise ValueError(f"File is not compressed: {src}")
+    with _temporary_path(dst) as tmp_dst:
+        with open_compressed(src, "rb", compression) as compressed:
+            with open(tmp_dst, "wb") as data:
+                shutil.copyfileobj(compressed, data, CHUNK_SIZE)
+        shutil.copymode(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+
+
+@contextlib.contextmanager
+def _temporary_path(dst: str) -> Iterator[str]:
+    """
+    Internal function to give a new temporary file beside dst to write it
+    in before it is moved into place, unique so that processes writing the
+    same dst at once never share one, and removed if it is not moved
+    """
+    fd, tmp_dst = tempfile.mkstemp(
+        suffix=".part",
+        prefix=os.path.basename(dst) + ".",
+        dir=os.path.dirname(dst) or None,
+    )
+    os.close(fd)
+    try:
+        yield tmp_dst
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_dst)
+
+
+def place_file(src: str, dst: str) -> str:
+    """
+    Internal function to move a file into the datastore. A rename is used
+    where possible, otherwise (e.g. from scratch space on another
+    filesystem) the file is linked or copied, see link_or_copy(), and the
+    source removed
+    Args:
+        |   src: str path of the file to move
+        |   dst: str path to move the file to
+    Returns:
+        |   str: how the file was placed: rename, reflink, hardlink or copy
+    """
+    try:
+        os.rename(src, dst)
+        return "rename"
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+    method = link_or_copy(src, dst)
+    os.remove(src)
+    return method
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    """
+    Internal function to give dst the content of src without duplicating
+    it where the filesystem allows, trying a reflink, then a hardlink,
+    then falling back to a copy
+    Args:
+        |   src: str path of the existing file
+        |   dst: str path of the file to create
+    Returns:
+        |   str: how the file was placed: reflink, hardlink or copy
+    """
+    with _temporary_path(dst) as tmp_dst:
+        if _reflink(src, tmp_dst):
+            shutil.copymode(src, tmp_dst)
+            os.replace(tmp_dst, dst)
+            return "reflink"
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+        _copy(src, tmp_dst)
+        shutil.copymode(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+    return "copy"
+
+
+def _reflink(src: str, dst: str) -> bool:
+    """
+    Internal function to clone src into a new file dst with FICLONE, so
+    both share data blocks, on filesystems that support it
+    Returns:
+        |   boolean: whether dst was created
+    """
+    if fcntl is None:
+        return False
+    with open(src, "rb") as data, open(dst, "wb") as clone:
+        try:
+            fcntl.ioctl(clone.fileno(), FICLONE, data.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(dst)
+    return False
+
+
+def _copy(src: str, dst: str) -> None:
+    """
+    Internal function to copy src to dst, in the kernel with
+    copy_file_range where available, otherwise streamed in chunks
+    """
+    with open(src, "rb") as data, open(dst, "wb") as copy:
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(
+                    data.fileno(), copy.fileno(), CHUNK_SIZE
+                ):
+                    pass
+                return
+            except OSError:
+                data.seek(0)
+                copy.seek(0)
+                copy.truncate()
+        shutil.copyfileobj(data, copy, CHUNK_SIZE)
+
+
+def remove_empty_directories(directory: str, stop: str) -> None:
+    """
+    Internal function to remove a directory and its parents while they
+    are empty, up to but not including stop
+    Args:
+        |   directory: str path of the first directory to remove
+        |   stop: str path of the directory to stop at e.g. the datastore
+    """
+    while os.path.normpath(directory) != os.path.normpath(stop):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            logging.debug(
+                "Ignoring Directory: {} as it is not empty".format(directory)
+            )
+            return
+        directory = os.path.dirname(directory)
+
+
+class HashingWriter(io.RawIOBase):
+    """
+    Internal writable stream that hashes the bytes written to it before
+    passing them on, so an output's hash is known as soon as it is closed
+    """
+
+    def __init__(self, raw: IO, on_close: Callable[[str], None]) -> None:
+        self._raw = raw
+        self._hashed = hashlib.sha1()
+        self._on_close = on_close
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self._hashed.update(data)
+        self._raw.write(data)
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self._raw.close()
+        super().close()
+        self._on_close(self._hashed.hexdigest())
+
+
 def read_token(token_path: str) -> str:
     """
     Internal function read a token from a given file
@@ -379,139 +1545,244 @@ def get_handle_index_from_path(handle: dict, path: str) -> Optional[Any]:
         |   handle: the handle containing the index
         |   path: path as generated by link_read or link_write
     """
-    tmp = None
-    if "output" in handle:
-        for output in handle["output"]:
-            if handle["output"][output]["path"] == path:
-                tmp = output
-    if "input" in handle:
-        for input in handle["input"]:
-            if handle["input"][input]["path"] == path:
-                tmp = input
-    return tmp
+    index = get_handle_indexes(handle)["path"].get(path)
+    if index is None or _get_handle_entry(handle, index)["path"] != path:
+        # The path of an input or output has changed, e.g. by open_write
+        index = get_handle_indexes(handle, rebuild=True)["path"].get(path)
+    return index
 
 
-# flake8: noqa C901
-def register_issues(token: str, handle: dict) -> dict:  # sourcery no-metrics
+def get_handle_indexes(handle: dict, rebuild: bool = False) -> dict:
+    """
+    Internal function to return lookup tables for a handle, these are
+    cached for the most recently used handles and rebuilt when reads or
+    writes are added to the config or inputs or outputs are added to the
+    handle
+    Args:
+        |   handle: the handle
+        |   rebuild: (optional) rebuild the lookup tables
+    Returns:
+        |   dict: a dictionary containing the following keys:
+        |       'read': {data_product: last read entry in the config}
+        |       'write': {data_product: last write entry in the config}
+        |       'path': {path: input or output index}
+    """
+    reads = handle["yaml"].get("read")
+    writes = handle["yaml"].get("write")
+    inputs = handle.get("input")
+    outputs = handle.get("output")
+    stamp = tuple(
+        (None, 0) if entries is None else (id(entries), len(entries))
+        for entries in (reads, writes, inputs, outputs)
+    )
+
+    with _HANDLE_INDEXES_LOCK:
+        cached = _HANDLE_INDEXES.get(id(handle))
+        if cached is not None and cached[0] is handle:
+            _HANDLE_INDEXES.move_to_end(id(handle))
+            indexes = cached[1]
+            if not rebuild and indexes["stamp"] == stamp:
+                return indexes
+
+    paths = {}
+    for entries in (outputs, inputs):
+        for index, entry in (entries or {}).items():
+            paths[entry["path"]] = index
+    indexes = {
+        "stamp": stamp,
+        "read": {read["data_product"]: read for read in reads or []},
+        "write": {write["data_product"]: write for write in writes or []},
+        "path": paths,
+    }
+    with _HANDLE_INDEXES_LOCK:
+        _HANDLE_INDEXES[id(handle)] = (handle, indexes)
+        _HANDLE_INDEXES.move_to_end(id(handle))
+        while len(_HANDLE_INDEXES) > HANDLE_INDEXES_CACHE_SIZE:
+            _HANDLE_INDEXES.popitem(last=False)
+    return indexes
+
+
+def _get_handle_entry(handle: dict, index: str) -> dict:
+    """
+    Internal function to return the input or output for a handle index
+    """
+    if index in (handle.get("input") or {}):
+        return handle["input"][index]
+    return handle["output"][index]
+
+
+def get_max_workers(run_metadata: dict) -> int:
+    """
+    Internal function to return the number of concurrent registry requests
+    to use, set by max_workers in the run_metadata
+    Args:
+        |   run_metadata: run_metadata from the config
+    Returns:
+        |   int: number of workers
+    """
+    return int(run_metadata.get("max_workers", DEFAULT_MAX_WORKERS))
+
+
+def register_issues(
+    token: str,
+    handle: dict,
+    registered: Optional[dict] = None,
+    on_register: Optional[Callable[[str, dict], None]] = None,
+) -> dict:
     """
     Internal function, should only be called from finalise.
+
+    Issues are grouped in a single pass, each object_component they refer to
+    is looked up once, and the lookups and the issue posts are made
+    concurrently. Each group is known by the key of its first issue.
+    Args:
+        |   token: registry token
+        |   handle: the handle of the code run
+        |   registered: (optional) {key: issue} of the groups registered
+        |       already, e.g. by a finalise being resumed, which are not
+        |       posted again
+        |   on_register: (optional) called with the key and the issue of
+        |       each group as it is registered, e.g. to journal it
     """
 
     api_url = handle["yaml"]["run_metadata"]["local_data_registry_url"]
-    issues = handle["issues"]
-    groups = {handle["issues"][i]["group"] for i in handle["issues"]}
     api_version = handle["yaml"]["run_metadata"]["api_version"]
+    max_workers = get_max_workers(handle["yaml"]["run_metadata"])
+
+    registered = registered or {}
+    groups: dict = {}
+    for key, issue in handle["issues"].items():
+        group = groups.setdefault(
+            issue["group"], {"key": key, "components": []}
+        )
+        group["issue"] = issue["issue"]
+        group["severity"] = issue["severity"]
+        group["components"].append(_get_issue_component_key(handle, issue))
+
+    component_keys = {
+        key for group in groups.values() for key in group["components"] if key
+    }
+    namespaces = {key[1] for key in component_keys if key[0] == "data_product"}
+
+    def _get_namespace_url(namespace: str) -> str:
+        return get_entry(
+            url=api_url,
+            endpoint="namespace",
+            query={"name": namespace},
+            api_version=api_version,
+        )[0]["url"]
+
+    def _get_component_url(key: tuple) -> str:
+        return _get_issue_component_url(
+            api_url, key, namespace_urls, api_version
+        )
 
-    for group in groups:
-        component_list = []
-        issue = None
-        severity = None
-        for i in issues:
-            if issues[i]["group"] == group:
-                issue_type = issues[i]["type"]
-                issue = issues[i]["issue"]
-                severity = issues[i]["severity"]
-                index = issues[i]["index"]
-                data_product = issues[i]["use_data_product"]
-                component = issues[i]["use_component"]
-                version = issues[i]["version"]
-                namespace = issues[i]["use_namespace"]
-
-                component_url = None
-                object_id = None
-                if issue_type == "config":
-                    object_id = handle["model_config"]
-                elif issue_type == "github_repo":
-                    object_id = handle["code_repo"]
-
-                elif issue_type == "submission_script":
-                    object_id = handle["submission_script"]
-                if object_id:
-                    component_url = get_entry(
-                        url=api_url,
-                        endpoint="object_component",
-                        query={
-                            "object": extract_id(object_id),
-                            "whole_object": True,
-                        },
-                        api_version=api_version,
-                    )[0]["url"]
-
-                if index:
-                    if "output" in handle:
-                        for ii in handle["output"]:
-                            if handle["output"][ii] == index:
-                                if (
-                                    "component_url"
-                                    in handle["output"][ii].keys()
-                                ):
-                                    component_url = handle["output"][ii][
-                                        "component_url"
-                                    ]
-                                else:
-                                    logging.warning("No Component Found")
-                    if "input" in handle:
-                        for ii in handle["input"]:
-                            if handle["input"][ii] == index:
-                                if (
-                                    "component_url"
-                                    in handle["input"][ii].keys()
-                                ):
-                                    component_url = handle["input"][ii][
-                                        "component_url"
-                                    ]
-                                else:
-                                    logging.warning("No Component Found")
-
-                if data_product:
-                    current_namespace = get_entry(
-                        url=api_url,
-                        endpoint="namespace",
-                        query={"name": namespace},
-                        api_version=api_version,
-                    )[0]["url"]
-
-                    object_entry = get_entry(
-                        url=api_url,
-                        endpoint="data_product",
-                        query={
-                            "name": data_product,
-                            "version": version,
-                            "namespace": extract_id(current_namespace),
-                        },
-                        api_version=api_version,
-                    )[0]["object"]
-                    object_id = extract_id(object_entry)
-                    if component:
-                        component_url = get_entry(
-                            url=api_url,
-                            endpoint="object_component",
-                            query={"name": component, "object": object_id},
-                            api_version=api_version,
-                        )
-                    else:
-                        component_obj = get_entry(
-                            url=api_url,
-                            endpoint="object_component",
-                            query={"object": object_id, "whole_object": True},
-                            api_version=api_version,
-                        )
-                        component_url = component_obj[0]["url"]
-
-                if component_url:
-                    component_list.append(component_url)
-
-        # Register the issue:
+    def _post_issue(group: str) -> dict:
+        key = groups[group]["key"]
+        if key in registered:
+            return registered[key]
         logging.info("Registering issue: {}".format(group))
-        current_issue = post_entry(
+        component_list = [
+            component_urls[key] for key in groups[group]["components"] if key
+        ]
+        issue = post_entry(
             url=api_url,
             endpoint="issue",
             data={
-                "severity": severity,
-                "description": issue,
-                "component_issues": component_list,
+                "severity": groups[group]["severity"],
+                "description": groups[group]["issue"],
+                "component_issues": list(dict.fromkeys(component_list)),
             },
             token=token,
             api_version=api_version,
         )
-    return current_issue
+        if on_register is not None:
+            on_register(key, issue)
+        return issue
+
+    with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+        namespace_urls = dict(
+            zip(namespaces, executor.map(_get_namespace_url, namespaces))
+        )
+        component_urls = dict(
+            zip(
+                component_keys,
+                executor.map(_get_component_url, component_keys),
+            )
+        )
+        issues = list(executor.map(_post_issue, groups))
+
+    return issues[-1] if issues else {}
+
+
+def _get_issue_component_key(handle: dict, issue: dict) -> Optional[tuple]:
+    """
+    Internal function to return a hashable key describing the
+    object_component an issue refers to, see _get_issue_component_url()
+    """
+    if issue["index"]:
+        for io_type in ("output", "input"):
+            entry = handle.get(io_type, {}).get(issue["index"])
+            if entry and entry.get("component_url"):
+                return ("url", entry["component_url"])
+        logging.warning("No Component Found")
+
+    if issue["use_data_product"]:
+        return (
+            "data_product",
+            issue["use_namespace"],
+            issue["use_data_product"],
+            issue["version"],
+            issue["use_component"],
+        )
+
+    object_url = {
+        "config": handle.get("model_config"),
+        "github_repo": handle.get("code_repo"),
+        "submission_script": handle.get("submission_script"),
+    }.get(issue["type"])
+    if object_url:
+        return ("object", object_url)
+    return None
+
+
+def _get_issue_component_url(
+    api_url: str, key: tuple, namespace_urls: dict, api_version: str
+) -> str:
+    """
+    Internal function to look up the url of the object_component described
+    by a key from _get_issue_component_key()
+    """
+    if key[0] == "url":
+        return key[1]
+
+    if key[0] == "object":
+        return get_entry(
+            url=api_url,
+            endpoint="object_component",
+            query={"object": extract_id(key[1]), "whole_object": True},
+            api_version=api_version,
+        )[0]["url"]
+
+    _, namespace, data_product, version, component = key
+    object_entry = get_entry(
+        url=api_url,
+        endpoint="data_product",
+        query={
+            "name": data_product,
+            "version": version,
+            "namespace": extract_id(namespace_urls[namespace]),
+        },
+        api_version=api_version,
+    )[0]["object"]
+    object_id = extract_id(object_entry)
+    if component:
+        query = {"name": component, "object": object_id}
+    else:
+        query = {"object": object_id, "whole_object": True}
+    return get_entry(
+        url=api_url,
+        endpoint="object_component",
+        query=query,
+        api_version=api_version,
+    )[0]["url"]
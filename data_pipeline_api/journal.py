@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+from typing import Any, Optional
+
+_JOURNAL_LOCK = threading.Lock()
+
+# Keys of the handle which are written to the journal, these are all that
+# finalise needs to resume a code run
+HANDLE_KEYS = (
+    "yaml",
+    "fdp_config_dir",
+    "model_config",
+    "submission_script",
+    "code_repo",
+    "code_run",
+    "code_run_uuid",
+    "author",
+    "input",
+    "output",
+    "issues",
+    "config_hash",
+    "script_hash",
+    "memoised",
+)
+
+
+def get_journal_path(handle: dict) -> str:
+    """
+    Internal function to return the path of the finalise journal of a code
+    run, which is kept next to coderuns.txt
+    Args:
+        |   handle: the handle of the code run
+    Returns:
+        |   str: path of the journal
+    """
+    return os.path.join(
+        handle["fdp_config_dir"],
+        "finalise_{}.journal".format(handle["code_run_uuid"]),
+    ).replace("\\", "/")
+
+
+def read_journal(path: str) -> dict:
+    """
+    Internal function to read the completed steps from a journal. A partly
+    written last line, left by a crash, is ignored.
+    Args:
+        |   path: path of the journal
+    Returns:
+        |   dict: {output key: {step: value}}, steps of the whole code run
+        |       are under the key None
+    """
+    steps: dict = {}
+    if not os.path.exists(path):
+        return steps
+    with open(path, "r") as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            steps.setdefault(entry["output"], {})[entry["step"]] = entry[
+                "value"
+            ]
+    return steps
+
+
+def write_step(
+    path: str, output: Optional[str], step: str, value: Any = True
+) -> None:
+    """
+    Internal function to append a completed step to a journal, the entry is
+    flushed to disk before returning
+    Args:
+        |   path: path of the journal
+        |   output: output key e.g. output_0, or None for the whole code run
+        |   step: name of the step e.g. hash
+        |   value: (optional) result of the step e.g. a registry url
+    """
+    entry = json.dumps(
+        {"output": output, "step": step, "value": value}, default=str
+    )
+    with _JOURNAL_LOCK, open(path, "a") as journal:
+        journal.write(entry + "\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def write_handle(path: str, handle: dict) -> None:
+    """
+    Internal function to record the handle in a journal so the code run can
+    be resumed from the journal alone, the last handle recorded is used
+    Args:
+        |   path: path of the journal
+        |   handle: the handle of the code run
+    """
+    record = {key: handle[key] for key in HANDLE_KEYS if key in handle}
+    if "issues" in record:
+        record["issues"] = {
+            key: dict(issue) for key, issue in record["issues"].items()
+        }
+    write_step(path, None, "handle", record)
+
+
+def write_output(path: str, handle: dict, output: str) -> None:
+    """
+    Internal function to record an output of the handle in a journal, so
+    an output added since the handle was recorded is resumed too without
+    recording the whole handle again
+    Args:
+        |   path: path of the journal
+        |   handle: the handle of the code run
+        |   output: output key e.g. output_0
+    """
+    write_step(path, output, "entry", handle["output"][output])
+
+
+def load_handle(path: str) -> dict:
+    """
+    Internal function to return the handle recorded in a journal, with the
+    outputs recorded since
+    Args:
+        |   path: path of the journal
+    Returns:
+        |   dict: the handle of the code run
+    """
+    steps = read_journal(path)
+    if None not in steps or "handle" not in steps[None]:
+        raise ValueError(f"No handle recorded in journal: {path}")
+    handle = steps[None]["handle"]
+    for output, output_steps in steps.items():
+        if output is not None and "entry" in output_steps:
+            handle.setdefault("output", {}).setdefault(
+                output, output_steps["entry"]
+            )
+    return handle
+
+
+def remove_journal(path: str) -> None:
+    """
+    Internal function to remove a journal once finalise has completed
+    Args:
+        |   path: path of the journal
+    """
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,219 @@
+import hashlib
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None  # type: ignore
+
+DEFAULT_MAX_REQUESTS = 10
+DEFAULT_INITIAL_REQUESTS = 4
+DEFAULT_TOLERANCE = 3.0
+DECREASE_FACTOR = 0.7
+LATENCY_WINDOW = 100
+
+# Latencies below this are never taken as a sign the registry is overloaded
+MIN_SLOW_LATENCY = 0.1
+
+SLOT_POLL_INTERVAL = 0.01
+MAX_SLOT_POLL_INTERVAL = 0.5
+
+
+def get_slot_directory() -> str:
+    """
+    Internal function to return the default directory of the slot files
+    shared by the processes on a node
+    """
+    return os.path.join(tempfile.gettempdir(), "fdp_registry_slots")
+
+
+class Permit:
+    """A request's place in flight, returned by AdaptiveLimiter.acquire"""
+
+    __slots__ = ("sent", "fd", "kind")
+
+    def __init__(self, sent: float, fd: Optional[int], kind: str) -> None:
+        self.sent = sent
+        self.fd = fd
+        self.kind = kind
+
+
+class AdaptiveLimiter:
+    """Client side limit on the requests in flight to a registry.
+
+    The limit adapts to how the registry copes. It grows by one for each
+    limit's worth of requests answered promptly, and is cut to 0.7 times
+    itself when a request fails because the registry is unavailable or
+    takes more than tolerance times the fastest recent latency of requests
+    of its kind, e.g. of the same method and endpoint, so that large
+    uploads are not judged against quick lookups. Requests
+    sent before a cut saw the old limit, so their failures do not cut it
+    again. The limit starts low, so many processes starting together do
+    not swamp the registry.
+
+    With node_max_requests the processes on a node sharing slot_directory
+    also hold one of node_max_requests slot files, locked with flock, for
+    each request in flight.
+
+    Args:
+        |   name: name of the registry, e.g. its host
+        |   max_requests: (optional) most requests in flight from this
+        |       process, defaults to 10
+        |   node_max_requests: (optional) most requests in flight from all
+        |       processes on the node, None for no limit
+        |   slot_directory: (optional) directory of the node's slot files
+        |   min_requests: (optional) least the limit is cut to
+        |   tolerance: (optional) how many times slower than the fastest
+        |       recent request of its kind a request is before the limit is
+        |       cut
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_requests: int = DEFAULT_MAX_REQUESTS,
+        node_max_requests: Optional[int] = None,
+        slot_directory: Optional[str] = None,
+        min_requests: int = 1,
+        tolerance: float = DEFAULT_TOLERANCE,
+    ) -> None:
+        if max_requests < 1 or min_requests < 1:
+            raise ValueError("max_requests must be at least 1")
+        self.name = name
+        self.max_requests = max_requests
+        self.min_requests = min(min_requests, max_requests)
+        self.tolerance = tolerance
+        self.limit = float(
+            max(self.min_requests, min(DEFAULT_INITIAL_REQUESTS, max_requests))
+        )
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        self._latencies: Dict[str, deque] = {}
+        self._decreased = 0.0
+        self._slots: List[str] = []
+        if node_max_requests:
+            if fcntl is None:
+                logging.warning(
+                    "Requests cannot be limited per node on this platform"
+                )
+            else:
+                directory = os.path.join(
+                    slot_directory or get_slot_directory(),
+                    hashlib.sha1(name.encode()).hexdigest()[:16],
+                )
+                os.makedirs(directory, exist_ok=True)
+                self._slots = [
+                    os.path.join(directory, "slot-{}.lock".format(index))
+                    for index in range(node_max_requests)
+                ]
+
+    def acquire(
+        self, timeout: Optional[float] = None, kind: str = ""
+    ) -> Optional[Permit]:
+        """
+        Internal function to wait for a request to be let in flight
+        Args:
+            |   timeout: (optional) seconds to wait, None to wait forever
+            |   kind: (optional) kind of the request, its latency is
+            |       compared with those of requests of the same kind
+        Returns:
+            |   Permit: to be released once the request is answered, or
+            |       None if the timeout passed
+        """
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                remaining = None
+                if expires is not None:
+                    remaining = expires - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                self._condition.wait(remaining)
+            self.in_flight += 1
+        fd = None
+        if self._slots:
+            fd = self._lock_slot(expires)
+            if fd is None:
+                with self._condition:
+                    self.in_flight -= 1
+                    self._condition.notify()
+                return None
+        return Permit(time.monotonic(), fd, kind)
+
+    def _lock_slot(self, expires: Optional[float]) -> Optional[int]:
+        """
+        Internal function to lock a free slot file of the node, the lock is
+        held by the returned file descriptor until it is closed
+        """
+        interval = SLOT_POLL_INTERVAL
+        while True:
+            start = random.randrange(len(self._slots))
+            for index in range(len(self._slots)):
+                path = self._slots[(start + index) % len(self._slots)]
+                fd = os.open(path, os.O_RDONLY | os.O_CREAT, 0o666)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close(fd)
+                    continue
+                return fd
+            delay = random.uniform(0, interval)
+            if expires is not None:
+                remaining = expires - time.monotonic()
+                if remaining <= 0:
+                    return None
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            interval = min(MAX_SLOT_POLL_INTERVAL, interval * 2)
+
+    def release(self, permit: Permit, ok: Optional[bool]) -> None:
+        """
+        Internal function to take an answered request out of flight and
+        adapt the limit to its outcome
+        Args:
+            |   permit: the request's permit
+            |   ok: whether the registry answered, False if it was
+            |       unavailable, None if the request was never sent
+        """
+        latency = time.monotonic() - permit.sent
+        if permit.fd is not None:
+            os.close(permit.fd)
+        with self._condition:
+            if ok is not None:
+                self._adapt(permit, latency, ok)
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _adapt(self, permit: Permit, latency: float, ok: bool) -> None:
+        """
+        Internal function to grow the limit additively after a prompt
+        answer and cut it multiplicatively after a failed or slow one
+        """
+        slow = False
+        if ok:
+            latencies = self._latencies.setdefault(
+                permit.kind, deque(maxlen=LATENCY_WINDOW)
+            )
+            slow = (
+                bool(latencies)
+                and latency > MIN_SLOW_LATENCY
+                and latency > self.tolerance * min(latencies)
+            )
+            latencies.append(latency)
+        if ok and not slow:
+            self.limit = min(self.max_requests, self.limit + 1 / self.limit)
+        elif permit.sent >= self._decreased:
+            self.limit = max(self.min_requests, self.limit * DECREASE_FACTOR)
+            self._decreased = time.monotonic()
+            logging.debug(
+                "Limiting requests to {} to {}".format(
+                    self.name, int(self.limit)
+                )
+            )
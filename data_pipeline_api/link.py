@@ -1,15 +1,23 @@
+import io
 import logging
 import os
+from typing import IO, Optional
 
-from data_pipeline_api import fdp_utils
+from data_pipeline_api import daemon, fdp_utils, pipeline, ref
 
 
-def link_write(handle: dict, data_product: str) -> str:
+@daemon.delegate()
+def link_write(
+    handle: dict, data_product: str, components: Optional[list] = None
+) -> str:
     """Reads write information in config file, updates handle with relevant
     metadata and returns path to write data product to.
 
     Args:
         |   data_product: Specified name of data product in config.
+        |   components: (optional) names of components within the file,
+        |       e.g. the members of an ensemble, to register for the
+        |       data product
 
     Returns:
         |   path: Path to write data product to.
@@ -39,6 +47,7 @@ def link_write(handle: dict, data_product: str) -> str:
     description = write["description"]
     write_namespace = run_metadata["default_output_namespace"]
     write_public = run_metadata["public"]
+    compression = fdp_utils.validate_compression(write.get("compression"))
 
     # Create filename for path
     filename = "dat-" + fdp_utils.random_hash() + "." + file_type
@@ -65,6 +74,8 @@ def link_write(handle: dict, data_product: str) -> str:
         "data_product_description": description,
         "component_description": None,
         "public": write_public,
+        "compression": compression,
+        "components": list(components) if components else None,
     }
 
     # If output exists in handle, append new metadata, otherwise create dict
@@ -78,6 +89,48 @@ def link_write(handle: dict, data_product: str) -> str:
     return path
 
 
+def open_write(handle: dict, data_product: str, mode: str = "w") -> IO:
+    """Links a data product for writing, as link_write, and returns an open
+    file object for it. If compression is set for the data product in the
+    config the data is compressed as it is written. The hash of the written
+    data is recorded when the file is closed, so finalise does not need to
+    read the file again. With auto_commit: true in the run_metadata the
+    output is committed in the background when it is closed, see
+    commit_output.
+
+    Args:
+        |   data_product: Specified name of data product in config.
+        |   mode: 'w' for text or 'wb' for binary, defaults to 'w'
+
+    Returns:
+        |   file object: Open file to write the data product to.
+    """
+    if mode not in {"w", "wb"}:
+        raise ValueError("Error: mode must be either 'w' or 'wb'")
+
+    path = link_write(handle, data_product)
+    key = "output_" + str(len(handle["output"]) - 1)
+    output_dict = handle["output"][key]
+
+    compression = output_dict["compression"]
+    if compression:
+        path += fdp_utils.COMPRESSION_SUFFIXES[compression]
+        raw = fdp_utils.open_compressed(path, "wb", compression)
+    else:
+        raw = open(path, "wb")
+    output_dict["path"] = path
+
+    def _record_hash(file_hash: str) -> None:
+        output_dict["hash"] = file_hash
+        pipeline.auto_commit_output(handle, key)
+
+    writer = io.BufferedWriter(fdp_utils.HashingWriter(raw, _record_hash))
+    if mode == "wb":
+        return writer
+    return io.TextIOWrapper(writer)
+
+
+@daemon.delegate()
 def link_read(handle: dict, data_product: str) -> str:
     """Reads 'read' information in config file, updates handle with relevant
     metadata and returns path to write data product to.
@@ -157,7 +210,7 @@ def link_read(handle: dict, data_product: str) -> str:
     object_response = fdp_utils.get_entity(
         url=registry_url,
         endpoint="object",
-        id=int(fdp_utils.extract_id(data_product_response[0]["object"])),
+        id=ref.parse(data_product_response[0]["object"]).id,
     )
 
     object_id = fdp_utils.extract_id(object_response["url"])
@@ -173,16 +226,14 @@ def link_read(handle: dict, data_product: str) -> str:
     storage_location_response = fdp_utils.get_entity(
         url=registry_url,
         endpoint="storage_location",
-        id=int(fdp_utils.extract_id(object_response["storage_location"])),
+        id=ref.parse(object_response["storage_location"]).id,
         api_version=api_version,
     )
 
     storage_root = fdp_utils.get_entity(
         url=registry_url,
         endpoint="storage_root",
-        id=int(
-            fdp_utils.extract_id(storage_location_response["storage_root"])
-        ),
+        id=ref.parse(storage_location_response["storage_root"]).id,
         api_version=api_version,
     )["root"]
     tmp_sl = storage_location_response["path"]
@@ -195,6 +246,24 @@ def link_read(handle: dict, data_product: str) -> str:
 
     # Get path of data product
     path = os.path.normpath(os.path.join(storage_root, tmp_sl))
+
+    # Decompress compressed data products into the local data store
+    if fdp_utils.get_compression(path):
+        directory = os.path.join(
+            handle["yaml"]["run_metadata"]["write_data_store"], ".decompressed"
+        )
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        decompressed_path = os.path.normpath(
+            os.path.join(
+                directory,
+                fdp_utils.strip_compression_suffix(os.path.basename(path)),
+            )
+        )
+        if not os.path.exists(decompressed_path):
+            fdp_utils.decompress_file(path, decompressed_path)
+        path = decompressed_path
+
     component = use["component"] if "component" in use else None
 
     # Write to handle and return path
@@ -206,6 +275,7 @@ def link_read(handle: dict, data_product: str) -> str:
         "use_namespace": namespace,
         "path": path,
         "component_url": component_url,
+        "hash": storage_location_response["hash"],
     }
 
     if "input" in handle:
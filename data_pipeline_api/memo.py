@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Optional
+
+from data_pipeline_api import fdp_utils, ref
+
+MEMO_DIRECTORY = ".memoised"
+
+
+def is_enabled(handle: dict) -> bool:
+    """
+    Internal function to return whether memoisation is turned on for a code
+    run, by memoise: true in the run_metadata
+    """
+    return bool(handle["yaml"]["run_metadata"].get("memoise"))
+
+
+def get_run_fingerprint(handle: dict) -> str:
+    """
+    Internal function to return the fingerprint of a code run, a hash of
+    its config, submission script, commit and the data of its inputs. Two
+    code runs with the same fingerprint produce the same outputs.
+    Args:
+        |   handle: the handle of the code run, after its inputs are linked
+    Returns:
+        |   str: the fingerprint
+    """
+    inputs = sorted(
+        [
+            entry["use_namespace"],
+            entry["use_data_product"],
+            entry["use_version"],
+            entry["use_component"],
+            entry.get("hash"),
+        ]
+        for entry in (handle.get("input") or {}).values()
+    )
+    fingerprint = {
+        "config": handle.get("config_hash"),
+        "script": handle.get("script_hash"),
+        "commit": handle["yaml"]["run_metadata"].get("latest_commit"),
+        "inputs": inputs,
+    }
+    return hashlib.sha1(
+        json.dumps(fingerprint, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def get_memo_path(handle: dict, fingerprint: str) -> str:
+    """
+    Internal function to return the path of the index entry for a
+    fingerprint, kept in the local data store
+    """
+    datastore = fdp_utils.remove_local_from_root(
+        handle["yaml"]["run_metadata"]["write_data_store"]
+    )
+    return os.path.join(
+        datastore, MEMO_DIRECTORY, fingerprint + ".json"
+    ).replace("\\", "/")
+
+
+def find_run(handle: dict) -> Optional[dict]:
+    """
+    Internal function to find a previous code run with the same fingerprint,
+    whose outputs are still in the registry and the data store
+    Returns:
+        |   dict: the index entry of the previous code run, or None
+    """
+    fingerprint = get_run_fingerprint(handle)
+    memo_path = get_memo_path(handle, fingerprint)
+    if not os.path.exists(memo_path):
+        return None
+    with open(memo_path, "r") as memo:
+        record = json.load(memo)
+
+    run_metadata = handle["yaml"]["run_metadata"]
+    for output in record["outputs"].values():
+        if not os.path.exists(output["path"]):
+            logging.info(
+                "Ignoring memoised run, {} is missing".format(output["path"])
+            )
+            return None
+        try:
+            fdp_utils.get_entity(
+                url=run_metadata["local_data_registry_url"],
+                endpoint="data_product",
+                id=ref.parse(output["data_product_url"]).id,
+                api_version=run_metadata["api_version"],
+            )
+        except ValueError:
+            logging.info(
+                "Ignoring memoised run, {} is not in the registry".format(
+                    output["data_product"]
+                )
+            )
+            return None
+    record["fingerprint"] = fingerprint
+    return record
+
+
+def record_run(handle: dict, steps: dict) -> None:
+    """
+    Internal function to add a finalised code run to the index, so later
+    code runs with the same fingerprint can reuse its outputs
+    Args:
+        |   handle: the handle of the finalised code run
+        |   steps: the finalise journal of the code run
+    """
+    # Outputs are kept by index, a data product can have several outputs
+    outputs = {}
+    for output, entry in (handle.get("output") or {}).items():
+        outputs[output] = {
+            "data_product": entry["data_product"],
+            "path": steps.get(output, {}).get("placement"),
+            "data_product_url": entry["data_product_url"],
+            "component_url": entry["component_url"],
+            "component_urls": entry.get("component_urls") or [],
+        }
+    if not outputs or not all(output["path"] for output in outputs.values()):
+        return
+
+    memo_path = get_memo_path(handle, get_run_fingerprint(handle))
+    os.makedirs(os.path.dirname(memo_path), exist_ok=True)
+    tmp_path = memo_path + "." + handle["code_run_uuid"]
+    with open(tmp_path, "w") as memo:
+        json.dump({"code_run": handle["code_run"], "outputs": outputs}, memo)
+    os.replace(tmp_path, memo_path)
@@ -0,0 +1,359 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from data_pipeline_api import fdp_utils, ref, transport
+
+# Tables which change slowly and are read by every code run
+MIRRORED_ENDPOINTS = (
+    "storage_root",
+    "file_type",
+    "namespace",
+    "users",
+    "user_author",
+    "data_product",
+)
+DEFAULT_MAX_AGE = 300
+BUSY_TIMEOUT = 30
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS entries ("
+    " endpoint TEXT, id INTEGER, data TEXT, PRIMARY KEY (endpoint, id))",
+    "CREATE TABLE IF NOT EXISTS fields ("
+    " endpoint TEXT, field TEXT, value TEXT, id INTEGER,"
+    " PRIMARY KEY (endpoint, field, value, id))",
+    "CREATE INDEX IF NOT EXISTS fields_id ON fields (endpoint, id)",
+    "CREATE TABLE IF NOT EXISTS synced ("
+    " endpoint TEXT PRIMARY KEY, synced_at REAL, last_id INTEGER,"
+    " last_updated TEXT)",
+)
+
+
+def is_enabled(run_metadata: dict) -> bool:
+    """
+    Internal function to return whether lookups are served from a local
+    mirror, set by registry_mirror: <path> in the run_metadata
+    """
+    return bool(run_metadata.get("registry_mirror"))
+
+
+def open_mirror(run_metadata: dict, token: str) -> "RegistryMirror":
+    """
+    Internal function to open the mirror of a config's registry, the
+    mirror is then used by get_entry and get_entity. Its freshness is set
+    by registry_mirror_max_age in the run_metadata, in seconds.
+    """
+    registry_url = run_metadata["local_data_registry_url"]
+    registry_mirror = fdp_utils.get_registry_mirror(registry_url)
+    if registry_mirror is None:
+        registry_mirror = RegistryMirror(
+            run_metadata["registry_mirror"],
+            registry_url,
+            max_age=run_metadata.get(
+                "registry_mirror_max_age", DEFAULT_MAX_AGE
+            ),
+            token=token,
+            api_version=run_metadata["api_version"],
+        )
+        fdp_utils.register_registry_mirror(registry_mirror)
+    return registry_mirror
+
+
+def _normalise(value: Any, registry_url: str) -> str:
+    """
+    Internal function to return the form of a field which queries are
+    matched against, registry urls are matched by their id as in get_entry
+    """
+    if isinstance(value, str) and value.startswith(
+        transport.get_registry_urls(registry_url)
+    ):
+        return fdp_utils.extract_id(value)
+    if isinstance(value, bool) or value in ("True", "False"):
+        return str(value).lower()
+    return str(value)
+
+
+class RegistryMirror:
+    """Local SQLite copy of the registry tables in MIRRORED_ENDPOINTS.
+
+    get_entry and get_entity answer lookups of these tables from the
+    mirror when it holds a match, otherwise the registry is asked and its
+    answer added to the mirror. A miss is never taken as proof an entry
+    does not exist. The mirror is synced incrementally, fetching entries
+    updated since the last sync, once it is older than max_age. Many
+    processes can share one mirror, it is opened in WAL mode and only one
+    of them syncs at a time.
+
+    Args:
+        |   path: path of the SQLite database
+        |   registry_url: url of the registry to mirror
+        |   max_age: (optional) seconds before the mirror is synced again,
+        |       None to only sync with sync(), defaults to 300
+        |   token: (optional) registry token
+        |   api_version: (optional) registry api version
+    """
+
+    def __init__(
+        self,
+        path: str,
+        registry_url: str,
+        max_age: Optional[float] = DEFAULT_MAX_AGE,
+        token: Optional[str] = None,
+        api_version: str = "1.0.0",
+    ) -> None:
+        if registry_url[-1] != "/":
+            registry_url += "/"
+        self.path = path
+        self.registry_url = registry_url
+        self.max_age = max_age
+        self.token = token
+        self.api_version = api_version
+        self.endpoints = MIRRORED_ENDPOINTS
+        self._local = threading.local()
+        self._fresh_until: Dict[str, float] = {}
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Internal function to return the connection of the current thread
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get_entry(self, endpoint: str, query: dict) -> list:
+        """
+        Internal function to return the mirrored entries matching a query,
+        see fdp_utils.get_entry
+        """
+        if any("__" in key for key in query):
+            return []
+        self.refresh(endpoint)
+        sql = "SELECT data FROM entries WHERE endpoint = ?"
+        parameters: List[Any] = [endpoint]
+        for key, value in query.items():
+            sql += (
+                " AND id IN (SELECT id FROM fields WHERE endpoint = ?"
+                " AND field = ? AND value = ?)"
+            )
+            parameters += [
+                endpoint,
+                key,
+                _normalise(value, self.registry_url),
+            ]
+        sql += " ORDER BY id"
+        rows = self._connect().execute(sql, parameters).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_entity(self, endpoint: str, id: Any) -> Optional[dict]:
+        """
+        Internal function to return a mirrored entry by its id, or None
+        """
+        self.refresh(endpoint)
+        row = (
+            self._connect()
+            .execute(
+                "SELECT data FROM entries WHERE endpoint = ? AND id = ?",
+                (endpoint, int(id)),
+            )
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def add(self, endpoint: str, entries: Iterable[dict]) -> None:
+        """
+        Internal function to add or update entries read from the registry
+        """
+        connection = self._connect()
+        with connection:
+            self._add(connection, endpoint, entries)
+
+    def _add(
+        self,
+        connection: sqlite3.Connection,
+        endpoint: str,
+        entries: Iterable[dict],
+    ) -> Tuple[int, Optional[str]]:
+        """
+        Internal function to write entries in the current transaction
+        Returns:
+            |   tuple: the largest id and last_updated of the entries
+        """
+        last_id = 0
+        last_updated = None
+        for entry in entries:
+            if "url" not in entry:
+                continue
+            id = ref.parse(entry["url"]).id
+            last_id = max(last_id, id)
+            if entry.get("last_updated"):
+                last_updated = max(last_updated or "", entry["last_updated"])
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (endpoint, id, json.dumps(entry)),
+            )
+            connection.execute(
+                "DELETE FROM fields WHERE endpoint = ? AND id = ?",
+                (endpoint, id),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO fields VALUES (?, ?, ?, ?)",
+                [
+                    (endpoint, field, _normalise(item, self.registry_url), id)
+                    for field, value in entry.items()
+                    for item in (value if isinstance(value, list) else [value])
+                ],
+            )
+        return last_id, last_updated
+
+    def refresh(self, endpoint: str) -> None:
+        """
+        Internal function to sync an endpoint if it is older than max_age
+        """
+        now = time.time()
+        if self.max_age is None or self._fresh_until.get(endpoint, 0) > now:
+            return
+        connection = self._connect()
+        synced = connection.execute(
+            "SELECT synced_at FROM synced WHERE endpoint = ?", (endpoint,)
+        ).fetchone()
+        if synced and synced[0] >= now - self.max_age:
+            self._fresh_until[endpoint] = synced[0] + self.max_age
+            return
+
+        # Claim the sync so other processes keep using the mirror meanwhile,
+        # a failed sync is not retried until max_age has passed
+        self._fresh_until[endpoint] = now + self.max_age
+        with connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO synced VALUES (?, 0, 0, NULL)",
+                (endpoint,),
+            )
+            claimed = connection.execute(
+                "UPDATE synced SET synced_at = ? WHERE endpoint = ?"
+                " AND synced_at < ?",
+                (now, endpoint, now - self.max_age),
+            ).rowcount
+        if claimed:
+            try:
+                self.sync([endpoint])
+            except Exception as err:
+                logging.warning(
+                    "Could not sync the mirror of {}: {}".format(endpoint, err)
+                )
+
+    def sync(
+        self, endpoints: Optional[Iterable[str]] = None, full: bool = False
+    ) -> int:
+        """Fetches the entries added or updated since the last sync.
+
+        Args:
+            |   endpoints: (optional) endpoints to sync, defaults to all
+            |   full: (optional) fetch every entry, dropping entries which
+            |       were removed from the registry
+
+        Returns:
+            |   int: number of entries fetched
+        """
+        fetched = 0
+        connection = self._connect()
+        for endpoint in endpoints or self.endpoints:
+            state = connection.execute(
+                "SELECT last_id, last_updated FROM synced WHERE endpoint = ?",
+                (endpoint,),
+            ).fetchone()
+            query: Dict[str, Any] = {}
+            if state and not full:
+                if state[1]:
+                    query["last_updated__gt"] = state[1]
+                elif state[0]:
+                    query["id__gt"] = state[0]
+            entries = self._fetch(endpoint, query)
+            with connection:
+                if full:
+                    connection.execute(
+                        "DELETE FROM entries WHERE endpoint = ?", (endpoint,)
+                    )
+                    connection.execute(
+                        "DELETE FROM fields WHERE endpoint = ?", (endpoint,)
+                    )
+                last_id, last_updated = self._add(
+                    connection, endpoint, entries
+                )
+                connection.execute(
+                    "INSERT OR IGNORE INTO synced VALUES (?, 0, 0, NULL)",
+                    (endpoint,),
+                )
+                connection.execute(
+                    "UPDATE synced SET synced_at = ?,"
+                    " last_id = MAX(last_id, ?),"
+                    " last_updated ="
+                    " COALESCE(MAX(last_updated, ?), last_updated, ?)"
+                    " WHERE endpoint = ?",
+                    (
+                        time.time(),
+                        last_id,
+                        last_updated,
+                        last_updated,
+                        endpoint,
+                    ),
+                )
+            fetched += len(entries)
+        logging.debug("Synced {} entries to the mirror".format(fetched))
+        return fetched
+
+    def _fetch(self, endpoint: str, query: dict) -> List[dict]:
+        """
+        Internal function to fetch every page of a query from the registry
+        """
+        return list(
+            fdp_utils.iter_entries(
+                url=self.registry_url,
+                endpoint=endpoint,
+                query=query,
+                token=self.token,
+                api_version=self.api_version,
+            )
+        )
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Sync a local mirror of the local registry"
+    )
+    parser.add_argument("registry_url", help="url of the local registry")
+    parser.add_argument("path", help="path of the mirror database")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="fetch every entry rather than those updated since the last sync",
+    )
+    parser.add_argument("--api-version", default="1.0.0")
+    args = parser.parse_args(argv)
+
+    registry_mirror = RegistryMirror(
+        args.path,
+        args.registry_url,
+        max_age=None,
+        api_version=args.api_version,
+    )
+    fetched = registry_mirror.sync(full=args.full)
+    print(f"Fetched {fetched} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,637 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from data_pipeline_api import fdp_utils
+
+OFFLINE_DIRECTORY = ".offline"
+JOURNAL_FORMAT = 1
+JOURNAL_SUFFIX = ".jsonl"
+PROGRESS_SUFFIX = ".replayed"
+REF_PREFIX = "ref-"
+
+# Tables the pipeline reads but never writes, their entries are looked up
+# when the journal is replayed
+LOOKUP_ENDPOINTS = ("users", "user_author")
+
+# Tables whose entries are unique, posting the same entry twice returns the
+# entry posted first
+UNIQUE_ENDPOINTS = (
+    "storage_root",
+    "storage_location",
+    "file_type",
+    "namespace",
+    "object_component",
+    "data_product",
+)
+
+_REF = re.compile(r"^" + REF_PREFIX + r"(\d+)$")
+
+
+def is_enabled(run_metadata: dict) -> bool:
+    """
+    Internal function to return whether a code run is recorded offline, set
+    by offline: true in the run_metadata
+    """
+    return bool(run_metadata.get("offline"))
+
+
+def get_journal_directory(run_metadata: dict) -> str:
+    """
+    Internal function to return the directory of the offline journals, kept
+    in the local data store
+    """
+    datastore = fdp_utils.remove_local_from_root(
+        run_metadata["write_data_store"]
+    )
+    return os.path.join(datastore, OFFLINE_DIRECTORY).replace("\\", "/")
+
+
+def open_journal(config_yaml: dict) -> "OfflineRegistry":
+    """
+    Internal function to start an offline journal for the code runs of a
+    config, its run_metadata is pointed at the journal in place of the
+    local registry
+    Args:
+        |   config_yaml: the config, as read by initialise
+    Returns:
+        |   OfflineRegistry: the journal
+    """
+    run_metadata = config_yaml["run_metadata"]
+    journal_id = fdp_utils.generate_uuid()
+    path = os.path.join(
+        get_journal_directory(run_metadata), journal_id + JOURNAL_SUFFIX
+    ).replace("\\", "/")
+    registry = OfflineRegistry(path, journal_id)
+    registry.write_header(
+        run_metadata["local_data_registry_url"], run_metadata["api_version"]
+    )
+    fdp_utils.register_offline_registry(registry)
+    run_metadata["local_data_registry_url"] = registry.url
+    logging.info("Recording registry writes offline to {}".format(path))
+    return registry
+
+
+def attach(handle: dict) -> None:
+    """
+    Internal function to reopen the offline journal of a handle, e.g. when
+    a code run is resumed by another process
+    """
+    url = handle["yaml"]["run_metadata"]["local_data_registry_url"]
+    if not url.startswith(fdp_utils.OFFLINE_PREFIX):
+        return
+    journal_id = urlsplit(url).netloc
+    if fdp_utils.get_offline_registry(url) is None:
+        path = os.path.join(
+            get_journal_directory(handle["yaml"]["run_metadata"]),
+            journal_id + JOURNAL_SUFFIX,
+        ).replace("\\", "/")
+        fdp_utils.register_offline_registry(OfflineRegistry.load(path))
+
+
+def read_records(path: str) -> List[dict]:
+    """
+    Internal function to read the records of a journal or its replay
+    progress. A partly written last line, left by a crash, is ignored.
+    """
+    records: List[dict] = []
+    if not os.path.exists(path):
+        return records
+    with open(path, "r") as journal:
+        for line in journal:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+
+def _append_record(path: str, record: dict) -> None:
+    """
+    Internal function to append a record to a journal, the record is
+    flushed to disk before returning
+    """
+    with open(path, "a") as journal:
+        journal.write(json.dumps(record, default=str) + "\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def _matches(value: Any, wanted: Any) -> bool:
+    """
+    Internal function to return whether a field of a recorded entry matches
+    a query, which may give a url by its id
+    """
+    if isinstance(value, list):
+        return any(_matches(item, wanted) for item in value)
+    if isinstance(value, str) and value.startswith(fdp_utils.OFFLINE_PREFIX):
+        return wanted in (value, fdp_utils.extract_id(value))
+    return str(value).lower() == str(wanted).lower()
+
+
+class _LookupEntry(dict):
+    """
+    Entry of a table which is only read, its fields become placeholders
+    which are looked up on replay
+    """
+
+    def __init__(self, registry: "OfflineRegistry", data: dict) -> None:
+        super().__init__(data)
+        self._registry = registry
+
+    def __missing__(self, key: str) -> str:
+        return self._registry.get_field(dict.__getitem__(self, "url"), key)
+
+
+class OfflineRegistry:
+    """Stands in for the local registry while it can not be reached, e.g.
+    on compute nodes.
+
+    Each registry write is appended to a journal, with placeholder urls of
+    the form offline://<journal>/<endpoint>/ref-<n>/ for the entries it
+    would create. Queries are answered from the entries recorded so far.
+    Entries of the tables in LOOKUP_ENDPOINTS, which the pipeline reads but
+    never writes, are recorded as lookups. replay pushes the journal to the
+    registry and swaps the placeholders for the real urls.
+
+    Args:
+        |   path: path of the journal
+        |   journal_id: id of the journal, used in its placeholder urls
+    """
+
+    def __init__(self, path: str, journal_id: str) -> None:
+        self.path = path
+        self.journal_id = journal_id
+        self.url = fdp_utils.OFFLINE_PREFIX + journal_id + "/"
+        self._lock = threading.RLock()
+        self._count = 0
+        self._entries: Dict[str, dict] = {}
+        self._endpoints: Dict[str, str] = {}
+
+    @classmethod
+    def load(cls, path: str) -> "OfflineRegistry":
+        """
+        Internal function to reopen a journal, so more writes can be
+        appended to it
+        """
+        records = read_records(path)
+        if not records or "journal" not in records[0]:
+            raise ValueError(f"Not an offline journal: {path}")
+        registry = cls(path, records[0]["journal"])
+        for record in records[1:]:
+            registry._apply(record)
+        return registry
+
+    def write_header(self, registry_url: str, api_version: str) -> None:
+        """
+        Internal function to start the journal, recording the registry it
+        is replayed to by default
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        _append_record(
+            self.path,
+            {
+                "format": JOURNAL_FORMAT,
+                "journal": self.journal_id,
+                "registry": registry_url,
+                "api_version": api_version,
+            },
+        )
+
+    def _placeholder(self, endpoint: str, ref: int) -> str:
+        """
+        Internal function to return the placeholder url of a recorded entry
+        """
+        return "{}{}/{}{}/".format(self.url, endpoint, REF_PREFIX, ref)
+
+    def _record(self, record: dict) -> dict:
+        """
+        Internal function to number a record, append it to the journal and
+        apply it
+        """
+        with self._lock:
+            self._count += 1
+            record["ref"] = self._count
+            _append_record(self.path, record)
+            return self._apply(record)
+
+    def _apply(self, record: dict) -> dict:
+        """
+        Internal function to add the entry of a record to those which
+        answer queries
+        Returns:
+            |   dict: the entry
+        """
+        self._count = max(self._count, record["ref"])
+        op = record["op"]
+        if op == "patch":
+            entry = self._entries.get(record["url"], {})
+            entry.update(record["data"])
+            return entry
+        if op == "field":
+            url = self._placeholder(record["field"], record["ref"])
+            self._entries[record["of"]][record["field"]] = url
+            return {"url": url}
+
+        url = self._placeholder(record["endpoint"], record["ref"])
+        if op == "post":
+            entry = dict(record["data"], url=url)
+        else:
+            entry = _LookupEntry(self, dict(record["query"], url=url))
+            if record["query"].get("whole_object"):
+                entry["name"] = "whole_object"
+                self._entries[record["query"]["object"]].setdefault(
+                    "components", []
+                ).append(url)
+        self._entries[url] = entry
+        self._endpoints[url] = record["endpoint"]
+        return entry
+
+    def get_field(self, url: str, field: str) -> str:
+        """
+        Internal function to record a field of a looked up entry, e.g. the
+        author of a user_author
+        """
+        with self._lock:
+            entry = self._entries[url]
+            if field not in entry.keys():
+                self._record({"op": "field", "of": url, "field": field})
+            return dict.__getitem__(entry, field)
+
+    def get_entry(self, endpoint: str, query: dict) -> list:
+        """
+        Internal function to answer a query from the recorded entries, see
+        fdp_utils.get_entry
+        """
+        with self._lock:
+            found = [
+                entry
+                for url, entry in self._entries.items()
+                if self._endpoints[url] == endpoint
+                and all(
+                    key in entry.keys() and _matches(entry[key], value)
+                    for key, value in query.items()
+                )
+            ]
+            if not found and endpoint in LOOKUP_ENDPOINTS:
+                found = [
+                    self._record(
+                        {"op": "lookup", "endpoint": endpoint, "query": query}
+                    )
+                ]
+            return found
+
+    def get_entity(self, endpoint: str, id: Any) -> dict:
+        """
+        Internal function to return a recorded entry by its id, see
+        fdp_utils.get_entity
+        """
+        url = "{}{}/{}/".format(self.url, endpoint, id)
+        with self._lock:
+            if url not in self._entries:
+                raise ValueError(
+                    fdp_utils.SERVER_RESPONSE_STR + "404 Query = " + url
+                )
+            return self._entries[url]
+
+    def post_entry(self, endpoint: str, data: dict) -> dict:
+        """
+        Internal function to record a new entry, an entry posted before
+        with the same data is returned instead, see fdp_utils.post_entry
+        """
+        with self._lock:
+            for url, entry in self._entries.items():
+                if (
+                    endpoint in UNIQUE_ENDPOINTS
+                    and self._endpoints[url] == endpoint
+                    and all(
+                        entry.get(key) == value for key, value in data.items()
+                    )
+                ):
+                    return entry
+            data = dict(data)
+            if endpoint == "code_run":
+                data.setdefault("uuid", fdp_utils.generate_uuid())
+            entry = self._record(
+                {"op": "post", "endpoint": endpoint, "data": data}
+            )
+            if endpoint == "object":
+                # The registry creates a whole_object component for each
+                # object, it is looked up on replay
+                self._record(
+                    {
+                        "op": "lookup",
+                        "endpoint": "object_component",
+                        "query": {
+                            "object": entry["url"],
+                            "whole_object": True,
+                        },
+                    }
+                )
+            return entry
+
+    def patch_entry(self, url: str, data: dict) -> dict:
+        """
+        Internal function to record an update of an entry, see
+        fdp_utils.patch_entry
+        """
+        return self._record({"op": "patch", "url": url, "data": data})
+
+
+def find_journals(paths: List[str]) -> List[str]:
+    """
+    Internal function to return the journals given by paths, directories
+    are searched for journals
+    """
+    journals = []
+    for path in paths:
+        if os.path.isdir(path):
+            journals.extend(
+                sorted(
+                    os.path.join(path, filename)
+                    for filename in os.listdir(path)
+                    if filename.endswith(JOURNAL_SUFFIX)
+                )
+            )
+        else:
+            journals.append(path)
+    return journals
+
+
+def _references(value: Any, prefix: str) -> List[int]:
+    """
+    Internal function to return the references to other records in a
+    field of a record
+    """
+    if isinstance(value, dict):
+        return [
+            ref for item in value.values() for ref in _references(item, prefix)
+        ]
+    if isinstance(value, list):
+        return [ref for item in value for ref in _references(item, prefix)]
+    if isinstance(value, str) and value.startswith(prefix):
+        value = fdp_utils.extract_id(value)
+    match = _REF.match(value) if isinstance(value, str) else None
+    if match:
+        return [int(match.group(1))]
+    return []
+
+
+def get_levels(records: List[dict], prefix: str) -> List[List[dict]]:
+    """
+    Internal function to group the records of a journal into levels, the
+    records of a level only refer to records in earlier levels
+    """
+    depths: Dict[int, int] = {}
+    patched: Dict[str, int] = {}
+    levels: List[List[dict]] = []
+    for record in records:
+        depth = 1 + max(
+            (
+                depths[ref]
+                for ref in _references(
+                    [
+                        record.get("data"),
+                        record.get("query"),
+                        record.get("url"),
+                        record.get("of"),
+                    ],
+                    prefix,
+                )
+            ),
+            default=-1,
+        )
+        if record["op"] == "patch":
+            # Updates of an entry are applied in the order they were made
+            depth = max(depth, patched.get(record["url"], -1) + 1)
+            patched[record["url"]] = depth
+        depths[record["ref"]] = depth
+        while len(levels) <= depth:
+            levels.append([])
+        levels[depth].append(record)
+    return levels
+
+
+class _Replay:
+    """
+    Pushes one journal to the registry, see replay
+    """
+
+    def __init__(
+        self,
+        path: str,
+        token: str,
+        registry_url: Optional[str],
+        executor: ThreadPoolExecutor,
+    ) -> None:
+        records = read_records(path)
+        if not records or "journal" not in records[0]:
+            raise ValueError(f"Not an offline journal: {path}")
+        header = records[0]
+        self.path = path
+        self.records = records[1:]
+        self.token = token
+        self.registry_url = registry_url or header["registry"]
+        self.api_version = header["api_version"]
+        self.prefix = fdp_utils.OFFLINE_PREFIX + header["journal"] + "/"
+        self.executor = executor
+        self.progress_path = path + PROGRESS_SUFFIX
+        self.done: Dict[int, dict] = {
+            record["ref"]: record["entry"]
+            for record in read_records(self.progress_path)
+        }
+
+    def run(self) -> int:
+        """
+        Internal function to push the records not pushed before, level by
+        level with the records of each level pushed concurrently
+        Returns:
+            |   int: number of records pushed
+        """
+        pushed = 0
+        for level in get_levels(self.records, self.prefix):
+            pending = [
+                record for record in level if record["ref"] not in self.done
+            ]
+            futures = [
+                self.executor.submit(self._push, record) for record in pending
+            ]
+            errors = []
+            for record, future in zip(pending, futures):
+                try:
+                    entry = future.result()
+                except Exception as err:
+                    errors.append(err)
+                    continue
+                self.done[record["ref"]] = entry
+                _append_record(
+                    self.progress_path, {"ref": record["ref"], "entry": entry}
+                )
+                pushed += 1
+            if errors:
+                raise errors[0]
+        return pushed
+
+    def _remap(self, value: Any, ids: bool = False) -> Any:
+        """
+        Internal function to swap the placeholders in a field of a record
+        for the urls, or with ids the ids, of the pushed entries
+        """
+        if isinstance(value, dict):
+            return {key: self._remap(item, ids) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._remap(item, ids) for item in value]
+        refs = _references(value, self.prefix)
+        if not refs:
+            return value
+        url = self.done[refs[0]]["url"]
+        if isinstance(value, str) and _REF.match(value):
+            return fdp_utils.extract_id(url) if ids else value
+        return url
+
+    def _push(self, record: dict) -> dict:
+        """
+        Internal function to push a record to the registry
+        Returns:
+            |   dict: the entry of the record in the registry
+        """
+        op = record["op"]
+        if op == "post":
+            return fdp_utils.post_entry(
+                url=self.registry_url,
+                endpoint=record["endpoint"],
+                data=self._remap(record["data"]),
+                token=self.token,
+                api_version=self.api_version,
+            )
+        if op == "patch":
+            return fdp_utils.patch_entry(
+                url=self._remap(record["url"]),
+                data=self._remap(record["data"]),
+                token=self.token,
+                api_version=self.api_version,
+            )
+        if op == "field":
+            of = _references(record["of"], self.prefix)[0]
+            return {"url": self.done[of][record["field"]]}
+
+        query = self._remap(record["query"], ids=True)
+        results = fdp_utils.get_entry(
+            url=self.registry_url,
+            endpoint=record["endpoint"],
+            query=dict(query),
+            token=self.token,
+            api_version=self.api_version,
+        )
+        if not results:
+            raise ValueError(
+                "No {} in the registry matches {}".format(
+                    record["endpoint"], query
+                )
+            )
+        return results[0]
+
+    def remove(self) -> None:
+        """
+        Internal function to remove the journal once it has been pushed
+        """
+        os.remove(self.path)
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
+
+def replay(
+    token: str,
+    paths: List[str],
+    registry_url: Optional[str] = None,
+    max_workers: int = fdp_utils.DEFAULT_MAX_WORKERS,
+) -> dict:
+    """Pushes offline journals to the registry, e.g. from a login node once
+    the code runs on compute nodes have finalised. Journals are pushed
+    concurrently and removed once pushed. The progress of each journal is
+    recorded, so a replay which fails part way through can be run again to
+    push the rest.
+
+    Args:
+        |   token: registry token
+        |   paths: paths of journals, or of directories of journals e.g.
+        |       the .offline directory of the local data store
+        |   registry_url: (optional) registry to push to, defaults to the
+        |       registry of each journal's config
+        |   max_workers: (optional) number of concurrent requests
+
+    Returns:
+        |   dict: 'journals': number of journals pushed,
+        |       'records': number of records pushed
+    """
+    journals = find_journals(paths)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _replay(path: str) -> int:
+        journal = _Replay(path, token, registry_url, pool)
+        pushed = journal.run()
+        journal.remove()
+        return pushed
+
+    failed = 0
+    pushed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_replay, path) for path in journals]
+            for path, future in zip(journals, futures):
+                try:
+                    pushed += future.result()
+                except Exception as err:
+                    failed += 1
+                    logging.warning(
+                        "Replay of {} failed: {}".format(path, err)
+                    )
+    finally:
+        pool.shutdown()
+
+    if failed:
+        raise ValueError(
+            "{} of {} journals could not be pushed, run replay again to "
+            "push the rest".format(failed, len(journals))
+        )
+    logging.info(
+        "Pushed {} records from {} journals".format(pushed, len(journals))
+    )
+    return {"journals": len(journals), "records": pushed}
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Push offline journals to the local registry"
+    )
+    parser.add_argument("token", help="path to the registry token")
+    parser.add_argument(
+        "paths", nargs="+", help="journals, or directories of journals"
+    )
+    parser.add_argument("--registry-url", help="url of the local registry")
+    parser.add_argument(
+        "--workers", type=int, default=fdp_utils.DEFAULT_MAX_WORKERS
+    )
+    args = parser.parse_args(argv)
+
+    result = replay(
+        token=fdp_utils.read_token(args.token),
+        paths=args.paths,
+        registry_url=args.registry_url,
+        max_workers=args.workers,
+    )
+    print(
+        "Pushed {} records from {} journals".format(
+            result["records"], result["journals"]
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,35 @@
 import datetime
 import logging
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional
 
 import yaml
 
-from data_pipeline_api import fdp_utils
+from data_pipeline_api import (
+    daemon,
+    fdp_utils,
+    journal,
+    memo,
+    mirror,
+    offline,
+)
 
 WRITING_STR = "Writing {} to local registry"
 
-def initialise(token: str, config: str, script: str) -> dict:
+# Outputs committed in the background before finalise, by code_run_uuid
+_COMMIT_LOCK = threading.Lock()
+_COMMIT_EXECUTORS: Dict[str, ThreadPoolExecutor] = {}
+_COMMITS: Dict[str, Dict[str, Future]] = {}
+_AUTO_COMMIT_TOKENS: Dict[str, str] = {}
+_CODERUNS_LOCK = threading.Lock()
+
+@daemon.delegate("config", "script")
+def initialise(
+    token: str, config: str, script: str, deadline: Optional[float] = None
+) -> dict:
     """Reads in token, config file and script, creates necessary registry items
     and creates new code run.
 
@@ -16,6 +37,8 @@ def initialise(token: str, config: str, script: str) -> dict:
         |   token: registry token
         |   config: Path to config file
         |   script: Path to script file
+        |   deadline: (optional) seconds within which the registry calls
+        |       must be made, defaults to deadline in the run_metadata
 
     Returns:
         |   dict: a dictionary containing the following keys:
@@ -26,9 +49,35 @@ def initialise(token: str, config: str, script: str) -> dict:
         |       'code_repo': code repo object url,
         |       'code_run': coderun url,
         |       'code_run_uuid': coderun uuid,
-        |       'author': author url
+        |       'author': author url,
+        |       'config_hash': hash of the config file,
+        |       'script_hash': hash of the script file
     """
 
+    config_yaml = _read_config(config, script)
+    with fdp_utils.deadline(
+        _get_deadline(config_yaml["run_metadata"], deadline)
+    ):
+        setup = _register_setup(token, config_yaml, config, script)
+        return _register_code_run(token, config_yaml, setup)
+
+
+def _get_deadline(
+    run_metadata: dict, deadline: Optional[float]
+) -> Optional[float]:
+    """
+    Internal function to return the deadline of an initialise or finalise,
+    given or set by deadline in the run_metadata
+    """
+    if deadline is not None:
+        return deadline
+    return run_metadata.get("deadline")
+
+
+def _read_config(config: str, script: str) -> dict:
+    """
+    Internal function to validate and read a config file
+    """
     # Validate Yamls
     if not fdp_utils.is_valid_yaml(config):
         raise ValueError("Config is not a valid YAML file")
@@ -38,17 +87,41 @@ def initialise(token: str, config: str, script: str) -> dict:
     # Read config file and extract run metadata
     with open(config, "r") as data:
         config_yaml = yaml.safe_load(data)
-    run_metadata = config_yaml["run_metadata"]
-    registry_url = run_metadata["local_data_registry_url"]
-    if registry_url[-1] != "/":
-        registry_url += "/"
-    filename = os.path.basename(config)
 
     # @todo to be set from config
     if "api_version" not in config_yaml["run_metadata"].keys():
         config_yaml["run_metadata"]["api_version"] = "1.0.0"
 
-    api_version = config_yaml["run_metadata"]["api_version"]
+    return config_yaml
+
+
+def _register_setup(
+    token: str, config_yaml: dict, config: str, script: str
+) -> dict:
+    """
+    Internal function to register the config, submission script and code
+    repo of a code run, and find its author
+    Returns:
+        |   dict: a dictionary containing the following keys:
+        |       'fdp_config_dir': config dir path,
+        |       'config_hash': hash of the config file,
+        |       'script_hash': hash of the script file,
+        |       'model_config': model config url,
+        |       'submission_script': submission script object url,
+        |       'code_repo': code repo object url,
+        |       'author': author url
+    """
+    run_metadata = config_yaml["run_metadata"]
+    fdp_utils.configure_requests(run_metadata)
+    if offline.is_enabled(run_metadata):
+        offline.open_journal(config_yaml)
+    elif mirror.is_enabled(run_metadata):
+        mirror.open_mirror(run_metadata, token)
+    registry_url = run_metadata["local_data_registry_url"]
+    if registry_url[-1] != "/":
+        registry_url += "/"
+    filename = os.path.basename(config)
+    api_version = run_metadata["api_version"]
 
     logging.info("Reading {} from local filestore".format(filename))
 
@@ -273,6 +346,33 @@ def initialise(token: str, config: str, script: str) -> dict:
 
     logging.info(WRITING_STR.format(repo_name))
 
+    return {
+        "fdp_config_dir": os.path.dirname(config),
+        "config_hash": config_hash,
+        "script_hash": script_hash,
+        "model_config": config_object_url,
+        "submission_script": script_object_url,
+        "code_repo": coderepo_object_url,
+        "author": author_url,
+    }
+
+
+def _register_code_run(
+    token: str,
+    config_yaml: dict,
+    setup: dict,
+    description: Optional[str] = None,
+) -> dict:
+    """
+    Internal function to register a new code run using the objects from
+    _register_setup and return its handle
+    """
+    run_metadata = config_yaml["run_metadata"]
+    registry_url = run_metadata["local_data_registry_url"]
+    if registry_url[-1] != "/":
+        registry_url += "/"
+    api_version = run_metadata["api_version"]
+
     # Register new code run
 
     coderun_response = fdp_utils.post_entry(
@@ -281,10 +381,10 @@ def initialise(token: str, config: str, script: str) -> dict:
         endpoint="code_run",
         data={
             "run_date": str(datetime.datetime.now()),
-            "description": run_metadata["description"],
-            "code_repo": coderepo_object_url,
-            "model_config": config_object_url,
-            "submission_script": script_object_url,
+            "description": description or run_metadata["description"],
+            "code_repo": setup["code_repo"],
+            "model_config": setup["model_config"],
+            "submission_script": setup["submission_script"],
             "input_urls": [],
             "output_urls": [],
         },
@@ -296,30 +396,41 @@ def initialise(token: str, config: str, script: str) -> dict:
 
     logging.info("Writing new code_run to local registry")
 
+    if run_metadata.get("auto_commit"):
+        _AUTO_COMMIT_TOKENS[coderun_uuid] = token
+
     # Write code run and object info to handle
 
     return {
         "yaml": config_yaml,
-        "fdp_config_dir": os.path.dirname(config),
-        "model_config": config_object_url,
-        "submission_script": script_object_url,
-        "code_repo": coderepo_object_url,
+        "fdp_config_dir": setup["fdp_config_dir"],
+        "model_config": setup["model_config"],
+        "submission_script": setup["submission_script"],
+        "code_repo": setup["code_repo"],
         "code_run": coderun_url,
         "code_run_uuid": coderun_uuid,
-        "author": author_url,
+        "author": setup["author"],
+        "config_hash": setup["config_hash"],
+        "script_hash": setup["script_hash"],
     }
 
 
 # flake8: noqa C901
-def finalise(token: str, handle: dict) -> None:
+@daemon.delegate()
+def finalise(
+    token: str, handle: dict, deadline: Optional[float] = None
+) -> None:
     """
     Renames files with their hash, updates data_product names and records
-    metadata in the registry
+    metadata in the registry. If the deadline passes finalise stops with
+    DeadlineExceeded, and can be resumed with finalise or resume_finalise.
 
     Args:
         |   token: registry token
         |   config: Path to config file
         |   script: Path to script file
+        |   deadline: (optional) seconds within which the registry calls
+        |       must be made, defaults to deadline in the run_metadata
 
     Returns:
         |   dict: a dictionary containing the following keys:
@@ -341,8 +452,301 @@ def finalise(token: str, handle: dict) -> None:
         |           'component_url': component url
         |       'outputs':
         |           component_url: component url
+        |           component_urls: urls of named components
         |           data_product_url: data product url
     """
+    run_metadata = handle["yaml"]["run_metadata"]
+    fdp_utils.configure_requests(run_metadata)
+    with fdp_utils.deadline(_get_deadline(run_metadata, deadline)):
+        try:
+            _finalise(token, handle, _get_datastore_root_url(token, handle))
+        except fdp_utils.DeadlineExceeded:
+            journal_path = journal.get_journal_path(handle)
+            resume = "by calling finalise again"
+            if os.path.exists(journal_path):
+                resume = "with resume_finalise from {}".format(journal_path)
+            logging.error(
+                "Finalise of code run {} stopped at its deadline, it can be "
+                "resumed {}".format(handle["code_run_uuid"], resume)
+            )
+            raise
+
+
+def _finalise(token: str, handle: dict, datastore_root_url: str) -> None:
+    """
+    Internal function to finalise a code run whose outputs are stored in
+    the storage_root datastore_root_url
+    """
+    api_version = handle["yaml"]["run_metadata"]["api_version"]
+
+    # Wait for outputs being committed in the background
+    _wait_for_commits(handle)
+
+    # Completed steps are journaled so a failed finalise can be resumed
+    journal_path = journal.get_journal_path(handle)
+    steps = journal.read_journal(journal_path)
+    journal.write_handle(journal_path, handle)
+    run_steps = steps.get(None, {})
+
+    if "output" in handle:
+        for output in handle["output"]:
+            _finalise_output(
+                token,
+                handle,
+                output,
+                datastore_root_url,
+                journal_path,
+                steps.get(output, {}),
+            )
+
+    output_components = []
+    input_components = []
+
+    if "output" in handle.keys():
+        for output in handle["output"]:
+            output_components.append(handle["output"][output]["component_url"])
+            output_components.extend(
+                handle["output"][output].get("component_urls") or []
+            )
+
+    # Outputs reused from an identical code run, see find_memoised_outputs
+    for output in (handle.get("memoised") or {}).get("outputs", {}).values():
+        output_components.append(output["component_url"])
+        output_components.extend(output["component_urls"])
+
+    if "input" in handle.keys():
+        for input in handle["input"]:
+            input_components.append(handle["input"][input]["component_url"])
+
+    # Each group of issues is journaled as it is registered
+    if "issues" in handle.keys() and "issues" not in run_steps:
+        fdp_utils.register_issues(
+            token,
+            handle,
+            registered={
+                key: issue
+                for key, issue in run_steps.items()
+                if key in handle["issues"]
+            },
+            on_register=lambda key, issue: journal.write_step(
+                journal_path, None, key, issue
+            ),
+        )
+        journal.write_step(journal_path, None, "issues")
+
+    if "code_run" not in run_steps:
+        fdp_utils.patch_entry(
+            token=token,
+            url=handle["code_run"],
+            data={"inputs": input_components, "outputs": output_components},
+            api_version=api_version,
+        )
+        journal.write_step(journal_path, None, "code_run")
+
+    coderuns_path = os.path.join(
+        handle["fdp_config_dir"], "coderuns.txt"
+    ).replace("\\", "/")
+
+    # A finalise being resumed may have added the code run before it stopped
+    if "coderuns" not in run_steps:
+        with _CODERUNS_LOCK, open(coderuns_path, "a+") as coderun_file:
+            coderun_file.seek(0)
+            if "code_run" in run_steps:
+                data = coderun_file.read()
+            else:
+                data = coderun_file.read(100)
+            if handle["code_run_uuid"] not in data.splitlines():
+                if len(data) > 0:
+                    coderun_file.write("\n")
+                coderun_file.write(handle["code_run_uuid"])
+        journal.write_step(journal_path, None, "coderuns")
+
+    # Offline code runs are only in the registry once they are replayed
+    if (
+        memo.is_enabled(handle)
+        and not handle.get("memoised")
+        and not offline.is_enabled(handle["yaml"]["run_metadata"])
+    ):
+        memo.record_run(handle, journal.read_journal(journal_path))
+
+    journal.remove_journal(journal_path)
+    _AUTO_COMMIT_TOKENS.pop(handle["code_run_uuid"], None)
+
+
+@daemon.delegate("journal_path")
+def resume_finalise(
+    token: str, journal_path: str, deadline: Optional[float] = None
+) -> dict:
+    """
+    Resumes a finalise which failed part way through, e.g. because the
+    process was killed, from its journal. Steps which were completed are
+    not repeated.
+
+    Args:
+        |   token: registry token
+        |   journal_path: Path to the journal, this is
+        |       finalise_<code_run_uuid>.journal in the config directory
+        |   deadline: (optional) seconds within which the registry calls
+        |       must be made, defaults to deadline in the run_metadata
+
+    Returns:
+        |   dict: the handle of the finalised code run
+    """
+    handle = journal.load_handle(journal_path)
+    offline.attach(handle)
+    finalise(token, handle, deadline)
+    return handle
+
+
+@daemon.delegate()
+def commit_output(token: str, handle: dict, path: str) -> None:
+    """
+    Commits an output once it has been written and closed: it is hashed,
+    moved into the datastore and registered by a background worker while
+    the model carries on. finalise waits for outstanding commits and
+    registers any outputs which were not committed.
+
+    With auto_commit: true in the run_metadata, outputs written with
+    open_write are committed when they are closed.
+
+    Args:
+        |   token: registry token
+        |   handle: the handle containing the output
+        |   path: path of the output as returned by link_write
+    """
+    output = fdp_utils.get_handle_index_from_path(handle, path)
+    if output is None or output not in handle.get("output", {}):
+        raise ValueError("Error: path is not an output in the handle")
+    _submit_commit(token, handle, output)
+
+
+@daemon.delegate()
+def find_memoised_outputs(handle: dict) -> Optional[dict]:
+    """
+    Finds a previous code run with the same config, submission script,
+    commit and inputs, when memoise: true is set in the run_metadata. Call
+    it once all inputs have been linked with link_read. If one is found its
+    outputs are reused: finalise records them as the outputs of this code
+    run, so the model does not need to be run again.
+
+    Args:
+        |   handle: the handle of the code run
+
+    Returns:
+        |   dict: {data_product: [path, ...]} of the reused outputs, with
+        |       a path for each output of the data product, or None if
+        |       there is no such code run
+    """
+    if not memo.is_enabled(handle):
+        return None
+    record = memo.find_run(handle)
+    if record is None:
+        return None
+    handle["memoised"] = record
+    logging.info(
+        "Reusing the outputs of identical code run {}".format(
+            record["code_run"]
+        )
+    )
+    paths: Dict[str, List[str]] = {}
+    for output in record["outputs"].values():
+        paths.setdefault(output["data_product"], []).append(output["path"])
+    return paths
+
+
+@daemon.delegate()
+def auto_commit_output(handle: dict, output: str) -> None:
+    """
+    Internal function to commit an output in the background if auto_commit
+    is set for the code run
+    """
+    token = _AUTO_COMMIT_TOKENS.get(handle["code_run_uuid"])
+    if token is not None:
+        _submit_commit(token, handle, output)
+
+
+def _submit_commit(token: str, handle: dict, output: str) -> None:
+    """
+    Internal function to queue an output on the code run's background worker
+    """
+    code_run_uuid = handle["code_run_uuid"]
+    with _COMMIT_LOCK:
+        commits = _COMMITS.setdefault(code_run_uuid, {})
+        if output in commits:
+            return
+        if code_run_uuid not in _COMMIT_EXECUTORS:
+            _COMMIT_EXECUTORS[code_run_uuid] = ThreadPoolExecutor(
+                max_workers=handle["yaml"]["run_metadata"].get(
+                    "commit_workers", 1
+                ),
+                thread_name_prefix="fdp-commit",
+            )
+        # The handle is journaled once, and each output before its commit's
+        # steps, so a code run which dies part way can be resumed with
+        # resume_finalise
+        journal_path = journal.get_journal_path(handle)
+        if not os.path.exists(journal_path):
+            journal.write_handle(journal_path, handle)
+        journal.write_output(journal_path, handle, output)
+        commits[output] = _COMMIT_EXECUTORS[code_run_uuid].submit(
+            _commit_output, token, handle, output
+        )
+
+
+def _commit_output(token: str, handle: dict, output: str) -> None:
+    """
+    Internal function run by the background worker to commit an output
+    """
+    journal_path = journal.get_journal_path(handle)
+    steps = journal.read_journal(journal_path)
+    _finalise_output(
+        token,
+        handle,
+        output,
+        _get_datastore_root_url(token, handle),
+        journal_path,
+        steps.get(output, {}),
+    )
+
+
+def _wait_for_commits(handle: dict) -> None:
+    """
+    Internal function to wait for the background commits of a code run,
+    outputs whose commit failed are left for finalise to register. Commits
+    still running at the deadline are waited for by the next finalise.
+    """
+    code_run_uuid = handle["code_run_uuid"]
+    with _COMMIT_LOCK:
+        commits = dict(_COMMITS.get(code_run_uuid, {}))
+    for commit in commits.values():
+        try:
+            commit.exception(timeout=fdp_utils.get_remaining_time())
+        except FutureTimeoutError as err:
+            raise fdp_utils.DeadlineExceeded(
+                "The deadline passed while waiting for commits"
+            ) from err
+
+    with _COMMIT_LOCK:
+        commits = _COMMITS.pop(code_run_uuid, {})
+        executor = _COMMIT_EXECUTORS.pop(code_run_uuid, None)
+    for output, commit in commits.items():
+        try:
+            commit.result()
+        except Exception as err:
+            logging.warning(
+                "Commit of {} failed, retrying in finalise: {}".format(
+                    output, err
+                )
+            )
+    if executor:
+        executor.shutdown()
+
+
+def _get_datastore_root_url(token: str, handle: dict) -> str:
+    """
+    Internal function to return the url of the write_data_store's
+    storage_root, registering it if needed
+    """
     registry_url = handle["yaml"]["run_metadata"]["local_data_registry_url"]
     datastore = handle["yaml"]["run_metadata"]["write_data_store"]
     api_version = handle["yaml"]["run_metadata"]["api_version"]
@@ -354,258 +758,376 @@ def finalise(token: str, handle: dict) -> None:
         query={"root": datastore},
         api_version=api_version,
     )
-    datastore_root_url = None
 
     # Check datastore is in registry
     if datastore_root:
         datastore_root_dict = fdp_utils.get_first_entry(datastore_root)
-        datastore_root_url = datastore_root_dict["url"]
+        return datastore_root_dict["url"]
+    return fdp_utils.post_storage_root(
+        token=token,
+        url=registry_url,
+        data={"root": datastore, "local": True},
+        api_version=api_version,
+    )["url"]
+
+
+# flake8: noqa C901
+def _finalise_output(
+    token: str,
+    handle: dict,
+    output: str,
+    datastore_root_url: str,
+    journal_path: str,
+    steps: dict,
+) -> None:
+    """
+    Internal function to hash, place and register a single output, steps
+    already in the journal are skipped and completed steps are journaled
+    """
+    fdp_utils.check_deadline()
+    registry_url = handle["yaml"]["run_metadata"]["local_data_registry_url"]
+    datastore = handle["yaml"]["run_metadata"]["write_data_store"]
+    api_version = handle["yaml"]["run_metadata"]["api_version"]
+    layout = fdp_utils.validate_layout(
+        handle["yaml"]["run_metadata"].get("datastore_layout")
+    )
+    datastore = fdp_utils.remove_local_from_root(datastore)
+    datastore_root_id = fdp_utils.extract_id(datastore_root_url)
+
+    if "${RUN_ID}" in handle["output"][output]["use_data_product"]:
+        handle["output"][output]["use_data_product"] = handle["output"][
+            output
+        ]["use_data_product"].replace("${RUN_ID}", handle["code_run_uuid"])
+
+    if "data_product" in steps:
+        handle["output"][output]["component_url"] = steps["component"]
+        handle["output"][output]["component_urls"] = steps.get(
+            "components", []
+        )
+        handle["output"][output]["data_product_url"] = steps["data_product"]
+        return
+
+    write_namespace = fdp_utils.get_entry(
+        url=registry_url,
+        endpoint="namespace",
+        query={"name": handle["output"][output]["use_namespace"]},
+        api_version=api_version,
+    )
+    write_namespace_url = None
+    if write_namespace:
+        entry = fdp_utils.get_first_entry(write_namespace)
+        write_namespace_url = entry["url"]
     else:
-        datastore_root_url = fdp_utils.post_storage_root(
+        write_namespace_url = fdp_utils.post_entry(
             token=token,
             url=registry_url,
-            data={"root": datastore, "local": True},
+            endpoint="namespace",
+            data={"name": handle["output"][output]["use_namespace"]},
             api_version=api_version,
         )["url"]
 
-    datastore_root_id = fdp_utils.extract_id(datastore_root_url)
+    # The hash is of the uncompressed data, open_write records it
+    file_hash = steps.get("hash") or handle["output"][output].get("hash")
+    if not file_hash:
+        file_hash = fdp_utils.get_file_hash(handle["output"][output]["path"])
+    if "hash" not in steps:
+        journal.write_step(journal_path, output, "hash", file_hash)
 
-    if "output" in handle:
-        for output in handle["output"]:
+    if "storage_location" in steps:
+        storage_location_url = steps["storage_location"]
+        new_path = steps["placement"]
+    else:
+        storage_exists = fdp_utils.get_entry(
+            url=registry_url,
+            endpoint="storage_location",
+            query={
+                "hash": file_hash,
+                "public": str(handle["output"][output]["public"]).lower(),
+                "storage_root": datastore_root_id,
+            },
+            api_version=api_version,
+        )
 
-            if "${RUN_ID}" in handle["output"][output]["use_data_product"]:
-                handle["output"][output]["use_data_product"] = handle[
-                    "output"
-                ][output]["use_data_product"].replace(
-                    "${RUN_ID}", handle["code_run_uuid"]
-                )
-            write_namespace = fdp_utils.get_entry(
-                url=registry_url,
-                endpoint="namespace",
-                query={"name": handle["output"][output]["use_namespace"]},
-                api_version=api_version,
-            )
-            write_namespace_url = None
-            if write_namespace:
-                entry = fdp_utils.get_first_entry(write_namespace)
-                write_namespace_url = entry["url"]
-            else:
-                write_namespace_url = fdp_utils.post_entry(
-                    token=token,
-                    url=registry_url,
-                    endpoint="namespace",
-                    data={"name": handle["output"][output]["use_namespace"]},
-                    api_version=api_version,
-                )["url"]
+        storage_location_url = None
+
+        if storage_exists:
+            storage_exists_dict = fdp_utils.get_first_entry(storage_exists)
+            storage_location_url = storage_exists_dict["url"]
+
+            existing_path = storage_exists_dict["path"]
+
+            existing_root = fdp_utils.get_entity_from_url(
+                storage_exists_dict["storage_root"], api_version=api_version
+            )["root"]
 
-            file_hash = fdp_utils.get_file_hash(handle["output"][output]["path"])
+            existing_root = fdp_utils.remove_local_from_root(existing_root)
 
-            storage_exists = fdp_utils.get_entry(
+            new_path = os.path.join(existing_root, existing_path)
+
+            if "placement" not in steps:
+                if not _is_placed(
+                    handle["output"][output]["path"], new_path, file_hash
+                ):
+                    os.remove(handle["output"][output]["path"])
+                    fdp_utils.remove_empty_directories(
+                        os.path.dirname(handle["output"][output]["path"]),
+                        datastore,
+                    )
+                journal.write_step(journal_path, output, "placement", new_path)
+
+        else:
+            tmp_filename = fdp_utils.strip_compression_suffix(
+                os.path.basename(handle["output"][output]["path"])
+            )
+            extension = tmp_filename.split(sep=".")[-1]
+            new_filename = ".".join([file_hash, extension])
+            compression = handle["output"][output].get("compression")
+            if compression:
+                new_filename += fdp_utils.COMPRESSION_SUFFIXES[compression]
+            data_product = handle["output"][output]["data_product"]
+            namespace = handle["output"][output]["use_namespace"]
+            new_storage_location = fdp_utils.get_storage_path(
+                namespace, data_product, new_filename, layout
+            )
+            new_path = os.path.join(datastore, new_storage_location).replace(
+                "\\", "/"
+            )
+
+            if "placement" not in steps:
+                if not _is_placed(
+                    handle["output"][output]["path"], new_path, file_hash
+                ):
+                    _place_output(
+                        handle["output"][output]["path"],
+                        new_path,
+                        compression,
+                        _find_duplicate_file(
+                            registry_url,
+                            datastore,
+                            datastore_root_id,
+                            file_hash,
+                            new_filename,
+                            api_version,
+                        ),
+                    )
+                journal.write_step(journal_path, output, "placement", new_path)
+
+            storage_location_url = fdp_utils.post_entry(
+                token=token,
                 url=registry_url,
                 endpoint="storage_location",
-                query={
+                data={
+                    "path": new_storage_location,
                     "hash": file_hash,
                     "public": str(handle["output"][output]["public"]).lower(),
-                    "storage_root": datastore_root_id,
+                    "storage_root": datastore_root_url,
                 },
                 api_version=api_version,
-            )
+            )["url"]
 
-            storage_location_url = None
+        journal.write_step(
+            journal_path, output, "storage_location", storage_location_url
+        )
 
-            if storage_exists:
-                storage_exists_dict = fdp_utils.get_first_entry(storage_exists)
-                storage_location_url = storage_exists_dict["url"]
+    file_type = os.path.basename(
+        fdp_utils.strip_compression_suffix(new_path)
+    ).split(".")[-1]
 
-                os.remove(handle["output"][output]["path"])
+    file_type_url = fdp_utils.post_file_type(
+        token=token,
+        url=registry_url,
+        data={"name": file_type, "extension": file_type},
+        api_version=api_version,
+    )["url"]
 
-                directory = os.path.dirname(handle["output"][output]["path"])
-                i = 0
-                while os.path.normpath(directory) != os.path.normpath(
-                    datastore
-                ):
-                    try:
-                        os.rmdir(directory)
-                    except Exception:
-                        logging.warning(
-                            "Ignoring Directory: {} as it is not empty".format(
-                                directory
-                            )
-                        )
-                    directory = os.path.split(directory)[0]
-                    i += 1
-                    if i > 4:
-                        break
-
-                existing_path = storage_exists_dict["path"]
-
-                existing_root = fdp_utils.get_entity(
-                    url=registry_url,
-                    endpoint="storage_root",
-                    id=int(
-                        fdp_utils.extract_id(
-                            storage_exists_dict["storage_root"]
-                        )
-                    ),
-                    api_version=api_version,
-                )["root"]
-
-                existing_root = fdp_utils.remove_local_from_root(existing_root)
-
-                new_path = os.path.join(existing_root, existing_path)
+    data_product_exists = fdp_utils.get_entry(
+        url=registry_url,
+        endpoint="data_product",
+        query={
+            "name": handle["output"][output]["use_data_product"],
+            "version": handle["output"][output]["use_version"],
+            "namespace": write_namespace_url,
+        },
+        api_version=api_version,
+    )
 
-            else:
-                tmp_filename = os.path.basename(
-                    handle["output"][output]["path"]
-                )
-                extension = tmp_filename.split(sep=".")[-1]
-                new_filename = ".".join([file_hash, extension])
-                data_product = handle["output"][output]["data_product"]
-                namespace = handle["output"][output]["use_namespace"]
-                new_path = os.path.join(
-                    datastore, namespace, data_product, new_filename
-                ).replace("\\", "/")
-                os.rename(handle["output"][output]["path"], new_path)
-                new_storage_location = os.path.join(
-                    namespace, data_product, new_filename
-                ).replace("\\", "/")
-
-                storage_location_url = fdp_utils.post_entry(
-                    token=token,
-                    url=registry_url,
-                    endpoint="storage_location",
-                    data={
-                        "path": new_storage_location,
-                        "hash": file_hash,
-                        "public": str(handle["output"][output]["public"]).lower(),
-                        "storage_root": datastore_root_url,
-                    },
-                    api_version=api_version,
-                )["url"]
-
-            file_type = os.path.basename(new_path).split(".")[-1]
-
-            file_type_url = fdp_utils.post_file_type(
+    if data_product_exists:
+        data_product_exists_dict = fdp_utils.get_first_entry(
+            data_product_exists
+        )
+        data_product_url = data_product_exists_dict["url"]
+        object_url = data_product_exists_dict["object"]
+        obj = fdp_utils.get_entity_from_url(
+            object_url, api_version=api_version
+        )
+        component_url = obj["components"][0]
+
+    else:
+        if "object" in steps:
+            object_url = steps["object"]
+        else:
+            object_url = fdp_utils.post_entry(
                 token=token,
                 url=registry_url,
-                data={"name": file_type, "extension": file_type},
+                endpoint="object",
+                data={
+                    "description": handle["output"][output][
+                        "data_product_description"
+                    ],
+                    "storage_location": storage_location_url,
+                    "authors": [handle["author"]],
+                    "file_type": file_type_url,
+                },
                 api_version=api_version,
-                )["url"]
+            )["url"]
+            journal.write_step(journal_path, output, "object", object_url)
 
-            data_product_exists = fdp_utils.get_entry(
+        component_url = None
+
+        if handle["output"][output]["use_component"]:
+            component_url = fdp_utils.post_entry(
+                token=token,
+                url=registry_url,
+                endpoint="object_component",
+                data={
+                    "object": object_url,
+                    "name": handle["output"][output]["use_component"],
+                },
+                api_version=api_version,
+            )["url"]
+        else:
+            component_url = fdp_utils.get_entry(
                 url=registry_url,
-                endpoint="data_product",
+                endpoint="object_component",
                 query={
-                    "name": handle["output"][output]["use_data_product"],
-                    "version": handle["output"][output]["use_version"],
-                    "namespace": write_namespace_url,
+                    "object": fdp_utils.extract_id(object_url),
                 },
                 api_version=api_version,
-            )
+            )[0]["url"]
 
-            if data_product_exists:
-                data_product_exists_dict = fdp_utils.get_first_entry(
-                    data_product_exists
-                )
-                data_product_url = data_product_exists_dict["url"]
-                object_url = data_product_exists_dict["object"]
-                obj = fdp_utils.get_entity(
-                    url=registry_url,
-                    endpoint="object",
-                    id=int(fdp_utils.extract_id(object_url)),
-                    api_version=api_version,
-                )
-                component_url = obj["components"][0]
+        data_product_url = fdp_utils.post_entry(
+            token=token,
+            url=registry_url,
+            endpoint="data_product",
+            data={
+                "name": handle["output"][output]["use_data_product"],
+                "version": handle["output"][output]["use_version"],
+                "object": object_url,
+                "namespace": write_namespace_url,
+            },
+            api_version=api_version,
+        )["url"]
 
-            else:
-                object_url = fdp_utils.post_entry(
-                    token=token,
-                    url=registry_url,
-                    endpoint="object",
-                    data={
-                        "description": handle["output"][output][
-                            "data_product_description"
-                        ],
-                        "storage_location": storage_location_url,
-                        "authors": [handle["author"]],
-                        "file_type": file_type_url,
-                    },
-                    api_version=api_version,
-                )["url"]
-
-                component_url = None
-
-                if handle["output"][output]["use_component"]:
-                    component_url = fdp_utils.post_entry(
-                        token=token,
-                        url=registry_url,
-                        endpoint="object_component",
-                        data={
-                            "object": object_url,
-                            "name": handle["output"][output]["use_component"],
-                        },
-                        api_version=api_version,
-                    )["url"]
-                else:
-                    component_url = fdp_utils.get_entry(
-                        url=registry_url,
-                        endpoint="object_component",
-                        query={
-                            "object": fdp_utils.extract_id(object_url),
-                        },
-                        api_version=api_version,
-                    )[0]["url"]
-
-                data_product_url = fdp_utils.post_entry(
-                    token=token,
-                    url=registry_url,
-                    endpoint="data_product",
-                    data={
-                        "name": handle["output"][output]["use_data_product"],
-                        "version": handle["output"][output]["use_version"],
-                        "object": object_url,
-                        "namespace": write_namespace_url,
-                    },
-                    api_version=api_version,
-                )["url"]
-
-            handle["output"][output]["component_url"] = component_url
-            handle["output"][output]["data_product_url"] = data_product_url
-
-            logging.info(
-                WRITING_STR.format(
-                    handle["output"][output]["use_data_product"]
-                )
-            )
+    component_urls = _register_components(
+        token,
+        handle,
+        handle["output"][output].get("components") or [],
+        object_url,
+    )
 
-    output_components = []
-    input_components = []
+    journal.write_step(journal_path, output, "components", component_urls)
+    journal.write_step(journal_path, output, "component", component_url)
+    journal.write_step(journal_path, output, "data_product", data_product_url)
 
-    if "output" in handle.keys():
-        for output in handle["output"]:
-            output_components.append(handle["output"][output]["component_url"])
+    handle["output"][output]["component_url"] = component_url
+    handle["output"][output]["component_urls"] = component_urls
+    handle["output"][output]["data_product_url"] = data_product_url
 
-    if "input" in handle.keys():
-        for input in handle["input"]:
-            input_components.append(handle["input"][input]["component_url"])
+    logging.info(
+        WRITING_STR.format(handle["output"][output]["use_data_product"])
+    )
 
-    if "issues" in handle.keys():
-        fdp_utils.register_issues(token, handle)
 
-    fdp_utils.patch_entry(
-        token=token,
-        url=handle["code_run"],
-        data={"inputs": input_components, "outputs": output_components},
-        api_version=api_version,
+def _register_components(
+    token: str, handle: dict, components: list, object_url: str
+) -> list:
+    """
+    Internal function to register named components of an output's object
+    concurrently, components which already exist are reused
+    Returns:
+        |   list: urls of the components, in the order given
+    """
+    run_metadata = handle["yaml"]["run_metadata"]
+
+    def _post(name: str) -> str:
+        return fdp_utils.post_entry(
+            token=token,
+            url=run_metadata["local_data_registry_url"],
+            endpoint="object_component",
+            data={"object": object_url, "name": name},
+            api_version=run_metadata["api_version"],
+        )["url"]
+
+    if not components:
+        return []
+    with fdp_utils.ContextThreadPoolExecutor(
+        max_workers=fdp_utils.get_max_workers(run_metadata)
+    ) as executor:
+        return list(executor.map(_post, components))
+
+
+def _place_output(
+    path: str,
+    new_path: str,
+    compression: Optional[str],
+    duplicate_path: Optional[str],
+) -> None:
+    """
+    Internal function to move an output from its temporary path into the
+    datastore, compressing it or sharing an existing copy as needed
+    """
+    new_directory = os.path.dirname(new_path)
+    if not os.path.exists(new_directory):
+        os.makedirs(new_directory)
+    if duplicate_path:
+        # Same content is already stored, e.g. with another
+        # public setting, so share it rather than copy it
+        if os.path.normpath(duplicate_path) == os.path.normpath(new_path):
+            method = "existing file"
+        else:
+            method = fdp_utils.link_or_copy(duplicate_path, new_path)
+        os.remove(path)
+    elif compression and not fdp_utils.get_compression(path):
+        fdp_utils.compress_file(path, new_path, compression)
+        os.remove(path)
+        method = "compress"
+    else:
+        method = fdp_utils.place_file(path, new_path)
+    logging.debug("Placed {} in datastore by {}".format(new_path, method))
+
+
+def _is_placed(path: str, new_path: str, file_hash: str) -> bool:
+    """
+    Internal function to return whether an output was already placed in the
+    datastore by a finalise which stopped before journaling its placement
+    """
+    return (
+        not os.path.exists(path)
+        and os.path.isfile(new_path)
+        and fdp_utils.get_data_hash(new_path) == file_hash
     )
 
-    coderuns_path = os.path.join(
-        handle["fdp_config_dir"], "coderuns.txt"
-    ).replace("\\", "/")
 
-    with open(coderuns_path, "a+") as coderun_file:
-        coderun_file.seek(0)
-        data = coderun_file.read(100)
-        if len(data) > 0:
-            coderun_file.write("\n")
-        coderun_file.write(handle["code_run_uuid"])
+def _find_duplicate_file(
+    registry_url: str,
+    datastore: str,
+    datastore_root_id: str,
+    file_hash: str,
+    filename: str,
+    api_version: str,
+) -> Optional[str]:
+    """
+    Internal function to find a file in the datastore with the same content
+    and filename as an output, returns None if there is no such file
+    """
+    storage_locations = fdp_utils.get_entry(
+        url=registry_url,
+        endpoint="storage_location",
+        query={"hash": file_hash, "storage_root": datastore_root_id},
+        api_version=api_version,
+    )
+    for storage_location in storage_locations:
+        path = os.path.join(datastore, storage_location["path"])
+        if os.path.basename(path) == filename and os.path.isfile(path):
+            return path
+    return None
@@ -0,0 +1,305 @@
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from data_pipeline_api import fdp_utils, ref
+
+DIRECTIONS = ("ancestors", "descendants", "both")
+KINDS = ("object", "code_run", "data_product")
+
+_UP = "up"
+_DOWN = "down"
+
+
+def _endpoint(url: str) -> str:
+    """
+    Internal function to return the endpoint of a registry url
+    e.g. code_run for http://localhost:8000/api/code_run/1/
+    """
+    return ref.parse(url).endpoint
+
+
+class ProvenanceGraph:
+    """Lineage of data products and code runs held in memory.
+
+    The graph's nodes are objects (the stored data behind data products)
+    and code runs. An object has an edge to each code run using one of its
+    components as an input, and each code run has an edge to the objects
+    of its outputs. Data products and components are mapped onto their
+    objects, so any of them can be used in a query. Edges are stored as
+    compact adjacency arrays in both directions, and ancestor and
+    descendant queries are answered locally in O(V + E).
+
+    Use ProvenanceGraph.fetch to build the graph from the registry.
+    """
+
+    def __init__(self) -> None:
+        self._entities: Dict[str, dict] = {}
+        self._edges: Set[Tuple[str, str]] = set()
+        self._frozen = False
+        self._urls: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._data_products: Dict[int, List[str]] = {}
+        self._forward: tuple = (array("l", [0]), array("l"))
+        self._reverse: tuple = (array("l", [0]), array("l"))
+
+    @classmethod
+    def fetch(
+        cls,
+        url: str,
+        depth: Optional[int] = 3,
+        direction: str = "both",
+        token: Optional[str] = None,
+        api_version: str = "1.0.0",
+        max_workers: int = fdp_utils.DEFAULT_MAX_WORKERS,
+    ) -> "ProvenanceGraph":
+        """Fetches the lineage of a data product, object, component or
+        code run from the registry breadth first. The entities at each
+        level are fetched concurrently.
+
+        Args:
+            |   url: registry url to start from
+            |   depth: (optional) maximum number of code runs to follow
+            |       from the start, None for no limit, defaults to 3
+            |   direction: (optional) 'ancestors', 'descendants' or 'both'
+            |   token: (optional) registry token
+            |   api_version: (optional) registry api version
+            |   max_workers: (optional) number of concurrent requests
+
+        Returns:
+            |   ProvenanceGraph: the lineage
+        """
+
+        def _get(entity_url: str) -> dict:
+            return fdp_utils.get_entity_from_url(
+                entity_url, token=token, api_version=api_version
+            )
+
+        graph = cls()
+        graph.walk(url, _get, depth, direction, max_workers)
+        return graph
+
+    def walk(
+        self,
+        url: str,
+        get: Callable[[str], dict],
+        depth: Optional[int] = 3,
+        direction: str = "both",
+        max_workers: int = fdp_utils.DEFAULT_MAX_WORKERS,
+    ) -> None:
+        """Adds the lineage of an entity to the graph, see fetch.
+
+        Args:
+            |   url: registry url to start from
+            |   get: function returning the registry entry of a url
+            |   depth: (optional) maximum number of code runs to follow
+            |   direction: (optional) 'ancestors', 'descendants' or 'both'
+            |   max_workers: (optional) number of concurrent requests
+        """
+        if direction not in DIRECTIONS:
+            raise ValueError(
+                "direction must be one of {}".format(", ".join(DIRECTIONS))
+            )
+        directions = {
+            "ancestors": (_UP,),
+            "descendants": (_DOWN,),
+            "both": (_UP, _DOWN),
+        }[direction]
+        frontier = [(url, 0, way) for way in directions]
+        visited: Set[Tuple[str, str]] = set()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while frontier:
+                frontier = [
+                    item
+                    for item in frontier
+                    if (item[0], item[2]) not in visited
+                ]
+                visited.update((item[0], item[2]) for item in frontier)
+                missing = list(
+                    {item[0] for item in frontier} - self._entities.keys()
+                )
+                for entity_url, entity in zip(
+                    missing, executor.map(get, missing)
+                ):
+                    self._entities[entity_url] = entity
+                next_frontier: List[Tuple[str, int, str]] = []
+                for entity_url, level, way in frontier:
+                    next_frontier.extend(
+                        self._expand(entity_url, level, way, depth)
+                    )
+                frontier = next_frontier
+        self._frozen = False
+
+    def _expand(
+        self, url: str, level: int, way: str, depth: Optional[int]
+    ) -> List[Tuple[str, int, str]]:
+        """
+        Internal function to record the edges of a fetched entity and
+        return the entities to fetch next
+        """
+        entity = self._entities[url]
+        endpoint = _endpoint(url)
+        further = depth is None or level < depth
+        found: List[Tuple[str, int, str]] = []
+        if endpoint == "data_product":
+            found.append((entity["object"], level, way))
+        elif endpoint == "object":
+            found.extend(
+                (component, level, way)
+                for component in entity.get("components") or []
+            )
+        elif endpoint == "object_component":
+            found.append((entity["object"], level, way))
+            for code_run in entity.get("outputs_of") or []:
+                self._edges.add((code_run, url))
+                if way == _UP and further:
+                    found.append((code_run, level + 1, way))
+            for code_run in entity.get("inputs_of") or []:
+                self._edges.add((url, code_run))
+                if way == _DOWN and further:
+                    found.append((code_run, level + 1, way))
+        elif endpoint == "code_run":
+            for component in entity.get("inputs") or []:
+                self._edges.add((component, url))
+                if way == _UP:
+                    found.append((component, level, way))
+            for component in entity.get("outputs") or []:
+                self._edges.add((url, component))
+                if way == _DOWN:
+                    found.append((component, level, way))
+        return found
+
+    def _freeze(self) -> None:
+        """
+        Internal function to build the adjacency arrays from the fetched
+        entities
+        """
+        if self._frozen:
+            return
+        self._urls = []
+        self._ids = {}
+        self._data_products = {}
+        for url, entity in self._entities.items():
+            endpoint = _endpoint(url)
+            if endpoint in ("object", "code_run"):
+                self._ids[url] = len(self._urls)
+                self._urls.append(url)
+        data_products: Set[Tuple[str, str]] = set()
+        for url, entity in self._entities.items():
+            endpoint = _endpoint(url)
+            if endpoint == "object":
+                data_products.update(
+                    (data_product, url)
+                    for data_product in entity.get("data_products") or []
+                )
+            elif endpoint == "data_product":
+                data_products.add((url, entity["object"]))
+            elif endpoint == "object_component":
+                if entity["object"] in self._ids:
+                    self._ids[url] = self._ids[entity["object"]]
+        for data_product, obj in sorted(data_products):
+            if obj in self._ids:
+                self._ids[data_product] = self._ids[obj]
+                self._data_products.setdefault(self._ids[obj], []).append(
+                    data_product
+                )
+
+        edges = sorted(
+            {
+                (self._ids[source], self._ids[target])
+                for source, target in self._edges
+                if source in self._ids and target in self._ids
+            }
+        )
+        self._forward = self._adjacency(edges)
+        self._reverse = self._adjacency(
+            sorted((target, source) for source, target in edges)
+        )
+        self._frozen = True
+
+    def _adjacency(self, edges: Iterable[Tuple[int, int]]) -> tuple:
+        """
+        Internal function to return compressed adjacency arrays, the
+        neighbours of node n are targets[offsets[n]:offsets[n + 1]]
+        """
+        offsets = array("l", [0] * (len(self._urls) + 1))
+        targets = array("l")
+        for source, target in edges:
+            offsets[source + 1] += 1
+            targets.append(target)
+        for node in range(len(self._urls)):
+            offsets[node + 1] += offsets[node]
+        return offsets, targets
+
+    def _search(self, url: str, reverse: bool, kind: Optional[str]) -> list:
+        """
+        Internal function to return the urls reachable from url
+        """
+        if kind is not None and kind not in KINDS:
+            raise ValueError("kind must be one of {}".format(", ".join(KINDS)))
+        self._freeze()
+        if url not in self._ids:
+            raise KeyError("{} is not in the provenance graph".format(url))
+        offsets, targets = self._reverse if reverse else self._forward
+        start = self._ids[url]
+        seen = bytearray(len(self._urls))
+        seen[start] = 1
+        queue = deque([start])
+        found = []
+        while queue:
+            node = queue.popleft()
+            first, last = offsets[node], offsets[node + 1]
+            for target in targets[first:last]:
+                if not seen[target]:
+                    seen[target] = 1
+                    found.append(target)
+                    queue.append(target)
+        if kind == "data_product":
+            return [
+                data_product
+                for node in found
+                for data_product in self._data_products.get(node, [])
+            ]
+        return [
+            self._urls[node]
+            for node in found
+            if kind is None or _endpoint(self._urls[node]) == kind
+        ]
+
+    def ancestors(self, url: str, kind: Optional[str] = None) -> list:
+        """Returns everything a data product or code run was derived from,
+        nearest first.
+
+        Args:
+            |   url: url of a data product, object, component or code run
+            |   kind: (optional) only return 'object', 'code_run' or
+            |       'data_product' urls
+
+        Returns:
+            |   list: registry urls of the ancestors
+        """
+        return self._search(url, True, kind)
+
+    def descendants(self, url: str, kind: Optional[str] = None) -> list:
+        """Returns everything derived from a data product or code run,
+        nearest first.
+
+        Args:
+            |   url: url of a data product, object, component or code run
+            |   kind: (optional) only return 'object', 'code_run' or
+            |       'data_product' urls
+
+        Returns:
+            |   list: registry urls of the descendants
+        """
+        return self._search(url, False, kind)
+
+    def __len__(self) -> int:
+        self._freeze()
+        return len(self._urls)
+
+    def __contains__(self, url: object) -> bool:
+        self._freeze()
+        return url in self._ids
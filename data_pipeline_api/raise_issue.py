@@ -1,5 +1,147 @@
 import logging
-from typing import Optional
+from array import array
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Iterator, Optional, Set
+
+from data_pipeline_api import fdp_utils
+
+ISSUE_FIELDS = (
+    "index",
+    "type",
+    "use_data_product",
+    "use_component",
+    "version",
+    "use_namespace",
+    "issue",
+    "severity",
+    "group",
+)
+
+
+class IssueBuffer(MutableMapping):
+    """
+    Compact store for the issues raised in a code run, kept in
+    handle["issues"]. Each field is a column of codes into a table of
+    distinct values, so repeated issues cost a few bytes each. Issues are
+    keyed issue_0, issue_1, ... and read and changed as dictionaries, e.g.
+    handle["issues"]["issue_0"]["severity"] = 5, which write through to the
+    columns.
+    """
+
+    def __init__(self, issues: Optional[Mapping] = None) -> None:
+        self._columns = {field: array("l") for field in ISSUE_FIELDS}
+        self._values: list = []
+        self._codes: dict = {}
+        self._deleted: Set[int] = set()
+        for key, issue in (issues or {}).items():
+            self[key] = issue
+
+    def _encode(self, value: Any) -> int:
+        try:
+            key = (type(value), value)
+            code = self._codes.get(key)
+        except TypeError:
+            key, code = None, None
+        if code is None:
+            code = len(self._values)
+            self._values.append(value)
+            if key is not None:
+                self._codes[key] = code
+        return code
+
+    def _rows(self) -> int:
+        return len(self._columns["group"])
+
+    def _get_row(self, key: Any) -> int:
+        if not isinstance(key, str) or not key.startswith("issue_"):
+            raise KeyError(key)
+        try:
+            return int(key[len("issue_") :])
+        except ValueError:
+            raise KeyError(key)
+
+    def _get_value(self, row: int, field: str) -> Any:
+        return self._values[self._columns[field][row]]
+
+    def _set_value(self, row: int, field: str, value: Any) -> None:
+        self._columns[field][row] = self._encode(value)
+
+    def append(self, **issue: Any) -> str:
+        """
+        Adds an issue, with a value for each of ISSUE_FIELDS
+        Returns:
+            |   str: key of the issue e.g. issue_0
+        """
+        key = "issue_" + str(self._rows())
+        for field in ISSUE_FIELDS:
+            self._columns[field].append(self._encode(issue[field]))
+        return key
+
+    def __getitem__(self, key: str) -> "IssueView":
+        row = self._get_row(key)
+        if not 0 <= row < self._rows() or row in self._deleted:
+            raise KeyError(key)
+        return IssueView(self, row)
+
+    def __setitem__(self, key: str, issue: Mapping) -> None:
+        row = self._get_row(key)
+        if row < 0:
+            raise KeyError(key)
+        # Rows skipped by the key are kept as deleted issues
+        while self._rows() <= row:
+            self._deleted.add(self._rows())
+            self.append(**{field: None for field in ISSUE_FIELDS})
+        for field in ISSUE_FIELDS:
+            self._set_value(row, field, issue.get(field))
+        self._deleted.discard(row)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self._deleted.add(self._get_row(key))
+
+    def __iter__(self) -> Iterator[str]:
+        return (
+            "issue_" + str(row)
+            for row in range(self._rows())
+            if row not in self._deleted
+        )
+
+    def __len__(self) -> int:
+        return self._rows() - len(self._deleted)
+
+
+class IssueView(MutableMapping):
+    """
+    An issue in an IssueBuffer, read and changed as a dictionary of
+    ISSUE_FIELDS
+    """
+
+    def __init__(self, issues: IssueBuffer, row: int) -> None:
+        self._issues = issues
+        self._row = row
+
+    def __getitem__(self, field: str) -> Any:
+        if field not in ISSUE_FIELDS:
+            raise KeyError(field)
+        return self._issues._get_value(self._row, field)
+
+    def __setitem__(self, field: str, value: Any) -> None:
+        if field not in ISSUE_FIELDS:
+            raise KeyError(field)
+        self._issues._set_value(self._row, field, value)
+
+    def __delitem__(self, field: str) -> None:
+        raise TypeError("The fields of an issue cannot be removed")
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(ISSUE_FIELDS)
+
+    def __len__(self) -> int:
+        return len(ISSUE_FIELDS)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
 
 
 def raise_issue_by_index(
@@ -165,66 +307,44 @@ def raise_issue(
         "github_repo",
         "existing_data_product",
     }:
-        logging.info("Adding issue {} for {} to handle".format(issue, type))
+        logging.info("Adding issue %s for %s to handle", issue, issue_type)
     elif index is None:
-        reads = (
-            handle["yaml"]["read"] if "read" in handle["yaml"].keys() else None
-        )
-        writes = (
-            handle["yaml"]["write"]
-            if "write" in handle["yaml"].keys()
-            else None
-        )
+        indexes = fdp_utils.get_handle_indexes(handle)
+        read = indexes["read"].get(data_product)
+        write = indexes["write"].get(data_product)
         data_product_in_config = False
-        if reads:
-            for i in reads:
-                if i["data_product"] == data_product:
-                    data_product_in_config = True
-                    if (
-                        "use" in i.keys()
-                        and "use_version" in i["use"].keys()
-                        and i["use"]["version"] != version
-                    ):
-                        data_product_in_config = False
-                    data_product = i["data_product"]
-                    if not group:
-                        current_group = i["data_product"]
-        if writes:
-            for i in writes:
-                if i["data_product"] == data_product:
-                    data_product_in_config = (
-                        "use" not in i.keys()
-                        or "use_version" not in i["use"].keys()
-                        or i["use"]["version"] == version
-                    )
-
-                    data_product = i["data_product"]
-                    if not group:
-                        current_group = i["data_product"]
+        if read is not None:
+            data_product_in_config = not (
+                "use" in read.keys()
+                and "use_version" in read["use"].keys()
+                and read["use"]["version"] != version
+            )
+        if write is not None:
+            data_product_in_config = (
+                "use" not in write.keys()
+                or "use_version" not in write["use"].keys()
+                or write["use"]["version"] == version
+            )
+        if (read is not None or write is not None) and not group:
+            current_group = data_product
 
         if not data_product_in_config:
             raise ValueError("Data product not in config file")
 
         logging.info(
-            "Raising issue {} for {}@{} to handle".format(
-                issue, data_product, version
-            )
+            "Raising issue %s for %s@%s to handle",
+            issue,
+            data_product,
+            version,
         )
 
     else:
         tmp = None
-        if "output" in handle:
-            for output in handle["output"]:
-                if output == index:
-                    tmp = handle["output"][output]
-                    if not group:
-                        current_group = handle["output"][output]
-        if "input" in handle:
-            for input in handle["input"]:
-                if input == index:
-                    tmp = handle["input"][input]
-                    if not group:
-                        current_group = handle["input"][input]
+        for io_type in ("output", "input"):
+            if io_type in handle and index in handle[io_type]:
+                tmp = handle[io_type][index]
+                if not group:
+                    current_group = handle[io_type][index]
         if tmp is None:
             raise ValueError("Error: index not found in handle")
 
@@ -233,23 +353,19 @@ def raise_issue(
         version = tmp["use_version"]
         namespace = tmp["use_namespace"]
 
-        logging.info("Adding issue {} for {} to handle".format(issue, index))
-    # Write to handle and return path
-    issues_dict = {
-        "index": index,
-        "type": issue_type,
-        "use_data_product": data_product,
-        "use_component": component,
-        "version": version,
-        "use_namespace": namespace,
-        "issue": issue,
-        "severity": severity,
-        "group": current_group,
-    }
-
-    if "issues" in handle:
-        this_issue = "issue_" + str(len(handle["issues"]))
-        handle["issues"][this_issue] = issues_dict
-    else:
-        handle["issues"] = {}
-        handle["issues"]["issue_0"] = issues_dict
+        logging.info("Adding issue %s for %s to handle", issue, index)
+
+    # Write to handle
+    if not isinstance(handle.get("issues"), IssueBuffer):
+        handle["issues"] = IssueBuffer(handle.get("issues"))
+    handle["issues"].append(
+        index=index,
+        type=issue_type,
+        use_data_product=data_product,
+        use_component=component,
+        version=version,
+        use_namespace=namespace,
+        issue=issue,
+        severity=severity,
+        group=current_group,
+    )
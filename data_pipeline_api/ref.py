@@ -0,0 +1,76 @@
+import functools
+import sys
+from typing import Any, Optional
+
+PARSE_CACHE_SIZE = 65536
+
+
+class Ref:
+    """Compact reference to a registry entry by its endpoint and id.
+
+    Refs are hashable and compare equal when they refer to the same entry
+    of the same registry. The registry url and endpoint are interned and
+    the entry's url is formatted once, so refs are cheap to hold, compare
+    and turn back into urls. Use parse to get the ref of a url.
+
+    Args:
+        |   registry: url of the registry, e.g. http://localhost:8000/api/
+        |   endpoint: endpoint (table) of the entry
+        |   id: id of the entry
+    """
+
+    __slots__ = ("registry", "endpoint", "id", "_url")
+
+    def __init__(self, registry: str, endpoint: str, id: int) -> None:
+        if registry[-1] != "/":
+            registry += "/"
+        self.registry = sys.intern(registry)
+        self.endpoint = sys.intern(endpoint)
+        self.id = int(id)
+        self._url: Optional[str] = None
+
+    @property
+    def url(self) -> str:
+        """The url of the entry"""
+        if self._url is None:
+            self._url = "{}{}/{}/".format(
+                self.registry, self.endpoint, self.id
+            )
+        return self._url
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Ref):
+            return NotImplemented
+        return (
+            self.id == other.id
+            and self.endpoint == other.endpoint
+            and self.registry == other.registry
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.registry, self.endpoint, self.id))
+
+    def __repr__(self) -> str:
+        return "Ref({!r}, {!r}, {})".format(
+            self.registry, self.endpoint, self.id
+        )
+
+    def __str__(self) -> str:
+        return self.url
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse(url: str) -> Ref:
+    """
+    Internal function to return the ref of a registry url, e.g.
+    Ref('http://localhost:8000/api/', 'object', 5) for
+    http://localhost:8000/api/object/5/. Urls which are parsed again are
+    answered from a cache, with the same ref.
+    Raises:
+        |   ValueError: the url is not the url of a registry entry
+    """
+    parts = url.rstrip("/").rsplit("/", 2)
+    if len(parts) != 3 or not parts[2].isdigit():
+        raise ValueError("Not the url of a registry entry: {}".format(url))
+    registry, endpoint, id = parts
+    return Ref(registry, endpoint, int(id))
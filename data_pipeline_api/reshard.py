@@ -0,0 +1,152 @@
+import argparse
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from data_pipeline_api import fdp_utils
+
+
+def reshard_datastore(
+    token: str,
+    registry_url: str,
+    datastore: str,
+    layout: str = "sharded",
+    max_workers: int = fdp_utils.DEFAULT_MAX_WORKERS,
+    api_version: str = "1.0.0",
+) -> int:
+    """Moves the hash named files of a local datastore into the given layout
+    and updates the paths of their storage_locations in the registry.
+    Files are moved and storage_locations patched concurrently.
+
+    Args:
+        |   token: registry token
+        |   registry_url: url of the local registry
+        |   datastore: path of the local datastore (write_data_store)
+        |   layout: (optional) 'flat' or 'sharded', defaults to 'sharded'
+        |   max_workers: (optional) number of concurrent moves
+        |   api_version: (optional) registry api version
+
+    Returns:
+        |   int: number of files moved
+    """
+    layout = fdp_utils.validate_layout(layout)
+    datastore = fdp_utils.remove_local_from_root(datastore)
+    if registry_url[-1] != "/":
+        registry_url += "/"
+
+    storage_root = _get_storage_root(registry_url, datastore, api_version)
+    if not storage_root:
+        raise ValueError(f"Datastore {datastore} is not in the registry")
+
+    locations = fdp_utils.iter_entries(
+        url=registry_url,
+        endpoint="storage_location",
+        query={"storage_root": fdp_utils.extract_id(storage_root["url"])},
+        token=token,
+        api_version=api_version,
+    )
+
+    def _move(location: dict) -> bool:
+        return _reshard_location(
+            token, location, datastore, layout, api_version
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        moved = sum(executor.map(_move, locations))
+
+    logging.info(
+        "Moved {} files in {} to the {} layout".format(
+            moved, datastore, layout
+        )
+    )
+    return moved
+
+
+def _get_storage_root(
+    registry_url: str, datastore: str, api_version: str
+) -> Optional[dict]:
+    """
+    Internal function to find the storage_root of a local datastore, which
+    may have been registered with or without file:// and a trailing separator
+    """
+    datastore = datastore.rstrip("/" + os.sep)
+    roots = [datastore + os.sep, datastore]
+    for root in [fdp_utils.FILE_PREFIX + root for root in roots] + roots:
+        storage_root = fdp_utils.get_entry(
+            url=registry_url,
+            endpoint="storage_root",
+            query={"root": root},
+            api_version=api_version,
+        )
+        if storage_root:
+            return fdp_utils.get_first_entry(storage_root)
+    return None
+
+
+def _reshard_location(
+    token: str, location: dict, datastore: str, layout: str, api_version: str
+) -> bool:
+    """
+    Internal function to move a single storage_location into a layout,
+    the file is moved back if the registry cannot be updated
+    """
+    path = location["path"]
+    if not fdp_utils.HASHED_FILENAME.match(os.path.basename(path)):
+        return False
+    new_path = fdp_utils.reshard_path(path, layout)
+    if new_path == path:
+        return False
+
+    src = os.path.join(datastore, path)
+    dst = os.path.join(datastore, new_path)
+    if not os.path.exists(src):
+        logging.warning("Ignoring missing file: {}".format(src))
+        return False
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    os.rename(src, dst)
+
+    try:
+        fdp_utils.patch_entry(
+            url=location["url"],
+            data={"path": new_path},
+            token=token,
+            api_version=api_version,
+        )
+    except Exception:
+        os.rename(dst, src)
+        raise
+
+    fdp_utils.remove_empty_directories(os.path.dirname(src), datastore)
+    return True
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Move a local datastore into a flat or sharded layout"
+    )
+    parser.add_argument("registry_url", help="url of the local registry")
+    parser.add_argument("datastore", help="path of the local datastore")
+    parser.add_argument("token", help="path to the registry token")
+    parser.add_argument(
+        "--layout", default="sharded", choices=fdp_utils.DATASTORE_LAYOUTS
+    )
+    parser.add_argument(
+        "--workers", type=int, default=fdp_utils.DEFAULT_MAX_WORKERS
+    )
+    parser.add_argument("--api-version", default="1.0.0")
+    args = parser.parse_args(argv)
+
+    moved = reshard_datastore(
+        token=fdp_utils.read_token(args.token),
+        registry_url=args.registry_url,
+        datastore=args.datastore,
+        layout=args.layout,
+        max_workers=args.workers,
+        api_version=args.api_version,
+    )
+    print(f"Moved {moved} files")
+
+
+if __name__ == "__main__":
+    main()
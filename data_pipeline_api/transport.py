@@ -0,0 +1,152 @@
+import socket
+import threading
+from typing import Any, Mapping, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+import requests
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+UNIX_SCHEME = "http+unix"
+UNIX_PREFIX = UNIX_SCHEME + "://"
+
+# Host the registry is addressed as over a socket given by an http+unix url
+UNIX_HOST = "localhost"
+
+
+def get_socket_path(url: str) -> str:
+    """
+    Internal function to return the socket path of an http+unix url, which
+    holds it quoted in place of the host, e.g. the socket of
+    http+unix://%2Frun%2Fregistry.sock/api/ is /run/registry.sock
+    """
+    return unquote(urlsplit(url).netloc)
+
+
+def get_registry_urls(url: str) -> Tuple[str, ...]:
+    """
+    Internal function to return the urls the registry at url gives its
+    entries by, an http+unix url also by the http://localhost/ url the
+    registry is addressed as over its socket
+    """
+    parts = urlsplit(url)
+    if parts.scheme != UNIX_SCHEME:
+        return (url,)
+    return (url, "http://{}{}".format(UNIX_HOST, parts.path))
+
+
+class _UnixConnection(HTTPConnection):
+    """HTTP connection made over a Unix domain socket"""
+
+    def __init__(self, *args: Any, socket_path: str, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self) -> socket.socket:
+        timeout = self.timeout
+        if timeout is not None and not isinstance(timeout, (int, float)):
+            timeout = socket.getdefaulttimeout()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.socket_path)
+        except socket.timeout as err:
+            sock.close()
+            raise ConnectTimeoutError(
+                self, "Connection to {} timed out".format(self.socket_path)
+            ) from err
+        except OSError as err:
+            sock.close()
+            raise NewConnectionError(
+                self,
+                "Failed to connect to {}: {}".format(self.socket_path, err),
+            ) from err
+        return sock
+
+
+class _UnixConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _UnixConnection
+
+
+class UnixSocketAdapter(requests.adapters.HTTPAdapter):
+    """Transport adapter sending HTTP requests over a Unix domain socket.
+
+    Mounted on the http+unix:// prefix of a session the socket is taken
+    from each url, e.g. http+unix://%2Frun%2Fregistry.sock/api/. Mounted on
+    the url of a registry, e.g. http://localhost:8000/, with socket_path
+    its requests are sent to socket_path rather than over TCP, and the
+    registry sees the same Host as over TCP.
+
+    Args:
+        |   socket_path: (optional) path of the socket, defaults to the
+        |       socket of each http+unix url
+        |   pool_maxsize: (optional) most connections kept to each socket
+        |   pool_block: (optional) whether requests beyond pool_maxsize
+        |       wait for a free connection
+    """
+
+    def __init__(
+        self,
+        socket_path: Optional[str] = None,
+        pool_maxsize: int = requests.adapters.DEFAULT_POOLSIZE,
+        pool_block: bool = False,
+    ) -> None:
+        self.socket_path = socket_path
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self._pools: dict = {}
+        self._pools_lock = threading.Lock()
+        super().__init__(pool_maxsize=pool_maxsize, pool_block=pool_block)
+
+    def get_connection_with_tls_context(
+        self,
+        request: requests.PreparedRequest,
+        verify: Any,
+        proxies: Optional[Mapping[str, str]] = None,
+        cert: Any = None,
+    ) -> _UnixConnectionPool:
+        return self._get_pool(request.url)  # type: ignore
+
+    def get_connection(
+        self, url: Any, proxies: Optional[Mapping[str, str]] = None
+    ) -> _UnixConnectionPool:
+        return self._get_pool(url)
+
+    def _get_pool(self, url: str) -> _UnixConnectionPool:
+        """
+        Internal function to return the connection pool of a url's socket
+        """
+        parts = urlsplit(url)
+        with self._pools_lock:
+            pool = self._pools.get(parts.netloc)
+            if pool is None:
+                if self.socket_path is None:
+                    socket_path = get_socket_path(url)
+                    host, port = UNIX_HOST, None
+                else:
+                    socket_path = self.socket_path
+                    host, port = parts.hostname or UNIX_HOST, parts.port
+                pool = _UnixConnectionPool(
+                    host,
+                    port,
+                    maxsize=self.pool_maxsize,
+                    block=self.pool_block,
+                    socket_path=socket_path,
+                )
+                self._pools[parts.netloc] = pool
+        return pool
+
+    def request_url(
+        self,
+        request: requests.PreparedRequest,
+        proxies: Optional[Mapping[str, str]],
+    ) -> str:
+        return request.path_url
+
+    def close(self) -> None:
+        super().close()
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
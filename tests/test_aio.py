@@ -0,0 +1,71 @@
+import asyncio
+import os
+
+import pytest
+
+import data_pipeline_api as pipeline
+import data_pipeline_api.fdp_utils as fdp_utils
+
+
+@pytest.fixture
+def test_dir() -> str:
+    return os.path.join(os.path.dirname(__file__), "ext")
+
+
+@pytest.fixture
+def token() -> str:
+    return fdp_utils.read_token(
+        os.path.join(os.path.expanduser("~"), ".fair/registry/token")
+    )
+
+
+@pytest.fixture
+def script(test_dir: str) -> str:
+    return os.path.join(test_dir, "test_script.sh")
+
+
+@pytest.fixture
+def config(test_dir: str) -> str:
+    return os.path.join(test_dir, "write_csv.yaml")
+
+
+@pytest.mark.pipeline
+def test_concurrent_code_runs(token: str, config: str, script: str) -> None:
+    async def code_run() -> dict:
+        handle = await pipeline.initialise_async(token, config, script)
+        path = await pipeline.link_write_async(handle, "test/csv")
+        with open(path, "w") as data:
+            data.write("a,b\n1,2\n")
+        await pipeline.raise_issue_with_config_async(handle, "Test", 4)
+        await pipeline.finalise_async(token, handle)
+        return handle
+
+    async def code_runs() -> list:
+        return await asyncio.gather(*(code_run() for _ in range(4)))
+
+    handles = asyncio.run(code_runs())
+    uuids = {handle["code_run_uuid"] for handle in handles}
+    assert len(uuids) == 4
+    for handle in handles:
+        assert handle["output"]["output_0"]["data_product_url"]
+
+
+@pytest.mark.utilities
+def test_async_client() -> None:
+    handle: dict = {"yaml": {}}
+
+    async def raise_issues() -> None:
+        async with pipeline.AsyncClient(max_connections=2) as client:
+            await client.raise_issue_with_config(handle, "Test", 4)
+            await client.raise_issue_with_github_repo(handle, "Test", 2)
+
+    asyncio.run(raise_issues())
+    assert len(handle["issues"]) == 2
+    assert handle["issues"]["issue_1"]["type"] == "github_repo"
+    adapter = fdp_utils.get_session().get_adapter("http://localhost")
+    assert adapter._pool_maxsize == 2  # type: ignore
+
+    # Clients which do not set a limit keep the limit of the process
+    asyncio.run(pipeline.AsyncClient().close())
+    assert fdp_utils.get_session().get_adapter("http://localhost") is adapter
+    fdp_utils.set_max_connections(fdp_utils.DEFAULT_MAX_CONNECTIONS)
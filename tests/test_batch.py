@@ -0,0 +1,125 @@
+import os
+from pathlib import Path
+from typing import Any
+
+import pytest
+import yaml
+
+import data_pipeline_api as pipeline
+import data_pipeline_api.fdp_utils as fdp_utils
+from data_pipeline_api import journal
+
+
+@pytest.fixture
+def test_dir() -> str:
+    return os.path.join(os.path.dirname(__file__), "ext")
+
+
+@pytest.fixture
+def token() -> str:
+    return fdp_utils.read_token(
+        os.path.join(os.path.expanduser("~"), ".fair/registry/token")
+    )
+
+
+@pytest.fixture
+def script(test_dir: str) -> str:
+    return os.path.join(test_dir, "test_script.sh")
+
+
+@pytest.fixture
+def config(test_dir: str) -> str:
+    return os.path.join(test_dir, "write_csv.yaml")
+
+
+@pytest.mark.pipeline
+def test_code_run_batch(token: str, config: str, script: str) -> None:
+    with pipeline.CodeRunBatch(token, config, script, commit_size=2) as batch:
+        handles = batch.initialise_many(3)
+        for handle in handles:
+            path = pipeline.link_write(handle, "test/csv")
+            with open(path, "w") as data:
+                data.write("a,b\n1,2\n")
+            batch.finalise(handle)
+        assert batch.committed == 2
+    assert batch.committed == 3
+    assert len({handle["model_config"] for handle in handles}) == 1
+    assert len({handle["code_run"] for handle in handles}) == 3
+
+
+@pytest.mark.utilities
+def test_code_run_batch_commit_size(config: str, script: str) -> None:
+    with pytest.raises(ValueError):
+        pipeline.CodeRunBatch("token", config, script, commit_size=0)
+
+
+@pytest.fixture
+def offline_config(tmp_path: Path) -> str:
+    config = {
+        "run_metadata": {
+            "description": "Offline batch",
+            "local_data_registry_url": "https://test.com/api/",
+            "default_input_namespace": "testing",
+            "default_output_namespace": "testing",
+            "write_data_store": str(tmp_path / "datastore") + "/",
+            "local_repo": "./",
+            "script": "python3 py.test",
+            "public": True,
+            "latest_commit": "221bfe8b52bbfb3b2dbdc23037b7dd94b49aaa70",
+            "remote_repo": "https://github.com/FAIRDataPipeline/test",
+            "offline": True,
+        },
+        "write": [
+            {
+                "data_product": "test/csv",
+                "description": "test csv file with simple data",
+                "file_type": "csv",
+                "use": {"version": "0.0.1"},
+            }
+        ],
+    }
+    config_path = str(tmp_path / "config.yaml")
+    with open(config_path, "w") as data:
+        yaml.safe_dump(config, data)
+    return config_path
+
+
+def _queue_code_run(batch: pipeline.CodeRunBatch) -> dict:
+    handle = batch.initialise()
+    path = pipeline.link_write(handle, "test/csv")
+    with open(path, "w") as data:
+        data.write("a,b\n1,2\n")
+    batch.finalise(handle)
+    return handle
+
+
+@pytest.mark.utilities
+def test_code_run_batch_block_fails(offline_config: str, script: str) -> None:
+    with pytest.raises(RuntimeError):
+        with pipeline.CodeRunBatch("token", offline_config, script) as batch:
+            handle = _queue_code_run(batch)
+            raise RuntimeError("The sweep failed")
+    assert batch.committed == 1
+    assert handle["output"]["output_0"]["data_product_url"]
+    assert not os.path.exists(journal.get_journal_path(handle))
+
+
+@pytest.mark.utilities
+def test_code_run_batch_commit_fails(
+    offline_config: str, script: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def _finalise(*args: Any) -> None:
+        raise ValueError("The registry is down")
+
+    with pytest.raises(RuntimeError):
+        with pipeline.CodeRunBatch("token", offline_config, script) as batch:
+            handle = _queue_code_run(batch)
+            monkeypatch.setattr(pipeline.pipeline, "_finalise", _finalise)
+            raise RuntimeError("The sweep failed")
+    monkeypatch.undo()
+
+    # The queued code run is journaled, to be resumed
+    journal_path = journal.get_journal_path(handle)
+    assert journal.load_handle(journal_path)["code_run"] == handle["code_run"]
+    handle = pipeline.resume_finalise("token", journal_path)
+    assert handle["output"]["output_0"]["data_product_url"]
@@ -0,0 +1,185 @@
+import os
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+
+from data_pipeline_api import bundle, fdp_utils
+
+API = "https://test.com/api/"
+TARGET = "https://target.com/api/"
+CONTENT = b"a,b\n1,2\n"
+
+
+@pytest.mark.utilities
+def test_collect_rows() -> None:
+    rows: Dict[str, dict] = {
+        API
+        + "data_product/1/": {
+            "object": API + "object/1/",
+            "namespace": API + "namespace/1/",
+        },
+        API
+        + "object/1/": {
+            "components": [API + "object_component/1/"],
+            "storage_location": API + "storage_location/1/",
+        },
+        API
+        + "object_component/1/": {
+            "object": API + "object/1/",
+            "outputs_of": [API + "code_run/1/"],
+        },
+        API
+        + "storage_location/1/": {
+            "storage_root": API + "storage_root/1/",
+            "path": "testing/SEIRS/results.csv",
+        },
+        API + "storage_root/1/": {"root": "https://github.com/"},
+        API + "namespace/1/": {"name": "testing"},
+    }
+    collected = bundle.collect_rows(
+        API + "data_product/1/", rows.__getitem__, max_workers=2
+    )
+    # outputs_of is not followed, so the code run is not exported
+    assert collected == rows
+
+
+class _Registry:
+    """Registry keeping its entries in memory"""
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.entries: Dict[str, dict] = {}
+
+    def _matches(self, value: Any, query_value: Any) -> bool:
+        if isinstance(value, str) and value.startswith(self.url):
+            value = fdp_utils.extract_id(value)
+        return str(value) == str(query_value)
+
+    def get_entry(
+        self, url: str, endpoint: str, query: dict, api_version: str
+    ) -> list:
+        return [
+            entry
+            for entry_url, entry in self.entries.items()
+            if bundle._endpoint(entry_url) == endpoint
+            and all(
+                self._matches(entry.get(field), value)
+                for field, value in query.items()
+            )
+        ]
+
+    def post_entry(self, endpoint: str, data: dict, **kwargs: Any) -> dict:
+        # A post of an existing entry returns it, as post_entry does
+        for entry in self.get_entry(self.url, endpoint, {}, "1.0.0"):
+            if all(entry.get(field) == data[field] for field in data):
+                return entry
+        url = "{}{}/{}/".format(self.url, endpoint, len(self.entries) + 1)
+        self.entries[url] = dict(data, url=url)
+        return self.entries[url]
+
+
+def _export(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, path: str) -> str:
+    source = str(tmp_path / "source")
+    local_file = os.path.normpath(os.path.join(source, path))
+    os.makedirs(source, exist_ok=True)
+    os.makedirs(os.path.dirname(local_file), exist_ok=True)
+    with open(local_file, "wb") as data:
+        data.write(CONTENT)
+    rows = {
+        API
+        + "data_product/1/": {
+            "name": "test/csv",
+            "version": "0.0.1",
+            "object": API + "object/1/",
+            "namespace": API + "namespace/1/",
+        },
+        API
+        + "object/1/": {
+            "components": [API + "object_component/1/"],
+            "storage_location": API + "storage_location/1/",
+        },
+        API
+        + "object_component/1/": {
+            "object": API + "object/1/",
+            "name": "whole_object",
+            "whole_object": True,
+        },
+        API
+        + "storage_location/1/": {
+            "path": path,
+            "hash": fdp_utils.get_file_hash(local_file),
+            "public": True,
+            "storage_root": API + "storage_root/1/",
+        },
+        API + "storage_root/1/": {"root": "file://" + source + "/"},
+        API + "namespace/1/": {"name": "testing"},
+    }
+    monkeypatch.setattr(
+        fdp_utils, "get_entity_from_url", lambda url, **kwargs: rows[url]
+    )
+    bundle_path = str(tmp_path / "bundle.tar.gz")
+    assert bundle.export_bundle(API + "data_product/1/", bundle_path) == {
+        "rows": 6,
+        "files": 1,
+    }
+    return bundle_path
+
+
+def _use_registry(monkeypatch: pytest.MonkeyPatch) -> _Registry:
+    registry = _Registry(TARGET)
+    monkeypatch.setattr(fdp_utils, "get_entry", registry.get_entry)
+    monkeypatch.setattr(fdp_utils, "post_entry", registry.post_entry)
+    monkeypatch.setattr(
+        fdp_utils,
+        "post_storage_root",
+        lambda data, **kwargs: registry.post_entry(
+            "storage_root", {"root": "file://" + data["root"]}
+        ),
+    )
+    return registry
+
+
+@pytest.mark.utilities
+def test_export_import_bundle(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    bundle_path = _export(tmp_path, monkeypatch, "testing/test/data.csv")
+    registry = _use_registry(monkeypatch)
+    datastore = str(tmp_path / "datastore") + "/"
+    summary = bundle.import_bundle(bundle_path, TARGET, datastore, "token")
+    assert summary["rows"] == 6
+    assert summary["files_written"] == 1
+
+    # The rows refer to the rows created in the target registry
+    data_product = registry.entries[summary["url"]]
+    obj = registry.entries[data_product["object"]]
+    location = registry.entries[obj["storage_location"]]
+    root = registry.entries[location["storage_root"]]
+    assert root["root"] == "file://" + datastore
+    with open(os.path.join(datastore, location["path"]), "rb") as data:
+        assert data.read() == CONTENT
+
+    # Importing again reuses the rows and the stored file
+    entries = len(registry.entries)
+    again = bundle.import_bundle(bundle_path, TARGET, datastore, "token")
+    assert again["url"] == summary["url"]
+    assert again["files_written"] == 0
+    assert again["files_skipped"] == 1
+    assert len(registry.entries) == entries
+
+
+@pytest.mark.utilities
+def test_import_bundle_outside_datastore(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    bundle_path = _export(tmp_path, monkeypatch, "../outside.csv")
+    os.remove(tmp_path / "outside.csv")
+    registry = _use_registry(monkeypatch)
+    datastore = str(tmp_path / "datastore") + "/"
+    with pytest.raises(ValueError, match="outside the datastore"):
+        bundle.import_bundle(bundle_path, TARGET, datastore, "token")
+    assert not os.path.exists(tmp_path / "outside.csv")
+    assert [bundle._endpoint(url) for url in registry.entries] == [
+        "storage_root"
+    ]
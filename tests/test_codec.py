@@ -0,0 +1,41 @@
+import pytest
+
+from data_pipeline_api import codec
+
+BACKENDS = [
+    backend for backend in codec.BACKENDS if codec.is_available(backend)
+]
+
+
+@pytest.mark.utilities
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_codec(backend: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(codec, "_BACKEND", backend)
+    data = {
+        "inputs": ["https://test.com/api/object_component/1/"],
+        "description": "Café",
+        "public": True,
+        "size": 3,
+    }
+    assert codec.loads(codec.dumps(data)) == data
+
+    page = codec.loads_page(
+        b'{"count": 3, "next": "https://test.com/api/object/?page=2",'
+        b' "previous": null, "results": [{"id": 1}, {"id": 2}]}'
+    )
+    assert page.results == [{"id": 1}, {"id": 2}]
+    assert page.next == "https://test.com/api/object/?page=2"
+    assert codec.loads_page(b'{"results": []}').next is None
+    with pytest.raises(ValueError):
+        codec.loads(b"<html>")
+
+
+@pytest.mark.utilities
+def test_set_backend(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(codec, "_BACKEND", "json")
+    codec.set_backend()
+    assert codec.get_backend() == BACKENDS[0]
+    codec.set_backend("json")
+    assert codec.get_backend() == "json"
+    with pytest.raises(ValueError):
+        codec.set_backend("yaml")
@@ -0,0 +1,119 @@
+import os
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError, Pipe
+from multiprocessing.connection import Client
+from pathlib import Path
+
+import pytest
+
+import data_pipeline_api as pipeline
+from data_pipeline_api import daemon
+
+
+@daemon.delegate("path")
+def _link(handle: dict, path: str) -> str:
+    if not path.endswith(".csv"):
+        raise ValueError("Error: not a csv")
+    handle.setdefault("output", {})["output_0"] = {"path": path}
+    return path
+
+
+@pytest.mark.utilities
+def test_delegate(monkeypatch: pytest.MonkeyPatch) -> None:
+    client, server = Pipe()
+    thread = threading.Thread(target=daemon._serve_connection, args=(server,))
+    thread.start()
+    monkeypatch.setattr(daemon, "_get_connection", lambda: client)
+
+    handle: dict = {"yaml": {}}
+    assert _link(handle, "data.csv") == os.path.abspath("data.csv")
+    assert handle == {
+        "yaml": {},
+        "output": {"output_0": {"path": os.path.abspath("data.csv")}},
+    }
+    with pytest.raises(ValueError, match="not a csv"):
+        _link(handle, "data.txt")
+    client.close()
+    thread.join()
+
+
+@pytest.mark.utilities
+def test_delegate_without_daemon(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv(daemon.SOCKET_ENVIRONMENT, str(tmp_path / "d.sock"))
+    monkeypatch.setattr(daemon, "_RUNNING", None)
+    handle: dict = {}
+    assert _link(handle, "data.csv") == "data.csv"
+    assert daemon._RUNNING is False
+
+
+@pytest.fixture
+def address(tmp_path: Path) -> str:
+    if not hasattr(socket, "AF_UNIX") or not hasattr(os, "getuid"):
+        pytest.skip("needs Unix domain sockets")
+    directory = tmp_path / "daemon"
+    directory.mkdir()
+    directory.chmod(0o700)
+    return str(directory / "daemon.sock")
+
+
+@pytest.mark.utilities
+def test_daemon_directory(
+    address: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    daemon.check_directory(os.path.dirname(address))
+
+    # A directory others can access is neither served nor delegated to
+    os.chmod(os.path.dirname(address), 0o755)
+    monkeypatch.setattr(daemon, "_SERVING", False)
+    with pytest.raises(daemon.DaemonError):
+        daemon.serve(address)
+    assert not os.path.exists(daemon.get_authkey_path(address))
+    monkeypatch.setattr(daemon, "_SERVING", False)
+    monkeypatch.setenv(daemon.SOCKET_ENVIRONMENT, address)
+    monkeypatch.setattr(daemon, "_RUNNING", None)
+    handle: dict = {}
+    assert _link(handle, "data.csv") == "data.csv"
+    assert daemon._RUNNING is False
+
+
+@pytest.mark.utilities
+def test_daemon_authkey(address: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "data_pipeline_api.daemon",
+            "--socket",
+            address,
+        ],
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+    )
+    try:
+        for _ in range(100):
+            if os.path.exists(address):
+                break
+            time.sleep(0.1)
+        authkey_path = daemon.get_authkey_path(address)
+        assert stat.S_IMODE(os.stat(authkey_path).st_mode) == 0o600
+
+        # Clients without the key are refused
+        with pytest.raises(AuthenticationError):
+            Client(address, family="AF_UNIX", authkey=b"wrong")
+
+        monkeypatch.setenv(daemon.SOCKET_ENVIRONMENT, address)
+        monkeypatch.setattr(daemon, "_RUNNING", None)
+        monkeypatch.setattr(daemon, "_LOCAL", threading.local())
+        with pytest.raises(ValueError, match="No handle recorded"):
+            pipeline.resume_finalise("token", "missing.journal")
+        assert daemon._RUNNING is True
+        daemon._LOCAL.connection.close()
+    finally:
+        process.terminate()
+        process.wait()
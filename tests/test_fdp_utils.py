@@ -1,8 +1,12 @@
 # Test fdp_utils
 
 import datetime
+import gzip
+import json
 import os
 import platform
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
 
 import pytest
 from _pytest.fixtures import FixtureRequest
@@ -129,6 +133,21 @@ def test_get_file_hash(test_dir: str) -> None:
         )
 
 
+@pytest.mark.utilities
+def test_get_file_hash_cache(tmp_path: Path) -> None:
+    file_path = os.path.join(tmp_path, "data.csv")
+    with open(file_path, "w") as data:
+        data.write("a,b\n")
+    os.utime(file_path, (1, 1))
+    file_hash = fdp_utils.get_file_hash(file_path)
+    assert fdp_utils.get_file_hash(file_path) == file_hash
+
+    with open(file_path, "w") as data:
+        data.write("c,d\n")
+    os.utime(file_path, (1, 1))
+    assert fdp_utils.get_file_hash(file_path) != file_hash
+
+
 @pytest.mark.utilities
 def test_random_hash_is_string() -> None:
     assert type(fdp_utils.random_hash()) == str
@@ -424,3 +443,449 @@ def test_post_storage_root_with_local(url: str, token: str) -> None:
         token=token, url=url, data={"root": f'{os.sep}test{os.sep}test', "local": True}
     )
     assert storage_root["root"] == f'file://{os.sep}test{os.sep}test{os.sep}'
+
+
+@pytest.mark.utilities
+@pytest.mark.parametrize("compression", ["gzip", "bz2", "lzma"])
+def test_compress_file(
+    test_dir: str, tmp_path: Path, compression: str
+) -> None:
+    file_path = os.path.join(test_dir, "test.csv")
+    compressed = os.path.join(
+        tmp_path, "test.csv" + fdp_utils.COMPRESSION_SUFFIXES[compression]
+    )
+    file_hash = fdp_utils.compress_file(file_path, compressed, compression)
+    assert file_hash == fdp_utils.get_file_hash(file_path)
+    assert fdp_utils.get_compression(compressed) == compression
+
+    # Another process writing the same file keeps its own temporary file
+    decompressed = os.path.join(tmp_path, "test.csv")
+    with open(decompressed + ".part", "w") as other:
+        other.write("partial")
+    fdp_utils.decompress_file(compressed, decompressed)
+    assert fdp_utils.get_file_hash(decompressed) == file_hash
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [os.path.basename(compressed), "test.csv", "test.csv.part"]
+    )
+
+
+@pytest.mark.utilities
+def test_validate_compression() -> None:
+    assert fdp_utils.validate_compression(None) is None
+    assert fdp_utils.validate_compression("gzip") == "gzip"
+    with pytest.raises(ValueError):
+        fdp_utils.validate_compression("zip")
+
+
+@pytest.mark.utilities
+def test_strip_compression_suffix() -> None:
+    assert fdp_utils.strip_compression_suffix("abc.csv.gz") == "abc.csv"
+    assert fdp_utils.strip_compression_suffix("abc.csv") == "abc.csv"
+
+
+@pytest.mark.utilities
+def test_get_data_hash(tmp_path: Path) -> None:
+    path = os.path.join(tmp_path, "data.csv")
+    with open(path, "wb") as data:
+        data.write(b"a,b\n1,2\n")
+    with gzip.open(path + ".gz", "wb") as data:
+        data.write(b"a,b\n1,2\n")
+    assert fdp_utils.get_data_hash(path + ".gz") == (
+        fdp_utils.get_file_hash(path)
+    )
+    os.rename(path + ".gz", path + ".part")
+    assert fdp_utils.get_data_hash(path + ".part", "gzip") == (
+        fdp_utils.get_file_hash(path)
+    )
+
+
+@pytest.mark.utilities
+def test_hashing_writer(test_dir: str, tmp_path: Path) -> None:
+    file_path = os.path.join(test_dir, "test.csv")
+    hashes: list = []
+    with open(file_path, "rb") as data:
+        content = data.read()
+    with open(os.path.join(tmp_path, "test.csv"), "wb") as raw:
+        writer = fdp_utils.HashingWriter(raw, hashes.append)
+        writer.write(content)
+        writer.close()
+    assert hashes == [fdp_utils.get_file_hash(file_path)]
+
+
+@pytest.mark.utilities
+def test_get_storage_path() -> None:
+    filename = "51345410c236d375ccf47149196746bc7f4db29d.csv"
+    assert (
+        fdp_utils.get_storage_path("testing", "test/csv", filename)
+        == "testing/test/csv/" + filename
+    )
+    assert (
+        fdp_utils.get_storage_path("testing", "test/csv", filename, "sharded")
+        == "testing/test/csv/51/34/" + filename
+    )
+    with pytest.raises(ValueError):
+        fdp_utils.get_storage_path("testing", "test/csv", filename, "deep")
+
+
+@pytest.mark.utilities
+def test_reshard_path() -> None:
+    flat = "testing/test/csv/51345410c236d375ccf47149196746bc7f4db29d.csv"
+    sharded = fdp_utils.reshard_path(flat, "sharded")
+    assert sharded == (
+        "testing/test/csv/51/34/51345410c236d375ccf47149196746bc7f4db29d.csv"
+    )
+    assert fdp_utils.reshard_path(sharded, "sharded") == sharded
+    assert fdp_utils.reshard_path(sharded, "flat") == flat
+
+
+@pytest.mark.utilities
+def test_place_file(test_dir: str, tmp_path: Path) -> None:
+    src = os.path.join(tmp_path, "src.csv")
+    dst = os.path.join(tmp_path, "dst.csv")
+    with open(os.path.join(test_dir, "test.csv"), "rb") as data:
+        content = data.read()
+    with open(src, "wb") as data:
+        data.write(content)
+    assert fdp_utils.place_file(src, dst) == "rename"
+    assert not os.path.exists(src)
+    with open(dst, "rb") as data:
+        assert data.read() == content
+
+
+@pytest.mark.utilities
+def test_link_or_copy(test_dir: str, tmp_path: Path) -> None:
+    src = os.path.join(test_dir, "test.csv")
+    dst = os.path.join(tmp_path, "dst.csv")
+    method = fdp_utils.link_or_copy(src, dst)
+    assert method in {"reflink", "hardlink", "copy"}
+    assert os.path.exists(src)
+    assert fdp_utils.get_file_hash(dst) == fdp_utils.get_file_hash(src)
+
+
+@pytest.mark.utilities
+def test_remove_empty_directories(tmp_path: Path) -> None:
+    directory = os.path.join(tmp_path, "a", "b", "c")
+    os.makedirs(directory)
+    with open(os.path.join(tmp_path, "a", "keep.txt"), "w") as data:
+        data.write("keep")
+    fdp_utils.remove_empty_directories(directory, str(tmp_path))
+    assert not os.path.exists(os.path.join(tmp_path, "a", "b"))
+    assert os.path.exists(os.path.join(tmp_path, "a"))
+
+
+@pytest.mark.utilities
+def test_get_issue_component_key() -> None:
+    handle: dict = {
+        "model_config": "http://localhost:8000/api/object/1/",
+        "output": {
+            "output_0": {
+                "component_url": "http://localhost:8000/api/object_component/2/"
+            }
+        },
+    }
+    issue = {
+        "index": None,
+        "type": "config",
+        "use_data_product": None,
+        "use_component": None,
+        "version": None,
+        "use_namespace": None,
+    }
+    assert fdp_utils._get_issue_component_key(handle, issue) == (
+        "object",
+        handle["model_config"],
+    )
+    issue.update(
+        index="output_0",
+        type="index",
+        use_data_product="test/csv",
+        version="0.0.1",
+        use_namespace="testing",
+    )
+    assert fdp_utils._get_issue_component_key(handle, issue) == (
+        "url",
+        handle["output"]["output_0"]["component_url"],
+    )
+    issue["index"] = None
+    assert fdp_utils._get_issue_component_key(handle, issue) == (
+        "data_product",
+        "testing",
+        "test/csv",
+        "0.0.1",
+        None,
+    )
+
+
+@pytest.mark.utilities
+def test_get_handle_indexes() -> None:
+    handle: dict = {
+        "yaml": {
+            "read": [{"data_product": "test/csv"}],
+            "write": [
+                {"data_product": "test/csv", "description": "first"},
+                {"data_product": "test/csv", "description": "last"},
+            ],
+        },
+        "output": {"output_0": {"path": "a.csv"}},
+    }
+    indexes = fdp_utils.get_handle_indexes(handle)
+    assert indexes["write"]["test/csv"]["description"] == "last"
+    assert indexes["path"] == {"a.csv": "output_0"}
+    assert fdp_utils.get_handle_indexes(handle) is indexes
+    assert list(handle) == ["yaml", "output"]
+
+    # The tables of a config without reads are cached too
+    del handle["yaml"]["read"]
+    indexes = fdp_utils.get_handle_indexes(handle)
+    assert indexes["read"] == {}
+    assert fdp_utils.get_handle_indexes(handle) is indexes
+
+    handle["input"] = {"input_0": {"path": "b.csv"}}
+    assert fdp_utils.get_handle_index_from_path(handle, "b.csv") == "input_0"
+    handle["output"]["output_0"]["path"] = "c.csv"
+    assert fdp_utils.get_handle_index_from_path(handle, "c.csv") == "output_0"
+    assert fdp_utils.get_handle_index_from_path(handle, "a.csv") is None
+
+
+class _Pages:
+    """Session returning a query's results two items per page"""
+
+    def __init__(self, items: list) -> None:
+        self.items = items
+        self.requested: list = []
+
+    def get(self, url: str, **kwargs: dict) -> object:
+        self.requested.append(url)
+        page = int(url.split("page=")[-1]) if "page=" in url else 1
+        start, end = (page - 1) * 2, page * 2
+        results = self.items[start:end]
+        more = page * 2 < len(self.items)
+
+        class _Response:
+            status_code = 200
+            content = json.dumps(
+                {
+                    "results": results,
+                    "next": url + "&page=" + str(page + 1) if more else None,
+                }
+            ).encode()
+
+        return _Response()
+
+
+@pytest.mark.utilities
+def test_get_query_string() -> None:
+    query = {
+        "name": "SEIRS model & data",
+        "storage_root": "https://test.com/api/storage_root/1/",
+        "inputs": [
+            "https://test.com/api/object_component/2/",
+            "https://test.com/api/object_component/3/",
+        ],
+        "public": True,
+    }
+    copy = dict(query)
+    assert fdp_utils.get_query_string("https://test.com/api", query) == (
+        "inputs=2,3&name=SEIRS%20model%20%26%20data&public=True"
+        "&storage_root=1"
+    )
+    assert query == copy
+    assert fdp_utils.get_query_string(
+        "https://test.com/api/", dict(reversed(query.items()))
+    ) == fdp_utils.get_query_string("https://test.com/api/", query)
+
+
+@pytest.mark.utilities
+def test_iter_entries(monkeypatch: pytest.MonkeyPatch) -> None:
+    session = _Pages([{"id": i} for i in range(5)])
+    monkeypatch.setattr(fdp_utils, "get_session", lambda: session)
+    query = {"storage_root": "https://test.com/api/storage_root/1/"}
+    entries = fdp_utils.iter_entries(
+        "https://test.com/api/", "storage_location", query, page_size=2
+    )
+    assert next(entries) == {"id": 0}
+    assert [entry["id"] for entry in entries] == [1, 2, 3, 4]
+    assert len(session.requested) == 3
+    assert session.requested[0] == (
+        "https://test.com/api/storage_location/?page_size=2&storage_root=1"
+    )
+    assert fdp_utils.get_entry(
+        "https://test.com/api/", "storage_location", query
+    ) == [{"id": 0}, {"id": 1}]
+
+
+class _Responses:
+    """Session returning scripted responses"""
+
+    def __init__(self, *responses: tuple) -> None:
+        self.responses = list(responses)
+        self.requested: list = []
+        self.timeouts: list = []
+
+    def _respond(self, url: str, **kwargs: dict) -> object:
+        self.requested.append(url)
+        self.timeouts.append(kwargs.get("timeout"))
+        status_code, body = self.responses.pop(0)
+
+        class _Response:
+            headers: dict = {}
+            content = json.dumps(body).encode()
+
+        response = _Response()
+        response.status_code = status_code  # type: ignore
+        return response
+
+    get = post = patch = _respond
+
+
+@pytest.mark.utilities
+def test_post_entry_retry(monkeypatch: pytest.MonkeyPatch) -> None:
+    session = _Responses((503, {}), (502, {}), (201, {"url": "created"}))
+    monkeypatch.setattr(fdp_utils, "get_session", lambda: session)
+    monkeypatch.setattr(fdp_utils.time, "sleep", lambda delay: None)
+    entry = fdp_utils.post_entry(
+        "https://test.com/api/", "namespace", {"name": "test"}, "token"
+    )
+    assert entry == {"url": "created"}
+    assert len(session.requested) == 3
+
+    # Objects are not unique, so a repeated post could duplicate them
+    session = _Responses((503, {}), (201, {"url": "created"}))
+    monkeypatch.setattr(fdp_utils, "get_session", lambda: session)
+    with pytest.raises(ValueError):
+        fdp_utils.post_entry(
+            "https://test.com/api/", "object", {"description": "x"}, "token"
+        )
+
+    # The registry sets the uuid of a code run posted without one
+    session = _Responses((503, {}), (201, {"url": "created"}))
+    monkeypatch.setattr(fdp_utils, "get_session", lambda: session)
+    with pytest.raises(ValueError):
+        fdp_utils.post_entry(
+            "https://test.com/api/", "code_run", {"description": "x"}, "token"
+        )
+    assert len(session.requested) == 1
+
+
+@pytest.mark.utilities
+def test_set_request_limits(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(fdp_utils, "_LIMITERS", {})
+    monkeypatch.setattr(fdp_utils, "_LIMITER_SETTINGS", None)
+    assert fdp_utils.get_limiter("https://test.com/api/") is None
+    fdp_utils.configure_requests({"registry_max_requests": 10})
+    request_limiter = fdp_utils.get_limiter("https://test.com/api/")
+    assert request_limiter is not None
+
+    # Applying the same limits again keeps what the limiter has learnt
+    fdp_utils.configure_requests({"registry_max_requests": 10})
+    assert fdp_utils.get_limiter("https://test.com/api/") is request_limiter
+    fdp_utils.configure_requests({"registry_max_requests": 2})
+    request_limiter = fdp_utils.get_limiter("https://test.com/api/")
+    assert request_limiter is not None
+    assert request_limiter.max_requests == 2
+    fdp_utils.set_request_limits(None)
+    assert fdp_utils.get_limiter("https://test.com/api/") is None
+
+
+@pytest.mark.utilities
+def test_get_request_kind() -> None:
+    assert (
+        fdp_utils._get_request_kind("patch", "http://test.com/api/code_run/3/")
+        == "patch code_run"
+    )
+    assert (
+        fdp_utils._get_request_kind(
+            "get", "http://test.com/api/object/?name=test"
+        )
+        == "get object"
+    )
+
+
+@pytest.mark.utilities
+def test_deadline(monkeypatch: pytest.MonkeyPatch) -> None:
+    session = _Responses((503, {}), (201, {"url": "created"}))
+    monkeypatch.setattr(fdp_utils, "get_session", lambda: session)
+    monkeypatch.setattr(fdp_utils.time, "sleep", lambda delay: None)
+    with fdp_utils.deadline(30):
+        fdp_utils.post_entry(
+            "https://test.com/api/", "namespace", {"name": "test"}, "token"
+        )
+        assert all(
+            timeout <= 30
+            for timeouts in session.timeouts
+            for timeout in timeouts
+        )
+
+        # The deadline is copied into the workers
+        with fdp_utils.ContextThreadPoolExecutor(max_workers=1) as executor:
+            remaining = executor.submit(fdp_utils.get_remaining_time).result()
+        assert remaining is not None and 0 < remaining <= 30
+    assert fdp_utils.get_remaining_time() is None
+
+    # A retry which cannot be made before the deadline is not waited for
+    session = _Responses((503, {}), (201, {"url": "created"}))
+    monkeypatch.setattr(fdp_utils, "get_session", lambda: session)
+    with fdp_utils.deadline(0.01):
+        with pytest.raises(fdp_utils.DeadlineExceeded):
+            fdp_utils.post_entry(
+                "https://test.com/api/", "namespace", {"name": "test"}, "token"
+            )
+    assert len(session.requested) == 1
+
+    with fdp_utils.deadline(0):
+        with pytest.raises(fdp_utils.DeadlineExceeded):
+            fdp_utils.check_deadline()
+
+
+@pytest.mark.utilities
+def test_get_shared(monkeypatch: pytest.MonkeyPatch) -> None:
+    session = _Responses((200, {"id": 1}))
+    monkeypatch.setattr(fdp_utils, "get_session", lambda: session)
+    assert fdp_utils.get_entity("https://test.com/api/", "object", 1) == {
+        "id": 1
+    }
+    assert not fdp_utils._IN_FLIGHT
+
+    # Identical requests join the one in flight
+    url = "https://test.com/api/object/2"
+    headers = fdp_utils.get_headers()
+    request: Future = Future()
+    key = (url, tuple(sorted(headers.items())))
+    monkeypatch.setitem(fdp_utils._IN_FLIGHT, key, request)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        entities = [
+            executor.submit(
+                fdp_utils.get_entity, "https://test.com/api/", "object", 2
+            )
+            for _ in range(4)
+        ]
+        session.responses.append((200, {"id": 2}))
+        request.set_result(session.get(url))
+        assert [entity.result() for entity in entities] == [{"id": 2}] * 4
+    assert len(session.requested) == 2
+
+
+@pytest.mark.utilities
+def test_post_entry_409_unique_keys(monkeypatch: pytest.MonkeyPatch) -> None:
+    session = _Responses(
+        (409, {}),
+        (200, {"results": []}),
+        (200, {"results": [{"url": "existing"}]}),
+    )
+    monkeypatch.setattr(fdp_utils, "get_session", lambda: session)
+    entry = fdp_utils.post_entry(
+        "https://test.com/api/",
+        "storage_location",
+        {
+            "path": "new/path.csv",
+            "hash": "abc",
+            "public": True,
+            "storage_root": "https://test.com/api/storage_root/1/",
+        },
+        "token",
+    )
+    assert entry == {"url": "existing"}
+    assert session.requested[2] == (
+        "https://test.com/api/storage_location/"
+        "?hash=abc&public=True&storage_root=1"
+    )
@@ -0,0 +1,70 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import data_pipeline_api.journal as journal
+
+
+@pytest.fixture
+def handle(tmp_path: Path) -> dict:
+    return {
+        "yaml": {"run_metadata": {"description": "Test journal"}},
+        "fdp_config_dir": str(tmp_path),
+        "code_run": "http://localhost:8000/api/code_run/1/",
+        "code_run_uuid": "0000-1111",
+        "output": {"output_0": {"data_product": "test/csv"}},
+    }
+
+
+@pytest.mark.utilities
+def test_get_journal_path(handle: dict) -> None:
+    path = journal.get_journal_path(handle)
+    assert os.path.dirname(path) == handle["fdp_config_dir"]
+    assert os.path.basename(path) == "finalise_0000-1111.journal"
+
+
+@pytest.mark.utilities
+def test_read_journal_missing(handle: dict) -> None:
+    assert journal.read_journal(journal.get_journal_path(handle)) == {}
+
+
+@pytest.mark.utilities
+def test_write_step(handle: dict) -> None:
+    path = journal.get_journal_path(handle)
+    journal.write_step(path, "output_0", "hash", "abc")
+    journal.write_step(path, None, "issues")
+    assert journal.read_journal(path) == {
+        "output_0": {"hash": "abc"},
+        None: {"issues": True},
+    }
+
+
+@pytest.mark.utilities
+def test_read_journal_partial_line(handle: dict) -> None:
+    path = journal.get_journal_path(handle)
+    journal.write_step(path, "output_0", "hash", "abc")
+    with open(path, "a") as data:
+        data.write('{"output": "output_0", "st')
+    assert journal.read_journal(path) == {"output_0": {"hash": "abc"}}
+
+
+@pytest.mark.utilities
+def test_load_handle(handle: dict) -> None:
+    path = journal.get_journal_path(handle)
+    journal.write_handle(path, handle)
+    assert journal.load_handle(path) == handle
+    journal.remove_journal(path)
+    assert not os.path.exists(path)
+    with pytest.raises(ValueError):
+        journal.load_handle(path)
+
+
+@pytest.mark.utilities
+def test_write_output(handle: dict) -> None:
+    path = journal.get_journal_path(handle)
+    journal.write_handle(path, handle)
+    handle["output"]["output_1"] = {"data_product": "test/other"}
+    journal.write_output(path, handle, "output_1")
+    journal.write_output(path, handle, "output_0")
+    assert journal.load_handle(path) == handle
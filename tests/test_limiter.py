@@ -0,0 +1,79 @@
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from data_pipeline_api import limiter
+
+
+def _acquire(
+    request_limiter: limiter.AdaptiveLimiter, timeout: Optional[float] = None
+) -> limiter.Permit:
+    permit = request_limiter.acquire(timeout=timeout)
+    assert permit is not None
+    return permit
+
+
+@pytest.mark.utilities
+def test_adaptive_limiter() -> None:
+    request_limiter = limiter.AdaptiveLimiter("test", max_requests=8)
+    assert request_limiter.limit == limiter.DEFAULT_INITIAL_REQUESTS
+    permits = [_acquire(request_limiter) for _ in range(4)]
+    assert request_limiter.acquire(timeout=0.01) is None
+
+    # Prompt answers grow the limit by about one per limit's worth
+    for permit in permits:
+        request_limiter.release(permit, True)
+    assert 4.5 < request_limiter.limit < 5.5
+
+    # Overlapping failures cut it once
+    limit = request_limiter.limit
+    permits = [_acquire(request_limiter) for _ in range(4)]
+    for permit in permits:
+        request_limiter.release(permit, False)
+    assert request_limiter.limit == limit * limiter.DECREASE_FACTOR
+    limit = request_limiter.limit
+    request_limiter.release(_acquire(request_limiter), None)
+    assert request_limiter.limit == limit
+    assert request_limiter.in_flight == 0
+
+    while request_limiter.limit > 1:
+        request_limiter.release(_acquire(request_limiter), False)
+    assert request_limiter.limit == 1
+
+
+@pytest.mark.utilities
+def test_adaptive_limiter_kinds() -> None:
+    request_limiter = limiter.AdaptiveLimiter("test", max_requests=8)
+
+    def _release(kind: str, latency: float) -> None:
+        permit = request_limiter.acquire(kind=kind)
+        assert permit is not None
+        permit.sent -= latency
+        request_limiter.release(permit, True)
+
+    # Requests are only slow compared with requests of their own kind
+    _release("get object", 0.01)
+    limit = request_limiter.limit
+    for _ in range(2):
+        _release("post object", 1.0)
+    assert request_limiter.limit > limit
+    limit = request_limiter.limit
+    _release("post object", 5.0)
+    assert request_limiter.limit == limit * limiter.DECREASE_FACTOR
+
+
+@pytest.mark.utilities
+@pytest.mark.skipif(limiter.fcntl is None, reason="needs flock")
+def test_adaptive_limiter_node(tmp_path: Path) -> None:
+    first = limiter.AdaptiveLimiter(
+        "test", node_max_requests=1, slot_directory=str(tmp_path)
+    )
+    second = limiter.AdaptiveLimiter(
+        "test", node_max_requests=1, slot_directory=str(tmp_path)
+    )
+    permit = _acquire(first)
+    assert second.acquire(timeout=0.05) is None
+    assert second.in_flight == 0
+    first.release(permit, True)
+    second.release(_acquire(second, timeout=1), True)
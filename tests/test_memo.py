@@ -0,0 +1,90 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import data_pipeline_api as pipeline
+from data_pipeline_api import fdp_utils, memo
+
+
+@pytest.fixture
+def handle(tmp_path: Path) -> dict:
+    return {
+        "yaml": {
+            "run_metadata": {
+                "local_data_registry_url": "https://test.com/api/",
+                "api_version": "1.0.0",
+                "write_data_store": str(tmp_path) + "/",
+                "latest_commit": "abc",
+                "memoise": True,
+            }
+        },
+        "code_run": "https://test.com/api/code_run/1/",
+        "code_run_uuid": "uuid",
+        "config_hash": "config",
+        "script_hash": "script",
+        "input": {
+            "input_0": {
+                "use_namespace": "testing",
+                "use_data_product": "test/csv",
+                "use_version": "0.0.1",
+                "use_component": None,
+                "hash": "input",
+            }
+        },
+        "output": {
+            "output_0": {
+                "data_product": "test/out",
+                "data_product_url": "https://test.com/api/data_product/1/",
+                "component_url": "https://test.com/api/object_component/1/",
+            }
+        },
+    }
+
+
+@pytest.mark.utilities
+def test_get_run_fingerprint(handle: dict) -> None:
+    fingerprint = memo.get_run_fingerprint(handle)
+    assert fingerprint == memo.get_run_fingerprint(handle)
+    handle["input"]["input_0"]["hash"] = "changed"
+    assert memo.get_run_fingerprint(handle) != fingerprint
+    handle["input"]["input_0"]["hash"] = "input"
+    handle["yaml"]["run_metadata"]["latest_commit"] = "def"
+    assert memo.get_run_fingerprint(handle) != fingerprint
+
+
+@pytest.mark.utilities
+def test_record_run(handle: dict, tmp_path: Path) -> None:
+    path = os.path.join(tmp_path, "out.csv")
+    memo.record_run(handle, {"output_0": {"placement": path}})
+    memo_path = memo.get_memo_path(handle, memo.get_run_fingerprint(handle))
+    assert os.path.exists(memo_path)
+    # The output has since been removed from the data store
+    assert memo.find_run(handle) is None
+
+
+@pytest.mark.utilities
+def test_find_memoised_outputs(
+    handle: dict, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Two components of one data product are written to two outputs
+    handle["output"]["output_1"] = dict(
+        handle["output"]["output_0"],
+        component_url="https://test.com/api/object_component/2/",
+    )
+    steps: dict = {}
+    for output in handle["output"]:
+        path = os.path.join(tmp_path, output + ".csv")
+        with open(path, "w") as data:
+            data.write(output)
+        steps[output] = {"placement": path}
+    memo.record_run(handle, steps)
+
+    monkeypatch.setattr(fdp_utils, "get_entity", lambda **kwargs: {})
+    assert pipeline.find_memoised_outputs(handle) == {
+        "test/out": [
+            os.path.join(tmp_path, "output_0.csv"),
+            os.path.join(tmp_path, "output_1.csv"),
+        ]
+    }
+    assert len(handle["memoised"]["outputs"]) == 2
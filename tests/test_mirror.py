@@ -0,0 +1,72 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from data_pipeline_api import mirror
+
+API = "https://test.com/api/"
+
+
+@pytest.mark.utilities
+def test_registry_mirror(tmp_path: Path) -> None:
+    path = os.path.join(tmp_path, "mirror.sqlite")
+    registry_mirror = mirror.RegistryMirror(path, API, max_age=None)
+    registry_mirror.add(
+        "data_product",
+        [
+            {
+                "url": API + "data_product/1/",
+                "name": "test/csv",
+                "version": "0.0.1",
+                "namespace": API + "namespace/2/",
+            },
+            {
+                "url": API + "data_product/3/",
+                "name": "test/csv",
+                "version": "0.0.2",
+                "namespace": API + "namespace/2/",
+            },
+        ],
+    )
+    registry_mirror.add(
+        "storage_root",
+        [{"url": API + "storage_root/1/", "root": "file:///", "local": True}],
+    )
+
+    found = registry_mirror.get_entry(
+        "data_product", {"name": "test/csv", "namespace": "2"}
+    )
+    assert [entry["version"] for entry in found] == ["0.0.1", "0.0.2"]
+    assert registry_mirror.get_entry("storage_root", {"local": "True"})
+    assert registry_mirror.get_entry("storage_root", {"local": False}) == []
+    assert registry_mirror.get_entry("data_product", {"id__gt": 1}) == []
+
+    # Entries are shared with other processes through the database
+    reopened = mirror.RegistryMirror(path, API, max_age=None)
+    entity = reopened.get_entity("data_product", 3)
+    assert entity is not None and entity["version"] == "0.0.2"
+    assert reopened.get_entity("data_product", 2) is None
+
+
+@pytest.mark.utilities
+def test_registry_mirror_socket(tmp_path: Path) -> None:
+    path = os.path.join(tmp_path, "mirror.sqlite")
+    registry_mirror = mirror.RegistryMirror(
+        path, "http+unix://%2Frun%2Fregistry.sock/api/", max_age=None
+    )
+    registry_mirror.add(
+        "data_product",
+        [
+            {
+                "url": "http://localhost/api/data_product/1/",
+                "name": "test/csv",
+                "version": "0.0.1",
+                "namespace": "http://localhost/api/namespace/2/",
+            }
+        ],
+    )
+    found = registry_mirror.get_entry(
+        "data_product", {"name": "test/csv", "namespace": "2"}
+    )
+    assert [entry["version"] for entry in found] == ["0.0.1"]
@@ -0,0 +1,262 @@
+import os
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+import yaml
+
+import data_pipeline_api as pipeline
+from data_pipeline_api import fdp_utils, journal, offline
+from data_pipeline_api.pipeline import _wait_for_commits
+
+WRITE = {
+    "data_product": "test/csv",
+    "description": "test csv file with simple data",
+    "file_type": "csv",
+    "use": {"version": "0.0.1"},
+}
+
+
+@pytest.fixture
+def config_yaml(tmp_path: Path) -> dict:
+    return {
+        "run_metadata": {
+            "local_data_registry_url": "https://test.com/api/",
+            "write_data_store": str(tmp_path) + "/",
+            "api_version": "1.0.0",
+            "offline": True,
+        }
+    }
+
+
+def _initialise(tmp_path: Path, write: list) -> dict:
+    config = {
+        "run_metadata": {
+            "description": "Offline run",
+            "local_data_registry_url": "https://test.com/api/",
+            "default_input_namespace": "testing",
+            "default_output_namespace": "testing",
+            "write_data_store": str(tmp_path / "datastore") + "/",
+            "local_repo": "./",
+            "script": "python3 py.test",
+            "public": True,
+            "latest_commit": "221bfe8b52bbfb3b2dbdc23037b7dd94b49aaa70",
+            "remote_repo": "https://github.com/FAIRDataPipeline/test",
+            "offline": True,
+        },
+        "write": write,
+    }
+    config_path = str(tmp_path / "config.yaml")
+    with open(config_path, "w") as data:
+        yaml.safe_dump(config, data)
+    script_path = str(tmp_path / "script.sh")
+    with open(script_path, "w") as data:
+        data.write("python3 py.test\n")
+    return pipeline.initialise("token", config_path, script_path)
+
+
+@pytest.mark.utilities
+def test_offline_registry(config_yaml: dict) -> None:
+    registry = offline.open_journal(config_yaml)
+    url = config_yaml["run_metadata"]["local_data_registry_url"]
+    assert url == registry.url
+    assert url.startswith(fdp_utils.OFFLINE_PREFIX)
+
+    user = fdp_utils.get_entry(url, "users", {"username": "admin"})[0]
+    author = fdp_utils.get_entry(
+        url, "user_author", {"user": fdp_utils.extract_id(user["url"])}
+    )[0]["author"]
+    assert fdp_utils.extract_id(author).startswith(offline.REF_PREFIX)
+
+    obj = fdp_utils.post_entry(
+        url, "object", {"authors": [author]}, token="token"
+    )
+    assert fdp_utils.post_entry(
+        url, "namespace", {"name": "testing"}, token="token"
+    ) == fdp_utils.post_entry(
+        url, "namespace", {"name": "testing"}, token="token"
+    )
+    component = fdp_utils.get_entry(
+        url,
+        "object_component",
+        {"object": fdp_utils.extract_id(obj["url"]), "whole_object": True},
+    )
+    assert [entry["url"] for entry in component] == obj["components"]
+    assert fdp_utils.get_entry(url, "namespace", {"name": "other"}) == []
+
+    reopened = offline.OfflineRegistry.load(registry.path)
+    assert reopened.get_entry("object", {"authors": author})[0] == obj
+    assert not os.path.exists(registry.path + offline.PROGRESS_SUFFIX)
+
+
+@pytest.mark.utilities
+def test_get_levels() -> None:
+    prefix = fdp_utils.OFFLINE_PREFIX + "journal/"
+    records = [
+        {"op": "post", "ref": 1, "endpoint": "namespace", "data": {}},
+        {"op": "lookup", "ref": 2, "endpoint": "users", "query": {}},
+        {
+            "op": "lookup",
+            "ref": 3,
+            "endpoint": "user_author",
+            "query": {"user": offline.REF_PREFIX + "2"},
+        },
+        {
+            "op": "field",
+            "ref": 4,
+            "of": prefix + "user_author/ref-3/",
+            "field": "author",
+        },
+        {
+            "op": "patch",
+            "ref": 5,
+            "url": prefix + "namespace/ref-1/",
+            "data": {},
+        },
+        {
+            "op": "patch",
+            "ref": 6,
+            "url": prefix + "namespace/ref-1/",
+            "data": {},
+        },
+    ]
+    levels = offline.get_levels(records, prefix)
+    assert [[record["ref"] for record in level] for level in levels] == [
+        [1, 2],
+        [3, 5],
+        [4, 6],
+    ]
+
+
+@pytest.mark.utilities
+def test_resume_finalise_after_placement(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    handle = _initialise(tmp_path, [WRITE])
+    path = pipeline.link_write(handle, "test/csv")
+    with open(path, "w") as data:
+        data.write("a,b\n1,2\n")
+
+    # The process dies after the output is placed, before it is journaled
+    def _write_step(
+        journal_path: str, output: str, step: str, value: object = True
+    ) -> None:
+        if step == "placement":
+            raise KeyboardInterrupt
+        write_step(journal_path, output, step, value)
+
+    write_step = journal.write_step
+    monkeypatch.setattr(journal, "write_step", _write_step)
+    with pytest.raises(KeyboardInterrupt):
+        pipeline.finalise("token", handle)
+    monkeypatch.undo()
+    assert not os.path.exists(path)
+
+    handle = pipeline.resume_finalise(
+        "token", journal.get_journal_path(handle)
+    )
+    assert handle["output"]["output_0"]["data_product_url"]
+
+
+@pytest.mark.utilities
+def test_resume_finalise_after_commit(tmp_path: Path) -> None:
+    handle = _initialise(tmp_path, [WRITE])
+    for content in ("a,b\n1,2\n", "a,b\n3,4\n"):
+        path = pipeline.link_write(handle, "test/csv")
+        with open(path, "w") as data:
+            data.write(content)
+        pipeline.commit_output("token", handle, path)
+        _wait_for_commits(handle)
+
+    # The process dies before finalise, the handle was journaled once
+    journal_path = journal.get_journal_path(handle)
+    with open(journal_path) as data:
+        assert data.read().count('"step": "handle"') == 1
+    assert journal.load_handle(journal_path)["code_run"] == handle["code_run"]
+    handle = pipeline.resume_finalise("token", journal_path)
+    assert len(handle["output"]) == 2
+    for output in handle["output"].values():
+        assert output["data_product_url"]
+    assert not os.path.exists(journal_path)
+
+
+@pytest.mark.utilities
+def test_resume_finalise_during_issues(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    handle = _initialise(tmp_path, [WRITE])
+    pipeline.raise_issue_with_config(handle, "first", 1)
+    pipeline.raise_issue_with_config(handle, "second", 2)
+
+    # The process dies after registering one of the issues
+    posted: List[str] = []
+    crash = True
+
+    def _post_entry(*args: Any, **kwargs: Any) -> dict:
+        if kwargs.get("endpoint") == "issue":
+            if crash and posted:
+                raise KeyboardInterrupt
+            posted.append(kwargs["data"]["description"])
+        return post_entry(*args, **kwargs)
+
+    post_entry = fdp_utils.post_entry
+    monkeypatch.setattr(fdp_utils, "post_entry", _post_entry)
+    monkeypatch.setattr(fdp_utils, "get_max_workers", lambda _: 1)
+    with pytest.raises(KeyboardInterrupt):
+        pipeline.finalise("token", handle)
+
+    crash = False
+    pipeline.resume_finalise("token", journal.get_journal_path(handle))
+    assert posted == ["first", "second"]
+
+
+@pytest.mark.utilities
+def test_resume_finalise_after_coderuns(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    handle = _initialise(tmp_path, [WRITE])
+
+    # The process dies after adding the code run to coderuns.txt
+    def _write_step(
+        journal_path: str, output: str, step: str, value: object = True
+    ) -> None:
+        if step == "coderuns":
+            raise KeyboardInterrupt
+        write_step(journal_path, output, step, value)
+
+    write_step = journal.write_step
+    monkeypatch.setattr(journal, "write_step", _write_step)
+    with pytest.raises(KeyboardInterrupt):
+        pipeline.finalise("token", handle)
+    monkeypatch.undo()
+
+    pipeline.resume_finalise("token", journal.get_journal_path(handle))
+    with open(os.path.join(handle["fdp_config_dir"], "coderuns.txt")) as data:
+        assert data.read().splitlines().count(handle["code_run_uuid"]) == 1
+
+
+@pytest.mark.utilities
+def test_finalise_offline_same_data_product(tmp_path: Path) -> None:
+    handle = _initialise(tmp_path, [WRITE])
+    for content in ("a,b\n1,2\n", "a,b\n3,4\n"):
+        path = pipeline.link_write(handle, "test/csv")
+        with open(path, "w") as data:
+            data.write(content)
+    pipeline.finalise("token", handle)
+    outputs = handle["output"].values()
+    assert len(outputs) == 2
+    assert len({output["data_product_url"] for output in outputs}) == 1
+
+
+@pytest.mark.utilities
+def test_finalise_offline_same_content(tmp_path: Path) -> None:
+    handle = _initialise(
+        tmp_path, [WRITE, dict(WRITE, data_product="test/copy")]
+    )
+    for data_product in ("test/csv", "test/copy"):
+        path = pipeline.link_write(handle, data_product)
+        with open(path, "w") as data:
+            data.write("a,b\n1,2\n")
+    pipeline.finalise("token", handle)
+    outputs = handle["output"].values()
+    assert len({output["data_product_url"] for output in outputs}) == 2
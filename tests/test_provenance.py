@@ -0,0 +1,69 @@
+import pytest
+
+from data_pipeline_api.provenance import ProvenanceGraph
+
+API = "https://test.com/api/"
+
+
+def url(endpoint: str, id: int) -> str:
+    return f"{API}{endpoint}/{id}/"
+
+
+@pytest.fixture
+def registry() -> dict:
+    # code_run 1 writes data_product 1, code_run 2 reads it and writes
+    # data_product 2, code_run 3 reads data_product 2 and writes 3
+    entries: dict = {}
+    for n in (1, 2, 3):
+        entries[url("data_product", n)] = {"object": url("object", n)}
+        entries[url("object", n)] = {
+            "components": [url("object_component", n)],
+            "data_products": [url("data_product", n)],
+        }
+        entries[url("object_component", n)] = {
+            "object": url("object", n),
+            "outputs_of": [url("code_run", n)],
+            "inputs_of": [url("code_run", n + 1)] if n < 3 else [],
+        }
+        entries[url("code_run", n)] = {
+            "inputs": [url("object_component", n - 1)] if n > 1 else [],
+            "outputs": [url("object_component", n)],
+        }
+    return entries
+
+
+@pytest.mark.utilities
+def test_provenance_graph(registry: dict) -> None:
+    graph = ProvenanceGraph()
+    graph.walk(url("data_product", 2), registry.__getitem__, depth=None)
+    assert len(graph) == 6
+    assert graph.ancestors(url("data_product", 2), "code_run") == [
+        url("code_run", 2),
+        url("code_run", 1),
+    ]
+    assert graph.ancestors(url("data_product", 2), "data_product") == [
+        url("data_product", 1)
+    ]
+    assert graph.descendants(url("object_component", 2), "data_product") == [
+        url("data_product", 3)
+    ]
+    assert graph.descendants(url("data_product", 3)) == []
+
+
+@pytest.mark.utilities
+def test_provenance_graph_depth(registry: dict) -> None:
+    graph = ProvenanceGraph()
+    graph.walk(
+        url("data_product", 3),
+        registry.__getitem__,
+        depth=1,
+        direction="ancestors",
+    )
+    assert url("code_run", 2) not in graph
+    assert graph.ancestors(url("data_product", 3), "data_product") == [
+        url("data_product", 2)
+    ]
+    with pytest.raises(ValueError):
+        graph.walk(
+            url("data_product", 3), registry.__getitem__, direction="up"
+        )
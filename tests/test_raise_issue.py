@@ -5,6 +5,7 @@ import pytest
 
 import data_pipeline_api as pipeline
 import data_pipeline_api.fdp_utils as fdp_utils
+from data_pipeline_api.raise_issue import ISSUE_FIELDS, IssueBuffer
 
 
 @pytest.fixture
@@ -221,3 +222,32 @@ def test_raise_issue_data_product_from_writes(
         "severity": 5,
         "group": "Problem with writing csv File : Test Issue # 4:5",
     }
+
+
+@pytest.mark.utilities
+def test_issue_buffer() -> None:
+    issues = IssueBuffer()
+    issue: dict = {field: None for field in ISSUE_FIELDS}
+    for severity in range(3):
+        issue.update(issue="bad", severity=severity, group={"path": "a"})
+        assert issues.append(**issue) == "issue_" + str(severity)
+    assert len(issues) == 3
+    assert list(issues) == ["issue_0", "issue_1", "issue_2"]
+    assert issues["issue_2"]["severity"] == 2
+    assert issues["issue_0"]["group"] == {"path": "a"}
+    assert "issue_3" not in issues
+    assert dict(IssueBuffer(issues)) == dict(issues)
+
+    # Issues are changed, added and removed as in a dictionary
+    issues["issue_0"]["severity"] = 5
+    assert issues["issue_0"]["severity"] == 5
+    issues["issue_4"] = dict(issue, severity=4)
+    assert list(issues) == ["issue_0", "issue_1", "issue_2", "issue_4"]
+    assert issues["issue_4"] == dict(issue, severity=4)
+    del issues["issue_1"]
+    assert list(issues) == ["issue_0", "issue_2", "issue_4"]
+    with pytest.raises(KeyError):
+        issues["issue_1"]
+    with pytest.raises(KeyError):
+        issues["other"] = issue
+    assert dict(IssueBuffer(issues)) == dict(issues)
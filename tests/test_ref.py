@@ -0,0 +1,24 @@
+import pytest
+
+from data_pipeline_api import ref
+
+API = "https://test.com/api/"
+
+
+@pytest.mark.utilities
+def test_parse() -> None:
+    object_ref = ref.parse(API + "object/5/")
+    assert object_ref.registry == API
+    assert object_ref.endpoint == "object"
+    assert object_ref.id == 5
+    assert object_ref.url == API + "object/5/"
+    assert ref.parse(API + "object/5/") is object_ref
+    assert ref.parse(API + "object/5") == object_ref
+    assert ref.Ref(API[:-1], "object", 5) == object_ref
+    assert ref.Ref(API, "object_component", 5) != object_ref
+    assert len({object_ref, ref.Ref(API, "object", 5)}) == 1
+    assert str(object_ref) == API + "object/5/"
+    with pytest.raises(ValueError):
+        ref.parse(API + "object/")
+    with pytest.raises(ValueError):
+        ref.parse("object")
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import numpy as np  # noqa: E402
+
+from data_pipeline_api.ext import seirs_ensemble  # noqa: E402
+
+
+@pytest.fixture
+def parameters() -> dict:
+    return seirs_ensemble.read_parameters(
+        os.path.join(
+            os.path.dirname(seirs_ensemble.__file__), "static_params_SEIRS.csv"
+        )
+    )
+
+
+@pytest.fixture
+def reference() -> np.ndarray:
+    return np.loadtxt(
+        os.path.join(
+            os.path.dirname(__file__),
+            "..",
+            "docs",
+            "examples",
+            "SEIRS_output.csv",
+        ),
+        delimiter=",",
+        skiprows=1,
+    )
+
+
+@pytest.mark.utilities
+def test_seirs_single(parameters: dict, reference: np.ndarray) -> None:
+    results = seirs_ensemble.seirs_single(parameters)
+    columns = ["time"] + list(seirs_ensemble.STATES)
+    assert np.allclose(
+        np.column_stack([results[column] for column in columns]), reference
+    )
+
+
+@pytest.mark.utilities
+def test_seirs_ensemble(parameters: dict, reference: np.ndarray) -> None:
+    ensemble: dict = seirs_ensemble.sample_parameters(parameters, 8, seed=0)
+    ensemble["beta"][0] = parameters["beta"]
+    ensemble["inv_gamma"][0] = parameters["inv_gamma"]
+    results = seirs_ensemble.seirs_ensemble(ensemble)
+    assert results["S"].shape == (8, 1001)
+    assert np.allclose(
+        np.column_stack(
+            [results["time"]]
+            + [results[state][0] for state in seirs_ensemble.STATES]
+        ),
+        reference,
+    )
+    member = {
+        key: value[5] if np.ndim(value) else value
+        for key, value in ensemble.items()
+    }
+    single = seirs_ensemble.seirs_single(member)
+    for state in seirs_ensemble.STATES:
+        assert np.allclose(results[state][5], single[state])
+
+
+@pytest.mark.utilities
+def test_write_ensemble(parameters: dict, tmp_path: str) -> None:
+    ensemble = seirs_ensemble.sample_parameters(parameters, 3, seed=0)
+    results = seirs_ensemble.seirs_ensemble(ensemble, timesteps=10)
+    path = os.path.join(tmp_path, "ensemble.npz")
+    seirs_ensemble.write_ensemble(path, results, ensemble)
+    with np.load(path) as data:
+        assert data["I"].shape == (3, 11)
+        assert np.array_equal(data["param_beta"], ensemble["beta"])
+        assert np.all(data["param_alpha"] == parameters["alpha"])
+    assert seirs_ensemble.member_names(3)[-1] == "member_2"
@@ -0,0 +1,114 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Any, Iterator
+from urllib.parse import quote
+
+import pytest
+import requests
+
+from data_pipeline_api import fdp_utils, transport
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Echoes the method, path, Host and body of each request"""
+
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.dumps(
+            {
+                "method": self.command,
+                "path": self.path,
+                "host": self.headers["Host"],
+                "body": self.rfile.read(length).decode(),
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PATCH = _respond
+
+    def address_string(self) -> str:
+        return "unix"
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def socket_path(tmp_path: Path) -> Iterator[str]:
+    if not hasattr(socket, "AF_UNIX"):
+        pytest.skip("needs Unix domain sockets")
+    path = os.path.join(tmp_path, "registry.sock")
+    server = _Server(path, _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.utilities
+def test_unix_socket_adapter(socket_path: str) -> None:
+    session = requests.Session()
+    session.mount(transport.UNIX_PREFIX, transport.UnixSocketAdapter())
+    url = transport.UNIX_PREFIX + quote(socket_path, safe="")
+    assert transport.get_socket_path(url) == socket_path
+
+    response = session.get(url + "/api/object/?name=test", timeout=5)
+    assert response.json() == {
+        "method": "GET",
+        "path": "/api/object/?name=test",
+        "host": transport.UNIX_HOST,
+        "body": "",
+    }
+    response = session.patch(url + "/api/object/1/", json={"a": 1})
+    assert response.json()["body"] == '{"a": 1}'
+
+    # Requests to a registry's http url are sent to its socket
+    session.mount(
+        "http://registry.invalid:8000/",
+        transport.UnixSocketAdapter(socket_path),
+    )
+    response = session.post(
+        "http://registry.invalid:8000/api/object/", json={}, timeout=5
+    )
+    assert response.json()["host"] == "registry.invalid:8000"
+    session.close()
+
+
+@pytest.mark.utilities
+def test_registry_socket_query(
+    socket_path: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(fdp_utils, "_SESSION", None)
+    monkeypatch.setattr(fdp_utils, "_REGISTRY_SOCKETS", {})
+    url = transport.UNIX_PREFIX + quote(socket_path, safe="") + "/api/"
+    fdp_utils.set_registry_socket(url)
+
+    # The registry gives its urls as it is addressed over the socket
+    query = {"storage_root": "http://localhost/api/storage_root/1/"}
+    query_url = fdp_utils._get_query_url(url, "storage_location", query)
+    response = fdp_utils.get_session().get(query_url, timeout=5)
+    assert response.json()["path"] == ("/api/storage_location/?storage_root=1")
+
+
+@pytest.mark.utilities
+def test_unix_socket_adapter_missing(tmp_path: Path) -> None:
+    session = requests.Session()
+    session.mount(transport.UNIX_PREFIX, transport.UnixSocketAdapter())
+    url = transport.UNIX_PREFIX + quote(str(tmp_path / "missing.sock"), "")
+    with pytest.raises(requests.ConnectionError):
+        session.get(url + "/api/", timeout=5)